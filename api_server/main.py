@@ -1,22 +1,54 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel, EmailStr, field_validator
-from typing import List, Optional, Dict, Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, ValidationError, field_validator
+from typing import Callable, List, Optional, Dict, Any
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from jose import jwt
 import os
+import asyncio
+import base64
 from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import motor.motor_asyncio
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from passlib.context import CryptContext
+from collections import Counter, OrderedDict
+import heapq
+import gzip
+import hashlib
 import json
+import mimetypes
+import re
+import threading
+import time
 
 # MCP 임포트
 from fastmcp import FastMCP
 
-app = FastAPI(title="Pensieve API", version="1.0.0")
+# 로컬 서버와 같은 검색 텍스트 처리 (이미지에는 mcp_server/text.py 만 복사한다)
+from mcp_server.text import bm25, estimate_tokens, idf, make_snippet, tokenize, truncate_to_tokens
+
+try:
+    import brotli
+except ImportError:  # 선택 의존성: 없으면 gzip 만 사용
+    brotli = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 큰 컬렉션은 인덱스 빌드가 오래 걸리므로 기다리지 않고 백그라운드에서 만든다
+    # (진행 상태는 /health 의 indexes 로 확인)
+    task = asyncio.create_task(ensure_indexes())
+    yield
+    if not task.done():
+        task.cancel()
+
+app = FastAPI(title="Pensieve API", version="1.0.0", lifespan=lifespan)
 
 # CORS 설정
 app.add_middleware(
@@ -25,12 +57,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # 환경 변수
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
+# 토큰의 uid 를 믿고 DB 조회 없이 인증 (삭제된 사용자의 토큰도 만료 전까지 유효해진다)
+JWT_TRUST_USER_ID = os.getenv("JWT_TRUST_USER_ID", "").lower() in ("1", "true", "yes")
+# 정적 파일: 개발 중에는 STATIC_DEV_RELOAD=1 로 바뀐 파일을 요청 때 다시 읽는다
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+STATIC_DEV_RELOAD = os.getenv("STATIC_DEV_RELOAD", "").lower() in ("1", "true", "yes")
+# bcrypt 해시/검증 스레드 수와 대기 한도 (넘으면 429)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = "pensieve"
 
@@ -40,10 +83,183 @@ db = client[DATABASE_NAME]
 users_collection = db.users
 conversations_collection = db.conversations
 
+# 시작할 때 만드는 인덱스: (컬렉션, 키, 옵션)
+# 목록/인증 쿼리가 컬렉션 전체를 훑지 않도록 user_id + 정렬 키 복합 인덱스를 둔다
+INDEXES = [
+    ("users", [("email", 1)], {"name": "email_unique", "unique": True}),
+    # _id 까지 넣어야 커서 페이지네이션의 (정렬 키, _id) 정렬을 인덱스만으로 처리한다
+    ("conversations", [("user_id", 1), ("created_at", -1), ("_id", -1)], {"name": "user_created_at_id"}),
+    ("conversations", [("user_id", 1), ("updated_at", -1), ("_id", -1)], {"name": "user_updated_at_id"}),
+]
+
+# "컬렉션.인덱스 이름" -> pending / building / ready / failed: <오류>
+index_status: Dict[str, str] = {}
+
+async def ensure_indexes():
+    """필요한 인덱스를 만들고 index_status 에 결과 기록 (이미 있으면 그대로 둔다)"""
+    collections = {"users": users_collection, "conversations": conversations_collection}
+    names = [f"{name}.{options['name']}" for name, _, options in INDEXES]
+    names.append(f"conversations.{TEXT_INDEX_NAME}")
+    for name in names:
+        index_status[name] = "pending"
+
+    for (collection_name, keys, options), name in zip(INDEXES, names):
+        index_status[name] = "building"
+        try:
+            await collections[collection_name].create_index(keys, **options)
+            index_status[name] = "ready"
+        except Exception as e:
+            # 예: 이메일이 중복된 기존 데이터가 있으면 unique 인덱스를 만들 수 없다
+            index_status[name] = f"failed: {e}"
+            print(f"인덱스 {name} 생성 실패: {e}")
+
+    index_status[names[-1]] = "building"
+    await ensure_text_index()
+    index_status[names[-1]] = "ready" if text_index_ready else "failed: regex fallback"
+
 # 보안
 security = HTTPBearer()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+class PasswordHasher:
+    """bcrypt 를 이벤트 루프 밖의 스레드 풀에서 실행 (bcrypt 는 계산 중 GIL 을 놓는다)
+
+    실행 중이거나 대기 중인 작업이 max_pending 개면 바로 429 로 거절해
+    로그인이 몰려도 대기열이 끝없이 길어지지 않게 한다.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # 스레드 풀에 넣었고 아직 끝나지 않은 작업 수 (_lock 으로 보호)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self._lock = threading.Lock()
+
+    def _timed(self, queued_at: float, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self.completed += 1
+                self.total_wait += started - queued_at
+                self.total_run += finished - started
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many authentication requests, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        with self._lock:
+            self.pending += 1
+        future = self.executor.submit(self._timed, time.perf_counter(), func, *args)
+        # 기다리던 요청이 취소돼도 스레드의 작업은 계속되므로 작업이 끝날 때 줄인다
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, password, hashed_password)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = self.completed
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / completed * 1000, 2) if completed else 0.0,
+                "avg_run_ms": round(self.total_run / completed * 1000, 2) if completed else 0.0
+            }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+# 인증된 사용자 캐시
+class UserCache:
+    """이메일 -> 사용자 문서의 TTL + LRU 캐시 (비밀번호 해시는 보관하지 않는다)"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, email: str) -> Optional[dict]:
+        entry = self._entries.get(email)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[email]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, email: str, user: dict) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        user = {key: value for key, value in user.items() if key != "hashed_password"}
+        self._entries[email] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, email: str) -> None:
+        """사용자 정보가 바뀌면 호출"""
+        self._entries.pop(email, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "ttl_seconds": self.ttl,
+            "trust_token_user_id": JWT_TRUST_USER_ID
+        }
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+
+async def load_user(email: str) -> Optional[dict]:
+    """캐시를 거쳐 사용자 조회 (없는 사용자는 캐시하지 않는다)"""
+    user = user_cache.get(email)
+    if user is None:
+        user = await users_collection.find_one({"email": email}, {"hashed_password": 0})
+        if user is not None:
+            user_cache.put(email, user)
+    return user
+
+async def resolve_user(payload: dict) -> Optional[dict]:
+    """검증된 토큰 payload 의 사용자"""
+    email = payload.get("sub")
+    if email is None:
+        return None
+    if JWT_TRUST_USER_ID and payload.get("uid"):
+        return {"_id": payload["uid"], "email": email}
+    return await load_user(email)
+
 # 모델
 class UserCreate(BaseModel):
     email: EmailStr  # 이메일 형식 검증
@@ -73,6 +289,22 @@ class ConversationCreate(BaseModel):
 class ConversationUpdate(BaseModel):
     messages: List[Message]
 
+class ConversationBatchItem(ConversationCreate):
+    id: Optional[str] = None  # 주면 대화 ID 로 사용 (Idempotency-Key 와 같은 형식)
+
+class ConversationBatchCreate(BaseModel):
+    conversations: List[Dict[str, Any]]
+
+class ConversationBatchLoad(BaseModel):
+    ids: List[str]
+
+class AppendItem(BaseModel):
+    conversation_id: str
+    messages: List[Message]
+
+class AppendBatch(BaseModel):
+    items: List[Dict[str, Any]]
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -100,7 +332,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid authentication credentials",
         )
     
-    user = await users_collection.find_one({"email": email})
+    user = await resolve_user(payload)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -108,6 +340,783 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     return user
 
+# 검색 랭킹 (BM25)
+# 메시지 하나를 문서로 보고 점수를 매긴 뒤, 대화 점수는
+# 가장 잘 맞는 메시지 점수 + METADATA_WEIGHT x 제목/태그 점수
+# 토큰화, BM25, 스니펫은 로컬 서버와 같은 구현 (mcp_server/text.py)
+METADATA_WEIGHT = 2.0
+
+def metadata_search_text(metadata: Optional[Dict[str, Any]]) -> str:
+    """메타데이터 중 검색 대상인 제목과 태그"""
+    metadata = metadata or {}
+    tags = metadata.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tags]
+    return " ".join([str(metadata.get("title") or "")] + [str(tag) for tag in tags])
+
+def term_frequencies(text: str, terms: List[str]) -> tuple:
+    """검색어별 빈도 (토큰 접두어 일치)와 문서 길이"""
+    tokens = tokenize(text)
+    tf = {}
+    for term in terms:
+        count = sum(1 for token in tokens if token.startswith(term))
+        if count:
+            tf[term] = count
+    return tf, len(tokens)
+
+def search_filter(user_id: str, terms: List[str]) -> dict:
+    """검색어 중 하나라도 메시지나 제목/태그에 있는 대화"""
+    pattern = "|".join(re.escape(term) for term in terms)
+    return {
+        "user_id": user_id,
+        "$or": [
+            {"messages.content": {"$regex": pattern, "$options": "i"}},
+            {"metadata.title": {"$regex": pattern, "$options": "i"}},
+            {"metadata.tags": {"$regex": pattern, "$options": "i"}},
+        ]
+    }
+
+async def rank_conversations(candidates, terms: List[str], limit: int) -> List[tuple]:
+    """후보 대화를 BM25 로 점수 매겨 상위 limit 개의 (점수, 대화 ID, 메시지 위치) 반환
+
+    후보는 한 번만 스트리밍하며 일치한 메시지의 단어 빈도만 보관하고,
+    점수 계산은 크기 limit 의 힙으로 하므로 대화 본문은 메모리에 쌓이지 않는다.
+    IDF 와 평균 길이는 후보 대화 전체를 기준으로 계산한다.
+    """
+    stats = {"content": [0, 0], "metadata": [0, 0]}
+    df = {"content": Counter(), "metadata": Counter()}
+    matched = []
+
+    async for conv in candidates:
+        messages = []
+        for index, message in enumerate(conv.get("messages", [])):
+            tf, length = term_frequencies(message.get("content", ""), terms)
+            stats["content"][0] += 1
+            stats["content"][1] += length
+            if tf:
+                df["content"].update(tf.keys())
+                messages.append((index, tf, length))
+
+        metadata_tf, metadata_length = term_frequencies(metadata_search_text(conv.get("metadata")), terms)
+        stats["metadata"][0] += 1
+        stats["metadata"][1] += metadata_length
+        df["metadata"].update(metadata_tf.keys())
+
+        if messages or metadata_tf:
+            matched.append((conv["_id"], messages, (metadata_tf, metadata_length)))
+
+    def field_score(field: str, tf: Dict[str, int], length: int) -> float:
+        doc_count, total_length = stats[field]
+        avgdl = (total_length / doc_count) or 1.0
+        return sum(bm25(freq, length, idf(doc_count, df[field][term]), avgdl) for term, freq in tf.items())
+
+    top = []
+    for conversation_id, messages, (metadata_tf, metadata_length) in matched:
+        best_index, best_score = None, 0.0
+        for index, tf, length in messages:
+            score = field_score("content", tf, length)
+            if score > best_score:
+                best_index, best_score = index, score
+        item = (best_score + METADATA_WEIGHT * field_score("metadata", metadata_tf, metadata_length), conversation_id, best_index)
+        if len(top) < limit:
+            heapq.heappush(top, item)
+        elif item[:2] > top[0][:2]:
+            heapq.heapreplace(top, item)
+
+    return sorted(top, key=lambda item: item[:2], reverse=True)
+
+# MongoDB 텍스트 인덱스 (컬렉션당 하나만 만들 수 있다)
+# 한국어 등 형태소 분석이 없는 언어도 그대로 매칭되도록 언어는 "none"
+TEXT_INDEX_NAME = "conversation_text"
+TEXT_INDEX_WEIGHTS = {"messages.content": 1, "metadata.title": 3, "metadata.tags": 3}
+# 텍스트 검색 결과마다 스니펫 후보로 가져올 일치 메시지 수
+MATCHED_MESSAGES = 3
+
+# 텍스트 인덱스를 만들 수 없으면 (다른 텍스트 인덱스가 있거나 지원하지 않는 서버)
+# 정규식 후보 + BM25 순위로 검색한다
+text_index_ready = False
+
+async def ensure_text_index():
+    global text_index_ready
+    try:
+        await conversations_collection.create_index(
+            [(field, "text") for field in TEXT_INDEX_WEIGHTS],
+            name=TEXT_INDEX_NAME,
+            weights=TEXT_INDEX_WEIGHTS,
+            default_language="none",
+        )
+        text_index_ready = True
+    except Exception as e:
+        # 이전에 다른 이름/필드로 만든 텍스트 인덱스가 있으면 그대로 사용
+        try:
+            indexes = await conversations_collection.index_information()
+        except Exception:
+            indexes = {}
+        text_index_ready = any(
+            kind == "text" for index in indexes.values() for _, kind in index.get("key", [])
+        )
+        if not text_index_ready:
+            print(f"텍스트 인덱스를 만들 수 없어 정규식 검색을 사용합니다: {e}")
+
+async def text_search(user_id: str, terms: List[str], limit: int) -> List[Dict[str, Any]]:
+    """텍스트 인덱스로 textScore 순 상위 limit 개 검색
+
+    메시지 본문 전체 대신 검색어가 들어간 메시지 몇 개만 받아와 스니펫을 만든다.
+    $search 에는 원래 검색어 대신 토큰을 넘긴다 ("-단어" 나 "\"구절\"" 이 제외/구절 연산자가 되지 않게).
+    """
+    pattern = "|".join(re.escape(term) for term in terms)
+    messages = {"$ifNull": ["$messages", []]}
+    pipeline = [
+        {"$match": {"user_id": user_id, "$text": {"$search": " ".join(terms)}}},
+        {"$sort": {"score": {"$meta": "textScore"}}},
+        {"$limit": limit},
+        {"$project": {
+            "metadata": 1,
+            "created_at": 1,
+            "score": {"$meta": "textScore"},
+            "updated_at": 1,
+            "message_count": {"$ifNull": ["$message_count", {"$size": messages}]},
+            "matched_messages": {"$slice": [
+                {"$filter": {
+                    "input": messages,
+                    "as": "message",
+                    "cond": {"$regexMatch": {"input": "$$message.content", "regex": pattern, "options": "i"}}
+                }},
+                MATCHED_MESSAGES
+            ]}
+        }}
+    ]
+
+    results = []
+    async for conv in conversations_collection.aggregate(pipeline):
+        result = {
+            "id": conv["_id"],
+            "metadata": conv.get("metadata", {}),
+            "created_at": str(conv["created_at"]),
+            "updated_at": str(conv.get("updated_at") or conv["created_at"]),
+            "message_count": conv.get("message_count", 0),
+            "score": round(conv.get("score", 0.0), 4)
+        }
+        matched = conv.get("matched_messages") or []
+        if matched:
+            # 검색어가 가장 많이 나오는 메시지로 스니펫을 만든다
+            best = max(matched, key=lambda message: sum(term_frequencies(message.get("content", ""), terms)[0].values()))
+            result["matched_message"] = best
+            result["snippet"] = make_snippet(best.get("content", ""), terms)
+        results.append(result)
+    return results
+
+async def search_user_conversations(user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+    """사용자 대화를 검색해 점수 순 결과 반환 (REST 와 MCP 도구가 함께 사용)"""
+    terms = sorted(set(tokenize(query)))
+    if not terms or limit <= 0:
+        return []
+
+    if text_index_ready:
+        return await text_search(user_id, terms, limit)
+
+    candidates = conversations_collection.find(
+        search_filter(user_id, terms),
+        {"messages.content": 1, "metadata": 1}
+    )
+    top = await rank_conversations(candidates, terms, limit)
+
+    # 상위 대화만 본문을 가져와 스니펫을 만든다
+    docs = {}
+    async for conv in conversations_collection.find({"_id": {"$in": [item[1] for item in top]}, "user_id": user_id}):
+        docs[conv["_id"]] = conv
+
+    results = []
+    for score, conversation_id, message_index in top:
+        conv = docs.get(conversation_id)
+        if conv is None:
+            continue
+        messages = conv.get("messages", [])
+        result = {
+            "id": conv["_id"],
+            "metadata": conv.get("metadata", {}),
+            "created_at": str(conv["created_at"]),
+            "updated_at": str(conv.get("updated_at") or conv["created_at"]),
+            "message_count": len(messages),
+            "score": round(score, 4)
+        }
+        if message_index is not None and message_index < len(messages):
+            result["matched_message"] = messages[message_index]
+            result["snippet"] = make_snippet(messages[message_index].get("content", ""), terms)
+        results.append(result)
+    return results
+
+# 토큰 예산 맥락 조회
+# 검색으로 고른 대화에서 검색어가 든 메시지만 위치와 함께 받아와 BM25 로 점수를 매기고,
+# 점수 순으로 근사 토큰 예산이 찰 때까지 담는다. 대화 본문 전체는 읽어 오지 않는다.
+CONTEXT_CONVERSATIONS = 20
+CONTEXT_CANDIDATES = 500
+# 메시지마다 역할/구분자에 드는 토큰
+MESSAGE_OVERHEAD_TOKENS = 4
+# 남은 예산이 이보다 작으면 긴 메시지를 잘라 넣지 않는다
+MIN_TRUNCATED_TOKENS = 32
+
+async def retrieve_context(user_id: str, query: str, max_tokens: int = 2000) -> Dict[str, Any]:
+    """검색어와 관련된 메시지를 여러 대화에서 골라 토큰 예산 안에 묶음
+
+    대화는 가장 잘 맞는 메시지 순서로, 대화 안의 메시지는 원래 순서로 돌려준다.
+    """
+    result = {"query": query, "max_tokens": max_tokens, "used_tokens": 0, "skipped": 0, "conversations": []}
+    terms = sorted(set(tokenize(query)))
+    if not terms or max_tokens <= 0:
+        return result
+
+    ranked = await search_user_conversations(user_id, query, CONTEXT_CONVERSATIONS)
+    conversations = {conv["id"]: (rank, conv) for rank, conv in enumerate(ranked)}
+    if not conversations:
+        return result
+
+    pattern = "|".join(re.escape(term) for term in terms)
+    pipeline = [
+        {"$match": {"_id": {"$in": list(conversations)}, "user_id": user_id}},
+        {"$project": {"messages": 1}},
+        {"$unwind": {"path": "$messages", "includeArrayIndex": "index"}},
+        {"$match": {"messages.content": {"$regex": pattern, "$options": "i"}}},
+        {"$limit": CONTEXT_CANDIDATES},
+        {"$project": {"index": 1, "role": "$messages.role", "content": "$messages.content"}}
+    ]
+    candidates = []
+    df = Counter()
+    total_length = 0
+    async for doc in conversations_collection.aggregate(pipeline):
+        tf, length = term_frequencies(doc.get("content") or "", terms)
+        df.update(tf.keys())
+        total_length += length
+        candidates.append((doc, tf, length))
+
+    # 후보 메시지 안에서 IDF 와 평균 길이를 계산한다
+    doc_count = len(candidates)
+    avgdl = (total_length / doc_count) if doc_count and total_length else 1.0
+    scored = []
+    for doc, tf, length in candidates:
+        score = sum(bm25(freq, length, idf(doc_count, df[term]), avgdl) for term, freq in tf.items())
+        scored.append((-score, conversations[doc["_id"]][0], int(doc["index"]), doc))
+    scored.sort(key=lambda item: item[:3])
+
+    packed: Dict[str, Dict[str, Any]] = {}
+    for negative_score, _, index, doc in scored:
+        remaining = max_tokens - result["used_tokens"]
+        content = doc.get("content") or ""
+        tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        item = {"index": index, "role": doc.get("role"), "content": content, "score": round(-negative_score, 4)}
+        if tokens > remaining:
+            # 너무 긴 메시지는 남은 예산이 넉넉하면 검색어 주변만 잘라 넣는다
+            if remaining - MESSAGE_OVERHEAD_TOKENS < MIN_TRUNCATED_TOKENS:
+                result["skipped"] += 1
+                continue
+            item["content"] = truncate_to_tokens(content, terms, remaining - MESSAGE_OVERHEAD_TOKENS)
+            item["truncated"] = True
+            tokens = estimate_tokens(item["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+        result["used_tokens"] += tokens
+        entry = packed.get(doc["_id"])
+        if entry is None:
+            conv = conversations[doc["_id"]][1]
+            entry = packed[doc["_id"]] = {
+                "id": doc["_id"],
+                "metadata": conv.get("metadata", {}),
+                "created_at": conv.get("created_at"),
+                "messages": []
+            }
+        entry["messages"].append(item)
+
+    for entry in packed.values():
+        entry["messages"].sort(key=lambda item: item["index"])
+    result["conversations"] = list(packed.values())
+    return result
+
+# 대화 요약
+# 목록에서 메시지 배열을 읽지 않도록 메시지 수와 첫 사용자 메시지 미리보기를 문서에 함께 저장한다
+PREVIEW_CHARS = 200
+SUMMARY_PROJECTION = {"metadata": 1, "created_at": 1, "updated_at": 1, "message_count": 1, "preview": 1}
+
+# 메시지 추가 요청의 Idempotency-Key 를 대화마다 최근 몇 개까지 기억할지
+APPLIED_KEYS_KEPT = 100
+IDEMPOTENCY_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+def check_idempotency_key(key: Optional[str]) -> Optional[str]:
+    if key is not None and not IDEMPOTENCY_KEY_RE.match(key):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Idempotency-Key must be 8-128 characters of [A-Za-z0-9_-]"
+        )
+    return key
+
+def message_preview(messages: list) -> str:
+    """첫 사용자 메시지의 앞부분 (객체가 아닌 메시지는 건너뛰고, 문자열이 아닌 내용은 문자열로)"""
+    for message in messages:
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = message.get("content")
+            if content is None:
+                return ""
+            if not isinstance(content, str):
+                content = json.dumps(content, ensure_ascii=False, default=str)
+            return content[:PREVIEW_CHARS]
+    return ""
+
+def summary_fields(messages: list) -> dict:
+    """메시지 목록으로 만드는 요약 필드 (저장/덮어쓰기 때 함께 $set)"""
+    return {"message_count": len(messages), "preview": message_preview(messages)}
+
+async def push_messages(conversation_id: str, user_id: str, messages: list, idempotency_key: Optional[str] = None) -> bool:
+    """대화에 메시지를 추가하고 요약 필드 갱신 (대화가 없으면 False)
+
+    idempotency_key 가 이미 적용된 키면 다시 추가하지 않고 성공으로 본다.
+    """
+    query = {"_id": conversation_id, "user_id": user_id}
+    update = {
+        "$push": {"messages": {"$each": messages}},
+        "$set": {"updated_at": datetime.utcnow()}
+    }
+    if idempotency_key:
+        query["applied_keys"] = {"$ne": idempotency_key}
+        update["$push"]["applied_keys"] = {"$each": [idempotency_key], "$slice": -APPLIED_KEYS_KEPT}
+
+    result = await conversations_collection.update_one(
+        {**query, "message_count": {"$exists": True}},
+        {**update, "$inc": {"message_count": len(messages)}}
+    )
+    if result.matched_count == 0:
+        # 요약 필드가 없는 예전 문서는 다음 목록 조회 때 fill_summaries 가 계산한다
+        result = await conversations_collection.update_one(query, update)
+        if result.matched_count == 0:
+            # 없는 대화거나, 이미 적용된 키로 다시 보낸 요청
+            return bool(idempotency_key) and await conversations_collection.find_one(
+                {"_id": conversation_id, "user_id": user_id, "applied_keys": idempotency_key}, {"_id": 1}
+            ) is not None
+        return True
+
+    preview = message_preview(messages)
+    if preview:
+        # 아직 사용자 메시지가 없던 대화면 미리보기 채우기
+        await conversations_collection.update_one(
+            {"_id": conversation_id, "user_id": user_id, "preview": ""},
+            {"$set": {"preview": preview}}
+        )
+    return True
+
+async def fill_summaries(docs: List[dict]) -> None:
+    """요약 필드가 없는 예전 문서는 메시지를 한 번 읽어 계산하고 저장해 둔다"""
+    missing = [doc["_id"] for doc in docs if "message_count" not in doc]
+    if not missing:
+        return
+    summaries = {}
+    async for conv in conversations_collection.find({"_id": {"$in": missing}}, {"messages": 1}):
+        summaries[conv["_id"]] = summary_fields(conv.get("messages", []))
+        await conversations_collection.update_one({"_id": conv["_id"]}, {"$set": summaries[conv["_id"]]})
+    for doc in docs:
+        doc.update(summaries.get(doc["_id"], {}))
+
+def conversation_summary(conv: dict) -> dict:
+    return {
+        "id": str(conv["_id"]),
+        "metadata": conv.get("metadata", {}),
+        "created_at": conv.get("created_at"),
+        "updated_at": conv.get("updated_at"),
+        "message_count": conv.get("message_count", 0),
+        "preview": conv.get("preview", "")
+    }
+
+# 조건부 GET (ETag / If-None-Match)
+# 대화는 수정될 때마다 updated_at 이 바뀌므로 (id, updated_at, 메시지 수) 로 ETag 를 만들고,
+# If-None-Match 가 있으면 본문을 읽기 전에 이 필드만 조회해 바뀌지 않았으면 304 로 끝낸다.
+VALIDATOR_PROJECTION = {"updated_at": 1, "message_count": 1}
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+def conversation_etag(conv: dict) -> str:
+    updated_at = conv.get("updated_at")
+    stamp = updated_at.isoformat() if isinstance(updated_at, datetime) else str(updated_at)
+    digest = hashlib.sha256(f"{conv['_id']}|{stamp}|{conv.get('message_count')}".encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+def payload_etag(payload: Any) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return f'W/"{hashlib.sha256(body.encode()).hexdigest()[:32]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 비교 (약한 비교)"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    )
+
+# 목록 페이지네이션
+# 커서는 마지막 항목의 (정렬 키 값, _id) 를 담은 불투명한 문자열이다.
+# 다음 페이지는 그보다 뒤에 오는 항목만 인덱스에서 찾으므로 깊은 페이지도 느려지지 않는다.
+# offset 은 호환용으로 남겨 두지만 건너뛴 만큼 읽어야 한다.
+LIST_SORT_KEYS = ("created_at", "updated_at")
+
+def encode_cursor(sort: str, conv: dict) -> str:
+    value = conv.get(sort)
+    payload = {"s": sort, "v": value.isoformat() if value is not None else None, "id": conv["_id"]}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """커서에서 (정렬 키 값, _id) 를 꺼냄 (잘못된 커서는 400)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["s"] != sort:
+            raise ValueError("cursor was issued for a different sort")
+        value = datetime.fromisoformat(payload["v"]) if payload["v"] is not None else None
+        return value, str(payload["id"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def after_cursor(sort: str, value, conversation_id: str) -> dict:
+    """내림차순 (sort, _id) 에서 커서 뒤에 오는 대화 조건"""
+    if value is None:
+        # 정렬 키가 없는 대화는 맨 뒤에 모여 있다
+        return {sort: None, "_id": {"$lt": conversation_id}}
+    return {"$or": [
+        {sort: {"$lt": value}},
+        {sort: value, "_id": {"$lt": conversation_id}},
+        {sort: None},
+    ]}
+
+async def list_user_conversations(
+    user_id: str,
+    limit: int,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    sort: str = "created_at"
+) -> tuple:
+    """사용자 대화 요약을 최신순으로 한 페이지 조회해 (대화 목록, next_cursor) 반환
+
+    메시지 배열은 읽지 않는다 (SUMMARY_PROJECTION).
+    cursor 가 있으면 offset 은 무시한다. 마지막 페이지면 next_cursor 는 None.
+    """
+    if sort not in LIST_SORT_KEYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"sort must be one of {', '.join(LIST_SORT_KEYS)}"
+        )
+    if limit <= 0:
+        return [], None
+
+    query = {"user_id": user_id}
+    if cursor:
+        query.update(after_cursor(sort, *decode_cursor(cursor, sort)))
+        offset = 0
+
+    # 한 개 더 읽어 다음 페이지가 있는지 확인
+    docs = await conversations_collection.find(query, SUMMARY_PROJECTION).sort(
+        [(sort, -1), ("_id", -1)]
+    ).skip(max(offset, 0)).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(sort, docs[-1])
+    await fill_summaries(docs)
+    return docs, next_cursor
+
+# 메시지 범위 조회
+# 아주 긴 대화는 메시지 배열 전체를 읽지 않고 $slice 로 필요한 구간만 조각씩 읽는다.
+# 범위는 offset/limit (앞에서부터), last (마지막 N 개), max_bytes (직렬화 크기 예산) 로 고르고,
+# 뒤에 메시지가 더 있으면 다음 구간을 가리키는 next_cursor 를 돌려준다.
+MESSAGE_CHUNK = 200  # 한 번에 읽을 메시지 수 (스트리밍/바이트 예산)
+
+def encode_message_cursor(conversation_id: str, offset: int) -> str:
+    payload = {"c": conversation_id, "o": offset}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_message_cursor(cursor: str, conversation_id: str) -> int:
+    """커서에서 다음 메시지 위치를 꺼냄 (다른 대화의 커서나 잘못된 커서는 400)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["c"] != conversation_id:
+            raise ValueError("cursor was issued for a different conversation")
+        return max(int(payload["o"]), 0)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def message_size(message: Any) -> int:
+    return len(json.dumps(message, default=str, ensure_ascii=False).encode())
+
+async def read_messages(query: dict, start: int, count: int) -> List[dict]:
+    """대화의 messages[start:start + count] 만 읽기"""
+    if count <= 0:
+        return []
+    docs = await conversations_collection.aggregate([
+        {"$match": query},
+        {"$project": {"_id": 0, "messages": {"$slice": [{"$ifNull": ["$messages", []]}, start, count]}}}
+    ]).to_list(length=1)
+    return docs[0]["messages"] if docs else []
+
+async def conversation_header(query: dict) -> Optional[dict]:
+    """메시지 배열을 뺀 대화 문서 (message_count 는 항상 채운다)"""
+    conv = await conversations_collection.find_one(query, {"messages": 0})
+    if conv is not None and "message_count" not in conv:
+        # 요약 필드가 없는 예전 문서
+        docs = await conversations_collection.aggregate([
+            {"$match": query},
+            {"$project": {"count": {"$size": {"$ifNull": ["$messages", []]}}}}
+        ]).to_list(length=1)
+        conv["message_count"] = docs[0]["count"] if docs else 0
+    return conv
+
+def range_requested(*params) -> bool:
+    return any(param is not None for param in params)
+
+async def load_message_range(
+    user_id: str,
+    conversation_id: str,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    last: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Optional[dict]:
+    """대화의 메시지 일부만 불러오기 (대화가 없으면 None)
+
+    cursor 가 있으면 offset 대신 커서 위치부터 읽는다. last 는 offset/limit 보다 우선하며,
+    max_bytes 를 넘기 전까지 (적어도 메시지 하나는) 담는다. last 와 함께 쓰면 최신 메시지부터 채운다.
+    """
+    if any(value is not None and value < 0 for value in (offset, limit, last, max_bytes)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="offset, limit, last and max_bytes must not be negative"
+        )
+    query = {"_id": conversation_id, "user_id": user_id}
+    conv = await conversation_header(query)
+    if conv is None:
+        return None
+
+    total = conv["message_count"]
+    if cursor:
+        offset = decode_message_cursor(cursor, conversation_id)
+    if last is not None:
+        start, end = max(total - last, 0), total
+    else:
+        start = min(offset or 0, total)
+        end = total if limit is None else min(start + limit, total)
+
+    # 조각씩 읽으며 바이트 예산을 채운다 (last 면 뒤에서부터)
+    from_end = last is not None
+    messages: List[dict] = []
+    used = 0
+    low, high = start, end
+    while low < high:
+        count = min(MESSAGE_CHUNK, high - low)
+        chunk = await read_messages(query, high - count if from_end else low, count)
+        if not chunk:
+            break
+        full = False
+        for message in (reversed(chunk) if from_end else chunk):
+            size = message_size(message)
+            if max_bytes is not None and messages and used + size > max_bytes:
+                full = True
+                break
+            messages.append(message)
+            used += size
+            if from_end:
+                high -= 1
+            else:
+                low += 1
+        if full:
+            break
+    if from_end:
+        messages.reverse()
+        start = high
+    else:
+        end = low
+
+    conv["messages"] = messages
+    conv["range"] = {"start": start, "end": end, "total": total}
+    conv["next_cursor"] = encode_message_cursor(conversation_id, end) if end < total else None
+    return conv
+
+async def stream_messages(query: dict, conv: dict, start: int, end: int):
+    """대화를 JSON 으로 조금씩 내보냄 (메시지는 MESSAGE_CHUNK 개씩만 메모리에 둔다)"""
+    header = jsonable_encoder({key: value for key, value in conv.items() if key != "messages"})
+    header["range"] = {"start": start, "end": end, "total": conv["message_count"]}
+    yield json.dumps(header, ensure_ascii=False)[:-1] + ', "messages": ['
+    first = True
+    for position in range(start, end, MESSAGE_CHUNK):
+        chunk = await read_messages(query, position, min(MESSAGE_CHUNK, end - position))
+        if not chunk:
+            break
+        body = ", ".join(json.dumps(message, default=str, ensure_ascii=False) for message in chunk)
+        yield body if first else ", " + body
+        first = False
+    yield "]}"
+
+# 일괄 처리
+# 항목마다 상태를 돌려주며, 잘못된 항목이 있어도 나머지는 처리한다
+MAX_BATCH_ITEMS = 100
+
+def validation_message(e: ValidationError) -> str:
+    """검증 오류를 항목별 결과에 넣을 한 줄 메시지로"""
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+def check_batch_size(items: list) -> None:
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_ITEMS} items per batch"
+        )
+
+async def save_many(user_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """대화 여러 개를 insert_many 한 번으로 저장"""
+    check_batch_size(items)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    docs, positions = [], []
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+        try:
+            conversation = ConversationBatchItem.model_validate(item)
+            check_idempotency_key(conversation.id)
+        except HTTPException as e:
+            results[index] = {"index": index, "status": "invalid", "error": e.detail}
+            continue
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "invalid", "error": validation_message(e)}
+            continue
+        messages = [msg.dict() for msg in conversation.messages]
+        docs.append({
+            "_id": conversation.id or str(uuid4()),
+            "user_id": user_id,
+            "messages": messages,
+            "metadata": conversation.metadata or {},
+            **summary_fields(messages),
+            "created_at": now,
+            "updated_at": now
+        })
+        positions.append(index)
+
+    write_errors = {}
+    if docs:
+        try:
+            await conversations_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            write_errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+
+    # 이미 있는 ID 는 같은 사용자의 것이면 이전에 저장된 것으로 본다
+    duplicates = [docs[i]["_id"] for i, error in write_errors.items() if error.get("code") == 11000]
+    owned = set()
+    if duplicates:
+        async for conv in conversations_collection.find({"_id": {"$in": duplicates}, "user_id": user_id}, {"_id": 1}):
+            owned.add(conv["_id"])
+
+    for position, (index, doc) in enumerate(zip(positions, docs)):
+        error = write_errors.get(position)
+        if error is None:
+            results[index] = {"index": index, "id": doc["_id"], "status": "saved"}
+        elif doc["_id"] in owned:
+            results[index] = {"index": index, "id": doc["_id"], "status": "exists"}
+        elif error.get("code") == 11000:
+            results[index] = {"index": index, "id": doc["_id"], "status": "conflict", "error": "Conversation ID already in use"}
+        else:
+            results[index] = {"index": index, "id": doc["_id"], "status": "error", "error": error.get("errmsg", "write failed")}
+    return results
+
+async def load_many(user_id: str, conversation_ids: List[str]) -> List[Dict[str, Any]]:
+    """대화 여러 개를 $in 조회 한 번으로 불러오기 (요청한 순서대로)"""
+    check_batch_size(conversation_ids)
+    found = {}
+    async for conv in conversations_collection.find({"_id": {"$in": list(set(conversation_ids))}, "user_id": user_id}):
+        found[conv["_id"]] = conv
+    return [
+        {"id": conversation_id, "status": "ok", "conversation": found[conversation_id]}
+        if conversation_id in found else {"id": conversation_id, "status": "not_found"}
+        for conversation_id in conversation_ids
+    ]
+
+async def append_many_messages(user_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """여러 대화에 메시지를 bulk_write 한 번으로 추가 (같은 대화는 요청 순서대로)"""
+    check_batch_size(items)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            append = AppendItem.model_validate(item)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "invalid", "error": validation_message(e)}
+            continue
+        parsed.append((index, append.conversation_id, [msg.dict() for msg in append.messages]))
+
+    # 대화가 있는지와 요약 필드 상태를 한 번에 확인
+    existing = {}
+    async for conv in conversations_collection.find(
+        {"_id": {"$in": list({conversation_id for _, conversation_id, _ in parsed})}, "user_id": user_id},
+        {"message_count": 1, "preview": 1}
+    ):
+        existing[conv["_id"]] = conv
+
+    operations = []
+    planned = []  # operations[i] 에 해당하는 (요청 위치, 대화 ID, 추가 메시지 수)
+    now = datetime.utcnow()
+    for index, conversation_id, messages in parsed:
+        conv = existing.get(conversation_id)
+        if conv is None:
+            results[index] = {"index": index, "id": conversation_id, "status": "not_found"}
+            continue
+        update = {
+            "$push": {"messages": {"$each": messages}},
+            "$set": {"updated_at": now}
+        }
+        # 요약 필드가 없는 예전 문서는 fill_summaries 가 나중에 계산한다
+        if "message_count" in conv:
+            update["$inc"] = {"message_count": len(messages)}
+            preview = message_preview(messages)
+            if not conv.get("preview") and preview:
+                update["$set"]["preview"] = conv["preview"] = preview
+        operations.append(UpdateOne({"_id": conversation_id, "user_id": user_id}, update))
+        planned.append((index, conversation_id, len(messages)))
+
+    if not operations:
+        return results
+
+    # ordered 이므로 첫 오류에서 멈춘다: 그 앞은 실행, 그 작업은 실패, 뒤는 실행되지 않음
+    executed = len(operations)
+    error = None
+    try:
+        matched = (await conversations_collection.bulk_write(operations, ordered=True)).matched_count
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        error = write_errors[0] if write_errors else {"index": 0, "errmsg": str(e)}
+        executed = error["index"]
+        matched = e.details.get("nMatched", 0)
+
+    # 확인한 뒤 쓰기 전에 지워진 대화는 일치하는 문서가 없었다 (결과에는 합계만 있어 다시 조회)
+    remaining = None
+    if matched < executed:
+        remaining = set()
+        async for conv in conversations_collection.find(
+            {"_id": {"$in": list({conversation_id for _, conversation_id, _ in planned[:executed]})}, "user_id": user_id},
+            {"_id": 1}
+        ):
+            remaining.add(conv["_id"])
+
+    for position, (index, conversation_id, added) in enumerate(planned):
+        if position < executed:
+            if remaining is not None and conversation_id not in remaining:
+                results[index] = {"index": index, "id": conversation_id, "status": "not_found"}
+            else:
+                results[index] = {"index": index, "id": conversation_id, "status": "appended", "added": added}
+        elif position == executed:
+            results[index] = {"index": index, "id": conversation_id, "status": "error", "error": error.get("errmsg", "write failed")}
+        else:
+            results[index] = {"index": index, "id": conversation_id, "status": "error", "error": "Not attempted after an earlier write error"}
+    return results
+
 # 인증 엔드포인트
 @app.post("/auth/register", response_model=Token)
 async def register(user: UserCreate):
@@ -119,7 +1128,7 @@ async def register(user: UserCreate):
         )
     
     # 사용자 생성
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     user_doc = {
         "_id": str(uuid4()),
         "email": user.email,
@@ -127,74 +1136,154 @@ async def register(user: UserCreate):
         "created_at": datetime.utcnow()
     }
     await users_collection.insert_one(user_doc)
+    user_cache.invalidate(user.email)
     
     # 토큰 생성
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "uid": user_doc["_id"]})
     return {"access_token": access_token}
 
 @app.post("/auth/login", response_model=Token)
 async def login(user: UserLogin):
     # 사용자 확인
     db_user = await users_collection.find_one({"email": user.email})
-    if not db_user or not pwd_context.verify(user.password, db_user["hashed_password"]):
+    if not db_user or not await password_hasher.verify(user.password, db_user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
     # 토큰 생성
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "uid": db_user["_id"]})
     return {"access_token": access_token}
 
 # 대화 엔드포인트
 @app.post("/conversations")
 async def create_conversation(
     conversation: ConversationCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    """대화 생성 (Idempotency-Key 를 주면 그 값이 대화 ID 가 되고, 같은 키로 다시 보내도 한 번만 생성)"""
+    check_idempotency_key(idempotency_key)
+    messages = [msg.dict() for msg in conversation.messages]
     conversation_doc = {
-        "_id": str(uuid4()),
+        "_id": idempotency_key or str(uuid4()),
         "user_id": current_user["_id"],
-        "messages": [msg.dict() for msg in conversation.messages],
+        "messages": messages,
         "metadata": conversation.metadata or {},
+        **summary_fields(messages),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
-    await conversations_collection.insert_one(conversation_doc)
+    try:
+        await conversations_collection.insert_one(conversation_doc)
+    except DuplicateKeyError:
+        existing = await conversations_collection.find_one({"_id": conversation_doc["_id"]}, {"user_id": 1})
+        if idempotency_key is None or existing is None or existing["user_id"] != current_user["_id"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Conversation ID already in use"
+            )
+        return {"id": conversation_doc["_id"], "message": "Conversation already created"}
     return {"id": conversation_doc["_id"], "message": "Conversation created successfully"}
 
+def list_response(request: Request, response: Response, conversations: list, next_cursor: Optional[str]):
+    """목록 응답에 커서와 ETag 를 붙이고, 클라이언트 것과 같으면 304"""
+    etag = payload_etag([conversations, next_cursor])
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        result = not_modified(etag)
+        if next_cursor:
+            result.headers["X-Next-Cursor"] = next_cursor
+        return result
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
+    return conversations
+
 @app.get("/conversations")
 async def list_conversations(
+    request: Request,
+    response: Response,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
     current_user: dict = Depends(get_current_user)
 ):
-    cursor = conversations_collection.find(
-        {"user_id": current_user["_id"]}
-    ).skip(offset).limit(limit)
-    
-    conversations = []
-    async for conv in cursor:
-        conversations.append({
-            "id": conv["_id"],
-            "metadata": conv.get("metadata", {}),
-            "created_at": conv["created_at"],
-            "updated_at": conv["updated_at"],
-            "message_count": len(conv.get("messages", []))
-        })
-    
-    return conversations
+    """대화 목록 (다음 페이지 커서는 X-Next-Cursor 헤더)"""
+    docs, next_cursor = await list_user_conversations(current_user["_id"], limit, offset, cursor, sort)
+    return list_response(request, response, [conversation_summary(conv) for conv in docs], next_cursor)
+
+# 일괄 처리 엔드포인트 (/conversations/{conversation_id} 와 겹치지 않도록 /batch 아래에 둔다)
+@app.post("/batch/conversations")
+async def batch_create_conversations(
+    batch: ConversationBatchCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    return {"results": await save_many(current_user["_id"], batch.conversations)}
+
+@app.post("/batch/conversations/load")
+async def batch_load_conversations(
+    batch: ConversationBatchLoad,
+    current_user: dict = Depends(get_current_user)
+):
+    return {"results": await load_many(current_user["_id"], batch.ids)}
+
+@app.post("/batch/conversations/messages")
+async def batch_append_messages(
+    batch: AppendBatch,
+    current_user: dict = Depends(get_current_user)
+):
+    return {"results": await append_many_messages(current_user["_id"], batch.items)}
+
+# /conversations/{conversation_id} 보다 먼저 등록해야 "search" 가 대화 ID 로 잡히지 않는다
+@app.get("/conversations/search")
+async def search_conversations(
+    query: str,
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    return await search_user_conversations(current_user["_id"], query, limit)
+
+@app.get("/conversations/context")
+async def get_context(
+    query: str,
+    max_tokens: int = 2000,
+    current_user: dict = Depends(get_current_user)
+):
+    return await retrieve_context(current_user["_id"], query, max_tokens)
 
 @app.get("/conversations/{conversation_id}")
 async def get_conversation(
     conversation_id: str,
+    request: Request,
+    response: Response,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    last: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    conversation = await conversations_collection.find_one({
-        "_id": conversation_id,
-        "user_id": current_user["_id"]
-    })
+    query = {"_id": conversation_id, "user_id": current_user["_id"]}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # 바뀌지 않았으면 메시지 본문을 읽지 않는다
+        # (범위 조회도 URL 에 범위가 들어 있으므로 대화가 같으면 응답도 같다)
+        validator = await conversations_collection.find_one(query, VALIDATOR_PROJECTION)
+        if validator and etag_matches(if_none_match, conversation_etag(validator)):
+            return not_modified(conversation_etag(validator))
+
+    if range_requested(offset, limit, last, max_bytes, cursor):
+        conversation = await load_message_range(
+            current_user["_id"], conversation_id, offset, limit, last, max_bytes, cursor
+        )
+        if conversation and conversation["next_cursor"]:
+            response.headers["X-Next-Cursor"] = conversation["next_cursor"]
+    else:
+        conversation = await conversations_collection.find_one(query)
     
     if not conversation:
         raise HTTPException(
@@ -202,19 +1291,54 @@ async def get_conversation(
             detail="Conversation not found"
         )
     
+    response.headers["ETag"] = conversation_etag(conversation)
+    response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
     return conversation
 
+@app.get("/conversations/{conversation_id}/stream")
+async def stream_conversation(
+    conversation_id: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """대화 전체(또는 offset/limit 구간)를 스트리밍 JSON 으로 응답"""
+    if offset < 0 or (limit is not None and limit < 0):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="offset and limit must not be negative"
+        )
+    query = {"_id": conversation_id, "user_id": current_user["_id"]}
+    conversation = await conversation_header(query)
+    if not conversation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+
+    # 스트리밍 중에 추가된 메시지는 섞지 않도록 끝 위치를 미리 정한다
+    total = conversation["message_count"]
+    start = min(offset, total)
+    end = total if limit is None else min(start + limit, total)
+    return StreamingResponse(
+        stream_messages(query, conversation, start, end),
+        media_type="application/json",
+        headers={"ETag": conversation_etag(conversation), "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    )
+
 @app.put("/conversations/{conversation_id}")
 async def update_conversation(
     conversation_id: str,
     update: ConversationUpdate,
     current_user: dict = Depends(get_current_user)
 ):
+    messages = [msg.dict() for msg in update.messages]
     result = await conversations_collection.update_one(
         {"_id": conversation_id, "user_id": current_user["_id"]},
         {
             "$set": {
-                "messages": [msg.dict() for msg in update.messages],
+                "messages": messages,
+                **summary_fields(messages),
                 "updated_at": datetime.utcnow()
             }
         }
@@ -232,17 +1356,13 @@ async def update_conversation(
 async def append_messages(
     conversation_id: str,
     messages: List[Message],
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    result = await conversations_collection.update_one(
-        {"_id": conversation_id, "user_id": current_user["_id"]},
-        {
-            "$push": {"messages": {"$each": [msg.dict() for msg in messages]}},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
-    )
+    check_idempotency_key(idempotency_key)
+    found = await push_messages(conversation_id, current_user["_id"], [msg.dict() for msg in messages], idempotency_key)
     
-    if result.matched_count == 0:
+    if not found:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversation not found"
@@ -268,70 +1388,157 @@ async def delete_conversation(
     
     return {"message": "Conversation deleted successfully"}
 
-@app.get("/conversations/search")
-async def search_conversations(
-    query: str,
-    limit: int = 20,
-    current_user: dict = Depends(get_current_user)
-):
-    # MongoDB 텍스트 검색 사용
-    cursor = conversations_collection.find(
-        {
-            "user_id": current_user["_id"],
-            "$text": {"$search": query}
+# 정적 파일
+class StaticAsset:
+    """메모리에 올려 둔 파일 하나와 미리 압축한 본문"""
+
+    def __init__(self, path: Path, rewrite: Optional[Callable[[bytes], bytes]] = None):
+        stat = path.stat()
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        body = path.read_bytes()
+        if rewrite is not None:
+            body = rewrite(body)
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type.endswith("javascript"):
+            content_type += "; charset=utf-8"
+        self.content_type = content_type
+
+        # 인코딩마다 본문이 다르므로 강한 ETag 도 인코딩별로 둔다
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # URL 에 붙이는 내용 해시 (/static/x.js?v=...)
+        self.version = digest[:12]
+        self.bodies = {"identity": body}
+        self.etags = {"identity": f'"{digest}"'}
+        if len(body) >= 1024:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.bodies["gzip"] = compressed
+                self.etags["gzip"] = f'"{digest}-gz"'
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.bodies["br"] = compressed
+                    self.etags["br"] = f'"{digest}-br"'
+
+
+_STATIC_URL_RE = re.compile(rb'''(["'])/static/([^"'?#]+)\1''')
+
+class StaticAssets:
+    """static 디렉토리를 한 번 읽어 메모리에서 서빙 (ETag/304, gzip/brotli)
+
+    HTML 안의 /static 참조에는 그 파일의 내용 해시를 붙인다 (?v=). 파일이 바뀌면 URL 도
+    바뀌므로 해시가 맞는 요청은 오래 캐시해도 된다. STATIC_DEV_RELOAD 모드에서는 붙이지 않는다.
+    """
+
+    def __init__(self, directory: Path, reload: bool = False):
+        self.directory = directory
+        self.reload = reload
+        self._assets: Dict[str, StaticAsset] = {}
+        paths = [path for path in directory.rglob("*") if path.is_file()]
+        # 참조되는 파일의 해시가 먼저 있어야 HTML 을 고칠 수 있다
+        for path in sorted(paths, key=lambda path: path.suffix == ".html"):
+            rewrite = self._version_urls if path.suffix == ".html" and not reload else None
+            self._assets[path.relative_to(directory).as_posix()] = StaticAsset(path, rewrite)
+
+    def _version_urls(self, body: bytes) -> bytes:
+        def versioned(match: "re.Match[bytes]") -> bytes:
+            asset = self._assets.get(match.group(2).decode())
+            if asset is None:
+                return match.group(0)
+            quote = match.group(1)
+            return quote + b"/static/" + match.group(2) + b"?v=" + asset.version.encode() + quote
+        return _STATIC_URL_RE.sub(versioned, body)
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        if not self.reload:
+            return self._assets.get(name)
+
+        path = (self.directory / name).resolve()
+        if not path.is_relative_to(self.directory) or not path.is_file():
+            self._assets.pop(name, None)
+            return None
+        asset = self._assets.get(name)
+        stat = path.stat()
+        if asset is None or asset.signature != (stat.st_mtime_ns, stat.st_size):
+            asset = self._assets[name] = StaticAsset(path)
+        return asset
+
+    def response(self, request: Request, name: str, cache_control: str) -> Response:
+        asset = self.get(name)
+        if asset is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in request.headers.get("accept-encoding", "").split(",")
+            if not part.replace(" ", "").endswith(";q=0")
         }
-    ).limit(limit)
-    
-    results = []
-    async for conv in cursor:
-        results.append({
-            "id": conv["_id"],
-            "metadata": conv.get("metadata", {}),
-            "created_at": conv["created_at"],
-            "message_count": len(conv.get("messages", []))
-        })
-    
-    return results
+        encoding = next((e for e in ("br", "gzip") if e in accepted and e in asset.bodies), "identity")
+        headers = {
+            "ETag": asset.etags[encoding],
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding"
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or asset.etags[encoding] in tags:
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(content=asset.bodies[encoding], media_type=asset.content_type, headers=headers)
+
+static_assets = StaticAssets(STATIC_DIR, reload=STATIC_DEV_RELOAD)
+
+# HTML 과 해시 없는 /static 요청은 매번 ETag 로 재검증하고, 해시가 맞는 요청은 1년 동안 캐시
+PAGE_CACHE_CONTROL = "no-cache"
+VERSIONED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.get("/static/{name:path}")
+async def static_file(name: str, request: Request, v: Optional[str] = None):
+    asset = static_assets.get(name)
+    versioned = asset is not None and v == asset.version
+    return static_assets.response(request, name, VERSIONED_CACHE_CONTROL if versioned else PAGE_CACHE_CONTROL)
 
 # 웹 페이지 라우트
 @app.get("/", response_class=HTMLResponse)
-async def dashboard():
+async def index_page(request: Request):
     """메인 대시보드 페이지"""
-    with open("static/index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    return static_assets.response(request, "index.html", PAGE_CACHE_CONTROL)
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard():
+async def dashboard_page(request: Request):
     """대화 관리 대시보드"""
-    with open("static/dashboard.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    return static_assets.response(request, "dashboard.html", PAGE_CACHE_CONTROL)
 
 @app.get("/conversation/{conversation_id}", response_class=HTMLResponse)
-async def conversation_detail(conversation_id: str):
+async def conversation_detail(conversation_id: str, request: Request):
     """대화 상세 페이지"""
-    with open("static/conversation.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    return static_assets.response(request, "conversation.html", PAGE_CACHE_CONTROL)
 
 @app.get("/guide", response_class=HTMLResponse)
-async def guide_page():
+async def guide_page(request: Request):
     """사용 가이드 페이지"""
-    with open("static/guide.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    return static_assets.response(request, "guide.html", PAGE_CACHE_CONTROL)
 
 @app.get("/setup", response_class=HTMLResponse)
-async def setup_page():
+async def setup_page(request: Request):
     """MCP 설정 가이드 페이지"""
-    with open("static/setup.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    return static_assets.response(request, "setup.html", PAGE_CACHE_CONTROL)
 
 # API 라우트 (프론트엔드에서 사용)
 @app.get("/api/me")
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """현재 로그인한 사용자 정보"""
+    if "created_at" not in current_user:
+        # 토큰만으로 인증한 경우 (JWT_TRUST_USER_ID)
+        current_user = await load_user(current_user["email"]) or current_user
     return {
         "id": current_user["_id"],
         "email": current_user["email"],
-        "created_at": current_user["created_at"]
+        "created_at": current_user.get("created_at")
     }
 
 @app.post("/api/login")
@@ -346,37 +1553,33 @@ async def api_register(user: UserCreate):
 
 @app.get("/api/conversations")
 async def api_get_conversations(
+    request: Request,
+    response: Response,
     limit: int = 20,
     skip: int = 0,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
     current_user: dict = Depends(get_current_user)
 ):
-    """사용자의 대화 목록 조회"""
+    """사용자의 대화 목록 조회 (다음 페이지 커서는 X-Next-Cursor 헤더)"""
     try:
-        cursor = conversations_collection.find(
-            {"user_id": current_user["_id"]}
-        ).sort("created_at", -1).limit(limit).skip(skip)
-
-        conversations = []
-        async for conv in cursor:
-            conversations.append({
-                "id": str(conv["_id"]),
-                "messages": conv.get("messages", []),
-                "metadata": conv.get("metadata", {}),
-                "created_at": conv.get("created_at"),  # .get() 사용으로 안전하게
-                "updated_at": conv.get("updated_at")   # .get() 사용으로 안전하게
-            })
-
-        return conversations
+        docs, next_cursor = await list_user_conversations(current_user["_id"], limit, skip, cursor, sort)
+        # 대시보드용 요약만 보낸다 (메시지 전체는 /api/conversations/{id})
+        return list_response(request, response, [conversation_summary(conv) for conv in docs], next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.get("/api/conversations/{conversation_id}")
 async def api_get_conversation(
     conversation_id: str,
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user)
 ):
     """특정 대화 상세 조회"""
-    return await get_conversation(conversation_id, current_user)
+    return await get_conversation(conversation_id, request, response, current_user=current_user)
 
 @app.delete("/api/conversations/{conversation_id}")
 async def api_delete_conversation(
@@ -389,7 +1592,14 @@ async def api_delete_conversation(
 # 기존 API 호환성을 위한 라우트
 @app.get("/health")
 async def health_check():
-    return {"message": "Pensieve API", "version": "1.0.0", "status": "healthy"}
+    return {
+        "message": "Pensieve API",
+        "version": "1.0.0",
+        "status": "healthy",
+        "indexes": index_status,
+        "user_cache": user_cache.stats(),
+        "password_hashing": password_hasher.stats()
+    }
 
 # ==================== MCP SSE 서버 ====================
 # FastMCP 인스턴스
@@ -416,7 +1626,7 @@ async def mcp_register(email: str, password: str) -> str:
         if len(password.encode('utf-8')) > 72:
             return "비밀번호는 72바이트 이하여야 합니다"
 
-        hashed_password = pwd_context.hash(password)
+        hashed_password = await password_hasher.hash(password)
         user_doc = {
             "_id": str(uuid4()),
             "email": email,
@@ -424,11 +1634,14 @@ async def mcp_register(email: str, password: str) -> str:
             "created_at": datetime.utcnow()
         }
         await users_collection.insert_one(user_doc)
+        user_cache.invalidate(email)
 
-        token = create_access_token(data={"sub": email})
+        token = create_access_token(data={"sub": email, "uid": user_doc["_id"]})
         mcp_api_tokens[email] = token
 
         return f"회원가입 성공! 토큰이 자동으로 설정되었습니다."
+    except HTTPException as e:
+        return f"요청이 많습니다. 잠시 후 다시 시도해주세요: {e.detail}"
     except Exception as e:
         return f"오류 발생: {str(e)}"
 
@@ -442,13 +1655,15 @@ async def mcp_login(email: str, password: str) -> str:
     """
     try:
         db_user = await users_collection.find_one({"email": email})
-        if not db_user or not pwd_context.verify(password, db_user["hashed_password"]):
+        if not db_user or not await password_hasher.verify(password, db_user["hashed_password"]):
             return "로그인 실패: 이메일 또는 비밀번호가 잘못되었습니다"
 
-        token = create_access_token(data={"sub": email})
+        token = create_access_token(data={"sub": email, "uid": db_user["_id"]})
         mcp_api_tokens[email] = token
 
         return f"로그인 성공! 토큰이 자동으로 설정되었습니다."
+    except HTTPException as e:
+        return f"요청이 많습니다. 잠시 후 다시 시도해주세요: {e.detail}"
     except Exception as e:
         return f"오류 발생: {str(e)}"
 
@@ -474,8 +1689,7 @@ async def get_mcp_user(email: str):
 
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_email = payload.get("sub")
-        user = await users_collection.find_one({"email": user_email})
+        user = await resolve_user(payload)
         if not user:
             raise HTTPException(status_code=401, detail="사용자를 찾을 수 없습니다")
         return user
@@ -499,6 +1713,7 @@ async def save_conversation(email: str, messages: list, metadata: dict = None) -
             "user_id": user["_id"],
             "messages": messages,
             "metadata": metadata or {},
+            **summary_fields(messages),
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
@@ -510,16 +1725,37 @@ async def save_conversation(email: str, messages: list, metadata: dict = None) -
         return f"오류 발생: {str(e)}"
 
 @mcp.tool()
-async def load_conversation(email: str, conversation_id: str) -> str:
-    """저장된 대화를 불러옵니다
+async def load_conversation(
+    email: str,
+    conversation_id: str,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    last: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> str:
+    """저장된 대화를 불러옵니다 (긴 대화는 범위를 지정해 일부만)
 
     Args:
         email: 사용자 이메일 주소
         conversation_id: 불러올 대화 ID
+        offset: 처음 메시지 위치 (0부터)
+        limit: 불러올 메시지 수
+        last: 마지막 N개 메시지만 (offset/limit 보다 우선)
+        max_bytes: 메시지 직렬화 크기 예산 (바이트)
+        cursor: 이전 응답의 next_cursor (이어서 불러오기)
     """
     try:
         user = await get_mcp_user(email)
 
+        if range_requested(offset, limit, last, max_bytes, cursor):
+            conv = await load_message_range(
+                user["_id"], conversation_id, offset, limit, last, max_bytes, cursor
+            )
+            if not conv:
+                return f"대화를 찾을 수 없습니다: {conversation_id}"
+            return json.dumps(conv, default=str, ensure_ascii=False, indent=2)
+
         conv = await conversations_collection.find_one({
             "_id": conversation_id,
             "user_id": user["_id"]
@@ -535,28 +1771,32 @@ async def load_conversation(email: str, conversation_id: str) -> str:
         return f"오류 발생: {str(e)}"
 
 @mcp.tool()
-async def list_conversations(email: str, limit: int = 50, offset: int = 0) -> str:
+async def list_conversations(email: str, limit: int = 50, offset: int = 0, cursor: str = None) -> str:
     """저장된 대화 목록을 조회합니다
 
     Args:
         email: 사용자 이메일 주소
         limit: 조회할 대화 수 (기본값: 50)
-        offset: 시작 위치 (기본값: 0)
+        offset: 시작 위치 (기본값: 0, cursor 를 주면 무시)
+        cursor: 이전 결과의 next_cursor (다음 페이지 조회). 첫 페이지는 빈 문자열.
+            cursor 를 주면 {conversations, next_cursor} 를, 주지 않으면 예전처럼 대화 배열을 반환
     """
     try:
         user = await get_mcp_user(email)
 
-        cursor = conversations_collection.find({"user_id": user["_id"]}).sort("created_at", -1).limit(limit).skip(offset)
+        docs, next_cursor = await list_user_conversations(user["_id"], limit, offset, cursor or None)
         convs = []
-        async for conv in cursor:
+        for conv in docs:
             convs.append({
                 "id": conv["_id"],
                 "metadata": conv.get("metadata", {}),
                 "created_at": str(conv["created_at"]),
-                "message_count": len(conv.get("messages", []))
+                "message_count": conv.get("message_count", 0)
             })
 
-        return json.dumps(convs, ensure_ascii=False, indent=2)
+        if cursor is None:
+            return json.dumps(convs, ensure_ascii=False, indent=2)
+        return json.dumps({"conversations": convs, "next_cursor": next_cursor}, ensure_ascii=False, indent=2)
     except HTTPException as e:
         return f"인증 오류: {e.detail}"
     except Exception as e:
@@ -574,27 +1814,7 @@ async def search_conversations(email: str, query: str, limit: int = 20) -> str:
     try:
         user = await get_mcp_user(email)
 
-        cursor = conversations_collection.find({
-            "user_id": user["_id"],
-            "messages.content": {"$regex": query, "$options": "i"}
-        }).limit(limit)
-
-        results = []
-        async for conv in cursor:
-            matched_message = None
-            for msg in conv.get("messages", []):
-                if query.lower() in msg.get("content", "").lower():
-                    matched_message = msg
-                    break
-
-            results.append({
-                "id": conv["_id"],
-                "metadata": conv.get("metadata", {}),
-                "created_at": str(conv["created_at"]),
-                "matched_message": matched_message,
-                "message_count": len(conv.get("messages", []))
-            })
-
+        results = await search_user_conversations(user["_id"], query, limit)
         return json.dumps(results, ensure_ascii=False, indent=2)
     except HTTPException as e:
         return f"인증 오류: {e.detail}"
@@ -613,33 +1833,83 @@ async def append_to_conversation(email: str, conversation_id: str, messages: lis
     try:
         user = await get_mcp_user(email)
 
-        conv = await conversations_collection.find_one({
-            "_id": conversation_id,
-            "user_id": user["_id"]
-        })
-
-        if not conv:
+        if not await push_messages(conversation_id, user["_id"], messages):
             return f"대화를 찾을 수 없습니다: {conversation_id}"
 
-        result = await conversations_collection.update_one(
-            {"_id": conversation_id, "user_id": user["_id"]},
-            {
-                "$push": {"messages": {"$each": messages}},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
+        return f"대화에 {len(messages)}개의 메시지가 추가되었습니다."
+    except HTTPException as e:
+        return f"인증 오류: {e.detail}"
+    except Exception as e:
+        return f"오류 발생: {str(e)}"
 
-        if result.modified_count > 0:
-            return f"대화에 {len(messages)}개의 메시지가 추가되었습니다."
-        else:
-            return "메시지 추가에 실패했습니다."
+@mcp.tool(name="retrieve_context")
+async def retrieve_context_tool(email: str, query: str, max_tokens: int = 2000) -> str:
+    """검색어와 관련된 메시지를 여러 대화에서 골라 토큰 예산 안에 담아 반환합니다
+
+    Args:
+        email: 사용자 이메일 주소
+        query: 검색어
+        max_tokens: 반환할 메시지들의 최대 토큰 수 (근사치)
+    """
+    try:
+        user = await get_mcp_user(email)
+        result = await retrieve_context(user["_id"], query, max_tokens)
+        return json.dumps(result, default=str, ensure_ascii=False)
     except HTTPException as e:
         return f"인증 오류: {e.detail}"
     except Exception as e:
         return f"오류 발생: {str(e)}"
 
-# 정적 파일 서빙 (MCP보다 먼저 마운트)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@mcp.tool()
+async def save_conversations(email: str, conversations: list) -> str:
+    """여러 대화를 한 번에 저장합니다 (항목별 결과 반환)
+
+    Args:
+        email: 사용자 이메일 주소
+        conversations: 저장할 대화 목록 (각 항목은 messages 와 선택적으로 metadata, id)
+    """
+    try:
+        user = await get_mcp_user(email)
+        results = await save_many(user["_id"], conversations)
+        return json.dumps(results, ensure_ascii=False, indent=2)
+    except HTTPException as e:
+        return f"요청 오류: {e.detail}"
+    except Exception as e:
+        return f"오류 발생: {str(e)}"
+
+@mcp.tool()
+async def load_conversations(email: str, conversation_ids: list) -> str:
+    """여러 대화를 한 번에 불러옵니다 (항목별 결과 반환)
+
+    Args:
+        email: 사용자 이메일 주소
+        conversation_ids: 불러올 대화 ID 목록
+    """
+    try:
+        user = await get_mcp_user(email)
+        results = await load_many(user["_id"], conversation_ids)
+        return json.dumps(results, default=str, ensure_ascii=False, indent=2)
+    except HTTPException as e:
+        return f"요청 오류: {e.detail}"
+    except Exception as e:
+        return f"오류 발생: {str(e)}"
+
+@mcp.tool()
+async def append_many(email: str, items: list) -> str:
+    """여러 대화에 메시지를 한 번에 추가합니다 (항목별 결과 반환)
+
+    Args:
+        email: 사용자 이메일 주소
+        items: 추가할 목록 (각 항목은 conversation_id 와 messages)
+    """
+    try:
+        user = await get_mcp_user(email)
+        results = await append_many_messages(user["_id"], items)
+        return json.dumps(results, ensure_ascii=False, indent=2)
+    except HTTPException as e:
+        return f"요청 오류: {e.detail}"
+    except Exception as e:
+        return f"오류 발생: {str(e)}"
 
 # FastMCP를 FastAPI에 통합 - SSE 방식 사용
 # SSE 엔드포인트는 /sse 에 자동 생성됨
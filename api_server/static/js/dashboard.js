@@ -172,7 +172,7 @@ function renderConversations(conversations) {
                         ${conv.metadata?.title || `대화 ${conv.id.slice(0, 8)}`}
                     </h4>
                     <p class="text-sm text-gray-600 mb-2 line-clamp-2">
-                        ${getFirstMessage(conv.messages)}
+                        ${escapeHtml(conv.snippet || getPreview(conv.preview))}
                     </p>
                     <div class="flex items-center space-x-4 text-xs text-gray-500">
                         <span>
@@ -181,7 +181,7 @@ function renderConversations(conversations) {
                         </span>
                         <span>
                             <i class="fas fa-comment mr-1"></i>
-                            ${conv.messages?.length || 0}개 메시지
+                            ${conv.message_count || 0}개 메시지
                         </span>
                         ${conv.metadata?.tags && conv.metadata.tags.length > 0 ? `
                             <span class="flex items-center flex-wrap gap-1">
@@ -225,10 +225,8 @@ function updateStats() {
 }
 
 // Utility functions
-function getFirstMessage(messages) {
-    if (!messages || messages.length === 0) return '메시지 없음';
-    const firstUserMessage = messages.find(m => m.role === 'user');
-    return firstUserMessage ? firstUserMessage.content.slice(0, 100) + '...' : '메시지 없음';
+function getPreview(preview) {
+    return preview ? preview.slice(0, 100) + '...' : '메시지 없음';
 }
 
 function formatDate(dateString) {
@@ -316,14 +314,19 @@ async function handleSearch() {
         return;
     }
 
-    const filtered = conversations.filter(conv => {
-        const title = conv.metadata?.title || '';
-        const tags = conv.metadata?.tags?.join(' ') || '';
-        const content = conv.messages?.map(m => m.content).join(' ') || '';
-
-        const searchText = (title + ' ' + tags + ' ' + content).toLowerCase();
-        return searchText.includes(query.toLowerCase());
-    });
+    // 목록에는 메시지 본문이 없으므로 서버에서 검색
+    try {
+        const token = localStorage.getItem('token');
+        const response = await fetch(`${API_BASE_URL}/conversations/search?query=${encodeURIComponent(query)}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
 
-    renderConversations(filtered);
+        if (response.ok) {
+            renderConversations(await response.json());
+        } else {
+            console.error('Search failed');
+        }
+    } catch (error) {
+        console.error('Search failed:', error);
+    }
 }
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""스냅샷 압축 형식별 디스크 사용량과 전체 스캔 처리량 비교
+
+사용법:
+    python benchmarks/bench_compression.py --conversations 2000 --messages 40
+
+임시 디렉토리에 같은 합성 대화를 형식별로 저장한 뒤, 모든 대화를 읽어
+부분 문자열 검색을 하는 전체 스캔(scan_conversations 와 같은 작업)을 잰다.
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mcp_server import storage  # noqa: E402
+
+WORDS = (
+    "the conversation model context server python index search cache token "
+    "message assistant user memory vector storage request response latency "
+    "대화 저장 검색 메시지 서버 모델 사용자 기억 요약 응답"
+).split()
+
+
+def make_conversation(rng: random.Random, conversation_id: str, message_count: int):
+    messages = []
+    for i in range(message_count):
+        length = rng.randint(20, 200)
+        messages.append({
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(rng.choice(WORDS) for _ in range(length))
+        })
+    return {
+        "id": conversation_id,
+        "messages": messages,
+        "metadata": {"title": f"conversation {conversation_id}", "tags": ["bench"]},
+        "created_at": "2024-01-01T00:00:00",
+        "updated_at": "2024-01-01T00:00:00"
+    }
+
+
+def scan(storage_dir: Path, query: str) -> int:
+    matched = 0
+    for conversation_id in storage.conversation_ids(storage_dir):
+        data = storage.read_conversation(storage_dir, conversation_id)
+        for message in data["messages"]:
+            if query in message["content"].lower():
+                matched += 1
+                break
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--query", default="latency memory")
+    args = parser.parse_args()
+
+    formats = ["none", "gzip"] + (["zstd"] if storage.zstandard is not None else [])
+    rng = random.Random(0)
+    conversations = [
+        make_conversation(rng, f"bench-{i:06d}", args.messages)
+        for i in range(args.conversations)
+    ]
+
+    print(f"{args.conversations} conversations x {args.messages} messages")
+    print(f"{'format':<8}{'bytes on disk':>16}{'ratio':>8}{'write s':>10}{'scan s':>10}{'scan MB/s':>12}")
+
+    baseline = None
+    for compression in formats:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage_dir = Path(tmp)
+            start = time.perf_counter()
+            for conversation in conversations:
+                storage.write_conversation(storage_dir, conversation, compression)
+            write_time = time.perf_counter() - start
+
+            size = sum(p.stat().st_size for p in storage_dir.iterdir())
+            baseline = baseline or size
+
+            start = time.perf_counter()
+            scan(storage_dir, args.query)
+            scan_time = time.perf_counter() - start
+
+            # 처리량은 압축 해제 후 JSON 크기(=none 형식 크기) 기준
+            print(f"{compression:<8}{size:>16,}{baseline / size:>7.1f}x{write_time:>10.2f}"
+                  f"{scan_time:>10.2f}{baseline / scan_time / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
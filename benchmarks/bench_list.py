@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""API 서버 대화 목록 쿼리의 인덱스 전후 지연 시간 비교
+
+사용법:
+    python benchmarks/bench_list.py --users 200 --conversations 50
+    python benchmarks/bench_list.py --mongodb-url mongodb://localhost:27017
+
+합성 사용자/대화를 넣고 /conversations 와 같은 쿼리
+(user_id 로 거르고 created_at 내림차순, limit 20)와 이메일 조회를
+인덱스 없이 한 번, ensure_indexes() 로 인덱스를 만든 뒤 한 번 잰다.
+
+--mongodb-url 을 주면 실제 mongod 의 임시 데이터베이스를 쓰고 실행 계획
+(COLLSCAN / IXSCAN)도 출력한다. 없으면 mongomock-motor 로 대신하는데,
+mongomock 은 인덱스를 쿼리에 쓰지 않으므로 지연 시간 차이는 mongod 에서만 의미가 있다.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import uuid4
+
+API_DIR = Path(__file__).resolve().parent.parent / "api_server"
+
+
+def load_api(mongodb_url):
+    """api_server/main.py 를 불러와 벤치마크용 데이터베이스로 바꿔 끼운다"""
+    if mongodb_url:
+        os.environ["MONGODB_URL"] = mongodb_url
+    # main.py 는 static 디렉토리를 상대 경로로 마운트한다
+    os.chdir(API_DIR)
+    sys.path.insert(0, str(API_DIR))
+    import main
+
+    database_name = f"pensieve_bench_{uuid4().hex[:8]}"
+    if mongodb_url:
+        main.db = main.client[database_name]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        main.db = AsyncMongoMockClient()[database_name]
+    main.users_collection = main.db.users
+    main.conversations_collection = main.db.conversations
+    return main
+
+
+async def seed(main, users: int, conversations: int, rng: random.Random):
+    start = datetime(2024, 1, 1)
+    user_ids = []
+    for u in range(users):
+        user_id = str(uuid4())
+        user_ids.append(user_id)
+        await main.users_collection.insert_one({
+            "_id": user_id,
+            "email": f"user{u}@example.com",
+            "hashed_password": "x",
+            "created_at": start
+        })
+        docs = []
+        for _ in range(conversations):
+            created_at = start + timedelta(minutes=rng.randint(0, 500_000))
+            docs.append({
+                "_id": str(uuid4()),
+                "user_id": user_id,
+                "messages": [{"role": "user", "content": "hello"}],
+                "metadata": {"title": "bench"},
+                "created_at": created_at,
+                "updated_at": created_at
+            })
+        await main.conversations_collection.insert_many(docs)
+    return user_ids
+
+
+async def time_queries(main, user_ids, users: int, rounds: int, rng: random.Random):
+    list_times, email_times = [], []
+    for _ in range(rounds):
+        user_id = rng.choice(user_ids)
+        t = time.perf_counter()
+        cursor = main.conversations_collection.find({"user_id": user_id}).sort("created_at", -1).limit(20)
+        await cursor.to_list(length=20)
+        list_times.append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        await main.users_collection.find_one({"email": f"user{rng.randrange(users)}@example.com"})
+        email_times.append(time.perf_counter() - t)
+    return list_times, email_times
+
+
+def summarize(label: str, times):
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1] if len(times) >= 20 else times[-1]
+    print(f"{label:<28} median {statistics.median(times) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+async def plan(main, user_id: str) -> str:
+    explain = await main.conversations_collection.find(
+        {"user_id": user_id}
+    ).sort("created_at", -1).limit(20).explain()
+    stage = explain.get("queryPlanner", {}).get("winningPlan", {})
+    stages = []
+    while stage:
+        stages.append(stage.get("stage", "?"))
+        stage = stage.get("inputStage")
+    return " <- ".join(stages)
+
+
+async def run(args):
+    main = load_api(args.mongodb_url)
+    rng = random.Random(args.seed)
+    total = args.users * args.conversations
+    print(f"seeding {args.users} users x {args.conversations} conversations ({total} documents)"
+          f" on {'mongod' if args.mongodb_url else 'mongomock'}")
+    user_ids = await seed(main, args.users, args.conversations, rng)
+
+    try:
+        for phase in ("without indexes", "with indexes"):
+            if phase == "with indexes":
+                t = time.perf_counter()
+                await main.ensure_indexes()
+                print(f"ensure_indexes: {time.perf_counter() - t:.2f} s")
+                for name, state in main.index_status.items():
+                    print(f"  {name}: {state}")
+            list_times, email_times = await time_queries(main, user_ids, args.users, args.rounds, rng)
+            print(f"-- {phase}")
+            summarize("list (user_id, created_at)", list_times)
+            summarize("find user by email", email_times)
+            if args.mongodb_url:
+                print(f"plan: {await plan(main, user_ids[0])}")
+    finally:
+        if args.mongodb_url:
+            await main.client.drop_database(main.db.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--conversations", type=int, default=50, help="사용자당 대화 수")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongodb-url", help="실제 mongod 주소 (없으면 mongomock)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
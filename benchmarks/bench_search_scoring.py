@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""로컬 검색 색인의 점수 계산: 순수 파이썬 루프와 NumPy 배열 연산 비교
+
+사용법:
+    python benchmarks/bench_search_scoring.py --conversations 2500 --messages 40
+
+임시 디렉토리의 SearchIndex 에 합성 대화(기본 10만 메시지)를 색인한 뒤,
+검색어마다 두 방식으로 점수 매겨 지연 시간을 재고 결과가 같은지 확인한다.
+- python: SQLite 에서 postings 를 한 행씩 읽어 병합하며 BM25 를 계산하고 크기 limit 의 힙 유지
+- numpy: 메모리의 배열 postings 조각으로 점수/합계/대화별 최고 메시지/argpartition 상위 k
+numpy 쪽은 첫 검색 때 한 번 postings 를 배열로 읽는 시간(load)도 따로 출력한다.
+자주 나오는 단어가 든 넓은 검색어일수록 후보가 많아 차이가 커진다.
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mcp_server import search_index  # noqa: E402
+from mcp_server.search_index import SearchIndex, tokenize  # noqa: E402
+
+if search_index.np is None:
+    sys.exit("numpy is required (pip install 'pensieve-mcp[semantic]')")
+
+# 앞쪽 단어일수록 자주 나오도록 (Zipf 분포에 가깝게) 고른다
+WORDS = (
+    "the conversation model context server python index search cache token "
+    "message assistant user memory vector storage request response latency "
+    "database connection pool timeout garden recipe tomato asyncio loop event "
+    "대화 저장 검색 메시지 서버 모델 사용자 기억 요약 응답"
+).split()
+WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+QUERIES = ["the", "conversation model", "memory vector storage", "asyncio loop", "대화 검색", "tomato"]
+
+
+def make_conversation(rng: random.Random, conversation_id: str, message_count: int):
+    return {
+        "id": conversation_id,
+        "messages": [
+            {"role": "user", "content": " ".join(rng.choices(WORDS, WEIGHTS, k=rng.randint(10, 60)))}
+            for _ in range(message_count)
+        ],
+        "metadata": {"title": " ".join(rng.choices(WORDS, k=3)), "tags": ["bench"]}
+    }
+
+
+def timed(func, rounds: int):
+    times = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times), result
+
+
+def same(a, b) -> bool:
+    """(대화, 메시지) 순서가 같고 점수가 부동소수 오차 안에서 같은지"""
+    return len(a) == len(b) and all(
+        x[:2] == y[:2] and abs(x[2] - y[2]) <= 1e-9 * max(1.0, abs(x[2])) for x, y in zip(a, b)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=2500)
+    parser.add_argument("--messages", type=int, default=40, help="대화당 메시지 수")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SearchIndex(Path(tmp) / "index.sqlite3", Path(tmp))
+        t = time.perf_counter()
+        for i in range(args.conversations):
+            index.index_conversation(make_conversation(rng, f"conv-{i:06d}", args.messages), 0)
+        print(f"indexed {args.conversations * args.messages} messages in {time.perf_counter() - t:.1f} s")
+        t = time.perf_counter()
+        arrays = index._posting_arrays()
+        print(f"loaded {len(arrays.posting_doc)} postings into arrays in {time.perf_counter() - t:.1f} s")
+
+        print(f"{'query':<24}{'postings':>10}{'python ms':>12}{'numpy ms':>12}{'speedup':>9}  same")
+        for query in QUERIES:
+            terms = sorted(set(tokenize(query)))
+            postings = sum(
+                index.conn.execute(
+                    "SELECT COUNT(*) FROM postings WHERE token >= ? AND token < ?",
+                    (term, term + search_index._PREFIX_END)
+                ).fetchone()[0]
+                for term in terms
+            )
+            python_time, python_result = timed(lambda: index._search(terms, args.limit), args.rounds)
+            numpy_time, numpy_result = timed(lambda: index._search_numpy(terms, args.limit), args.rounds)
+            print(
+                f"{query:<24}{postings:>10}{python_time * 1000:>12.1f}{numpy_time * 1000:>12.1f}"
+                f"{python_time / numpy_time:>8.1f}x  {same(python_result, numpy_result)}"
+            )
+
+            # retrieve_context 가 쓰는 메시지 단위 검색도 같은 결과인지
+            search_index.np, saved = None, search_index.np
+            try:
+                python_messages = index.search_messages(query, 200)
+            finally:
+                search_index.np = saved
+            if not same(python_messages, index.search_messages(query, 200)):
+                print(f"  search_messages differs for {query!r}")
+
+
+if __name__ == "__main__":
+    main()
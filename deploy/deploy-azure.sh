@@ -30,7 +30,7 @@ az acr login --name $ACR_NAME
 # 3. Docker 이미지 빌드 및 푸시
 echo -e "${GREEN}3. Docker 이미지 빌드 및 푸시${NC}"
 cd ../api_server
-docker build -t pensieve-api .
+docker build -t pensieve-api -f Dockerfile ..
 docker tag pensieve-api $ACR_NAME.azurecr.io/pensieve-api:latest
 docker push $ACR_NAME.azurecr.io/pensieve-api:latest
 
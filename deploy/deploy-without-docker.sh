@@ -74,6 +74,10 @@ properties:
       args:
       - |
         pip install fastapi uvicorn motor passlib[bcrypt] python-jose[cryptography] python-multipart httpx pydantic python-dotenv &&
+        mkdir -p mcp_server && touch mcp_server/__init__.py &&
+        cat > mcp_server/text.py << 'PYTHON_EOF'
+$(cat ../mcp_server/text.py)
+PYTHON_EOF
         cat > main.py << 'PYTHON_EOF'
 $(cat ../api_server/main.py)
 PYTHON_EOF
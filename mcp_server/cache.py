@@ -0,0 +1,111 @@
+"""크기 제한이 있는 LRU 대화 캐시
+
+항목 수와 바이트 예산을 넘으면 가장 오래 사용하지 않은 대화부터 내보낸다.
+바이트는 압축을 푼 대화 JSON 크기로 계산한다 (압축된 스냅샷의 파일 크기가 아니라).
+다른 프로세스가 파일을 바꾸면 (storage.signature 의 mtime/크기가 달라지면)
+캐시 항목을 버리고 다시 읽게 한다.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class ConversationCache:
+    """파일 변경을 감지하는 LRU 캐시"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # conversation_id -> (data, 파일 (mtime_ns, size), 압축을 푼 바이트)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], Tuple[int, int], int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.RLock()
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, conversation_id: str, signature: Optional[Tuple[int, int]]) -> Optional[Dict[str, Any]]:
+        """캐시된 대화 반환 (없거나 파일이 바뀌었으면 None)
+
+        Args:
+            signature: 현재 대화 파일의 (mtime_ns, 바이트). 파일이 없으면 None
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            data, cached_signature, _ = entry
+            if signature != cached_signature:
+                # 다른 프로세스가 파일을 바꾸거나 지웠다
+                self.invalidations += 1
+                self.misses += 1
+                self.invalidate(conversation_id)
+                return None
+
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return data
+
+    def put(self, conversation_id: str, data: Dict[str, Any], signature: Optional[Tuple[int, int]], size: int) -> None:
+        """대화를 캐시에 넣고 예산을 넘으면 오래된 항목을 내보냄
+
+        Args:
+            size: 압축을 푼 대화 바이트 수 (storage.read_conversation_sized 등이 잰 값)
+        """
+        with self._lock:
+            self.invalidate(conversation_id)
+
+            if signature is None or size > self.max_bytes:
+                # 예산보다 큰 대화는 캐시하지 않는다
+                return
+
+            self._entries[conversation_id] = (data, signature, size)
+            self.total_bytes += size
+
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def size_of(self, conversation_id: str) -> Optional[int]:
+        """캐시된 대화의 바이트 수 (캐시에 없으면 None)"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            return entry[2] if entry is not None else None
+
+    def invalidate(self, conversation_id: str) -> None:
+        """대화를 캐시에서 제거"""
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self.total_bytes -= entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """캐시 크기 조정용 통계"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
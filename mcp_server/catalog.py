@@ -0,0 +1,160 @@
+"""로컬 대화 목록 카탈로그
+
+대화별 id, 메타데이터, 생성/수정 시각, 메시지 수만 SQLite 에 저장해 두어
+list_conversations 가 대화 본문(JSON 파일)을 읽지 않고 페이지 단위로 조회한다.
+"""
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from . import storage
+
+# 스키마가 바뀌면 올린다 (버전이 다르면 카탈로그를 비우고 다시 만든다)
+SCHEMA_VERSION = 1
+
+
+class Catalog:
+    """SQLite 기반 대화 요약 카탈로그"""
+
+    def __init__(self, db_path: Path, storage_dir: Path):
+        self.db_path = db_path
+        self.storage_dir = storage_dir
+        # 스레드 풀에서 동시에 호출되므로 연결 하나를 잠금으로 보호
+        self._lock = threading.RLock()
+        self.conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            # 손상된 카탈로그는 버리고 새로 만든다 (다음 sync 에서 전체 재구성)
+            print(f"Discarding corrupt catalog {self.db_path}: {e}", file=sys.stderr)
+            self.db_path.unlink(missing_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            version = 0
+
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if version != SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS conversations")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL,
+                created_at TEXT,
+                updated_at TEXT,
+                message_count INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS conversations_by_mtime
+                ON conversations (mtime_ns DESC);
+        """)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _summary(row) -> Dict[str, Any]:
+        conversation_id, metadata, created_at, updated_at, message_count = row
+        return {
+            "id": conversation_id,
+            "metadata": json.loads(metadata),
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "message_count": message_count
+        }
+
+    def upsert(self, conversation_data: Dict[str, Any], mtime_ns: int) -> None:
+        """대화 요약을 추가하거나 갱신"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    conversation_data["id"],
+                    json.dumps(conversation_data.get("metadata", {}), ensure_ascii=False),
+                    conversation_data.get("created_at"),
+                    conversation_data.get("updated_at"),
+                    len(conversation_data.get("messages", [])),
+                    mtime_ns
+                )
+            )
+
+    def record_append(self, conversation_id: str, added: int, updated_at: str, mtime_ns: int) -> None:
+        """메시지 추가를 요약에 반영"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE conversations SET message_count = message_count + ?, updated_at = ?, mtime_ns = ? "
+                "WHERE conversation_id = ?",
+                (added, updated_at, mtime_ns, conversation_id)
+            )
+
+    def remove(self, conversation_id: str) -> None:
+        """카탈로그에서 대화 제거"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """대화 하나의 요약 반환"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT conversation_id, metadata, created_at, updated_at, message_count "
+                "FROM conversations WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+            return self._summary(row) if row else None
+
+    def message_count(self, conversation_id: str, mtime_ns: int) -> Optional[int]:
+        """파일 수정 시각이 카탈로그와 같을 때만 메시지 수 반환 (다르면 None)"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT message_count FROM conversations WHERE conversation_id = ? AND mtime_ns = ?",
+                (conversation_id, mtime_ns)
+            ).fetchone()
+            return row[0] if row else None
+
+    def list(self, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """최근 수정 순으로 대화 요약 목록 반환"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT conversation_id, metadata, created_at, updated_at, message_count "
+                "FROM conversations ORDER BY mtime_ns DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            )
+            return [self._summary(row) for row in rows]
+
+    def sync(self) -> int:
+        """대화 파일과 카탈로그를 비교해 바뀐 대화만 다시 읽기
+
+        Returns:
+            갱신하거나 제거한 대화 수
+        """
+        with self._lock:
+            cataloged = dict(self.conn.execute("SELECT conversation_id, mtime_ns FROM conversations"))
+        changed = 0
+
+        for conversation_id in storage.conversation_ids(self.storage_dir):
+            try:
+                file_signature = storage.signature(self.storage_dir, conversation_id)
+                if file_signature is None:
+                    continue
+                mtime_ns = file_signature[0]
+                if cataloged.pop(conversation_id, None) == mtime_ns:
+                    continue
+                data = storage.read_conversation(self.storage_dir, conversation_id)
+                if data is None:
+                    continue
+                self.upsert(data, mtime_ns)
+                changed += 1
+            except Exception as e:
+                print(f"Error cataloging {conversation_id}: {e}", file=sys.stderr)
+
+        # 파일이 사라진 대화
+        for conversation_id in cataloged:
+            self.remove(conversation_id)
+            changed += 1
+
+        return changed
@@ -0,0 +1,76 @@
+"""토큰 예산에 맞춘 관련 메시지 묶음
+
+검색으로 고른 메시지들을 점수 순으로 예산이 찰 때까지 담고, 대화별로 묶어
+대화 안에서는 원래 순서대로 돌려준다. 토큰 수는 토크나이저 없이 글자 수로 어림한다.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .text import estimate_tokens, tokenize, truncate_to_tokens
+
+# 메시지마다 역할/구분자에 드는 토큰
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 남은 예산이 이보다 작으면 긴 메시지를 잘라 넣지 않는다
+MIN_TRUNCATED_TOKENS = 32
+
+
+def pack_context(
+    query: str,
+    hits: Iterable[Tuple[str, int, float]],
+    get_conversation: Callable[[str], Optional[Dict[str, Any]]],
+    max_tokens: int
+) -> Dict[str, Any]:
+    """점수 순 (conversation_id, message_index, score) 를 예산 안에서 묶음
+
+    Args:
+        get_conversation: 대화 ID -> 대화 (없으면 None)
+        max_tokens: 담을 메시지들의 근사 토큰 합 상한
+    """
+    used = 0
+    skipped = 0
+    conversations: Dict[str, Dict[str, Any]] = {}
+    for conversation_id, message_index, score in hits:
+        remaining = max_tokens - used
+        if remaining < MESSAGE_OVERHEAD_TOKENS + 1:
+            skipped += 1
+            continue
+
+        conversation = get_conversation(conversation_id)
+        messages = (conversation or {}).get("messages", [])
+        if message_index >= len(messages):
+            continue
+        message = messages[message_index]
+        content = message.get("content", "")
+        tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+        item = {"index": message_index, "role": message.get("role"), "content": content, "score": round(score, 4)}
+        if tokens > remaining:
+            # 너무 긴 메시지는 남은 예산이 넉넉하면 검색어 주변만 잘라 넣는다
+            if remaining - MESSAGE_OVERHEAD_TOKENS < MIN_TRUNCATED_TOKENS:
+                skipped += 1
+                continue
+            item["content"] = truncate_to_tokens(content, tokenize(query), remaining - MESSAGE_OVERHEAD_TOKENS)
+            item["truncated"] = True
+            tokens = estimate_tokens(item["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+        used += tokens
+        entry = conversations.get(conversation_id)
+        if entry is None:
+            entry = conversations[conversation_id] = {
+                "id": conversation_id,
+                "metadata": conversation.get("metadata", {}),
+                "created_at": conversation.get("created_at"),
+                "messages": []
+            }
+        entry["messages"].append(item)
+
+    # 대화는 가장 잘 맞는 메시지 순서, 대화 안의 메시지는 원래 순서
+    for entry in conversations.values():
+        entry["messages"].sort(key=lambda item: item["index"])
+    return {
+        "query": query,
+        "max_tokens": max_tokens,
+        "used_tokens": used,
+        "skipped": skipped,
+        "conversations": list(conversations.values())
+    }
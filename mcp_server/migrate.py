@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""저장된 대화 스냅샷을 다른 압축 형식으로 변환
+
+사용법:
+    python -m mcp_server.migrate --compression gzip
+    python -m mcp_server.migrate --compression none   # 압축 해제
+"""
+import argparse
+
+from . import storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="대화 스냅샷 압축 형식 변환")
+    parser.add_argument(
+        "--compression",
+        choices=sorted(storage.SNAPSHOT_SUFFIXES),
+        default=storage.COMPRESSION,
+        help="변환할 형식 (기본값: PENSIEVE_COMPRESSION)"
+    )
+    args = parser.parse_args()
+
+    stats = storage.migrate(storage.STORAGE_DIR, args.compression)
+    print(f"{stats['converted']}개 대화를 {args.compression} 형식으로 변환했습니다.")
+    print(f"스냅샷 크기: {stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""색인 없이 대화 파일을 직접 읽는 전체 스캔 검색
+
+대화 ID 를 정렬해 조각(shard)으로 나누고 프로세스 풀에서 병렬로 스캔한다.
+결과는 조각 순서대로 합치므로 항상 대화 ID 순서로 같은 결과가 나오고,
+앞 조각들에서 limit 개를 채우면 아직 시작하지 않은 조각은 취소한다.
+이미 워커에서 돌고 있는 조각은 끝까지 (또는 자기 limit 개까지) 스캔하며
+결과만 버린다. 조각을 작게 나누는 것(SHARDS_PER_WORKER)이 그 낭비를 줄인다.
+
+서버 프로세스에는 스레드와 SQLite 연결, 잡힌 잠금이 있으므로 fork 하지 않고
+spawn 으로 워커를 띄운다.
+
+워커 프로세스가 가볍게 import 할 수 있도록 이 모듈은 storage 만 사용한다.
+"""
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from . import storage
+
+# 대화가 이보다 적으면 프로세스를 띄우는 비용이 더 크므로 현재 스레드에서 스캔
+PARALLEL_MIN_CONVERSATIONS = 256
+
+# 워커당 조각 수 (조각이 작을수록 조기 종료가 빨라진다)
+SHARDS_PER_WORKER = 4
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def match_conversation(data: Dict[str, Any], query_lower: str) -> Optional[Dict[str, Any]]:
+    """대화가 검색어를 포함하면 검색 결과 항목 반환"""
+    messages = data.get("messages", [])
+
+    # 메시지 내용에서 검색
+    for message in messages:
+        content = message.get("content", "").lower()
+        if query_lower in content:
+            return {
+                "id": data["id"],
+                "metadata": data.get("metadata", {}),
+                "created_at": data.get("created_at"),
+                "matched_message": message,
+                "message_count": len(messages)
+            }
+
+    # 메타데이터에서도 검색
+    metadata_str = json.dumps(data.get("metadata", {}), ensure_ascii=False).lower()
+    if query_lower in metadata_str:
+        return {
+            "id": data["id"],
+            "metadata": data.get("metadata", {}),
+            "created_at": data.get("created_at"),
+            "message_count": len(messages)
+        }
+
+    return None
+
+
+def scan_shard(storage_dir: Path, conversation_ids: List[str], query_lower: str, limit: int) -> List[Dict[str, Any]]:
+    """대화 ID 목록을 순서대로 스캔 (limit 개를 찾으면 중단)"""
+    results = []
+    for conversation_id in conversation_ids:
+        try:
+            data = storage.read_conversation(storage_dir, conversation_id)
+            if data is None:
+                continue
+            result = match_conversation(data, query_lower)
+            if result is not None:
+                results.append(result)
+                if len(results) >= limit:
+                    break
+        except Exception as e:
+            print(f"Error searching {conversation_id}: {e}", file=sys.stderr)
+    return results
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def scan(storage_dir: Path, query: str, limit: int = 20, workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """모든 대화를 스캔해 부분 문자열 검색 (대화 ID 순서)
+
+    Args:
+        workers: 프로세스 수 (기본값: CPU 수). 1 이면 현재 스레드에서 스캔
+    """
+    query_lower = query.lower()
+    conversation_ids = sorted(storage.conversation_ids(storage_dir))
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(conversation_ids) < PARALLEL_MIN_CONVERSATIONS:
+        return scan_shard(storage_dir, conversation_ids, query_lower, limit)
+
+    shard_count = workers * SHARDS_PER_WORKER
+    shard_size = -(-len(conversation_ids) // shard_count)
+    pool = _get_pool(workers)
+    futures = [
+        pool.submit(scan_shard, storage_dir, conversation_ids[i:i + shard_size], query_lower, limit)
+        for i in range(0, len(conversation_ids), shard_size)
+    ]
+
+    results: List[Dict[str, Any]] = []
+    try:
+        # 조각 순서대로 합쳐야 결과 순서가 결정적이다
+        for future in futures:
+            results.extend(future.result())
+            if len(results) >= limit:
+                break
+    finally:
+        # 시작 전인 조각만 취소된다 (실행 중인 조각은 끝나면 결과가 버려짐)
+        for future in futures:
+            future.cancel()
+
+    return results[:limit]
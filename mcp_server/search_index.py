@@ -0,0 +1,764 @@
+"""로컬 대화 검색용 역색인 (token -> conversation/message postings)
+
+postings 는 SQLite 파일 하나에 저장되므로 검색 비용은 전체 대화 수가 아니라
+일치하는 posting 수에 비례한다. 색인이 JSON 파일과 어긋나면 sync() 로
+변경분만, rebuild() 로 전체를 다시 색인한다.
+
+검색 결과는 BM25 점수 순이다. 메시지 하나를 문서로 보고 점수를 매긴 뒤,
+대화 점수 = 가장 잘 맞는 메시지 점수 + METADATA_WEIGHT x 메타데이터(제목/태그) 점수.
+postings 를 대화 순서로 병합하며 크기 limit 의 힙만 유지하므로 일치하는
+문서가 아무리 많아도 메모리는 O(limit) 이다.
+
+numpy 가 있으면 첫 검색 때 postings 를 메모리의 연속 배열(토큰 순서 CSR)로 한 번
+읽어 두고, 저장/추가/삭제가 SQLite 와 함께 갱신한다 (_PostingArrays). 다른 프로세스가
+색인을 바꾸면 배열은 백그라운드에서 다시 읽고, 그동안 검색은 SQLite 에서 점수를 계산한다. 검색은
+배열 조각에서 BM25 점수, (대화, 메시지) 별 합, 대화별 최고 메시지, 상위 limit 개
+(argpartition)를 모두 배열 연산으로 계산하므로 SQLite 에서 행을 읽지 않는다.
+메모리는 posting 하나당 8바이트 정도이고, 검색 중 임시 배열은 일치한 posting 수에 비례한다.
+"""
+import array
+import bisect
+import heapq
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import storage
+from .text import BM25_B, BM25_K1, bm25, idf, tokenize
+
+# 스키마가 바뀌면 올린다 (버전이 다르면 색인을 비우고 다시 만든다)
+SCHEMA_VERSION = 2
+
+# 메타데이터 토큰은 이 message_index 로 색인
+METADATA_INDEX = -1
+
+# 제목/태그 일치 가중치
+METADATA_WEIGHT = 2.0
+
+# 필드별 통계 (문서 수, 전체 길이) 키
+FIELD_CONTENT = "content"
+FIELD_METADATA = "metadata"
+
+# 접두어 범위 검색의 상한 (어떤 코드 포인트보다도 큼)
+_PREFIX_END = "\U0010ffff"
+
+# 배열 postings: 병합 전 추가분이 이 수와 병합된 postings 의 1/8 중 큰 쪽을 넘으면 병합
+MERGE_MIN_PENDING = 65536
+# 다른 프로세스가 색인을 바꾼 뒤 배열을 다시 읽기 전에 기다리는 시간 (초). 그 사이의 쓰기는 한 번에 반영
+ARRAYS_RELOAD_DELAY = 1.0
+
+def metadata_text(metadata: Any) -> str:
+    """메타데이터 값(제목, 태그 등)을 검색 가능한 문자열로 변환"""
+    if isinstance(metadata, dict):
+        return " ".join(metadata_text(value) for value in metadata.values())
+    if isinstance(metadata, (list, tuple)):
+        return " ".join(metadata_text(value) for value in metadata)
+    return "" if metadata is None else str(metadata)
+
+
+class SearchIndex:
+    """SQLite 기반 역색인
+
+    검색어 토큰 중 하나라도 메시지(또는 메타데이터)에 있는 토큰의 접두어이면 일치로 보고
+    (OR), 일치한 토큰들의 BM25 점수 합으로 순위를 매긴다. 더 많은 검색어가 맞을수록
+    점수가 높다. 예를 들어 "대화" 는 "대화를" 이 들어 있는 메시지와 일치한다.
+    """
+
+    def __init__(self, db_path: Path, storage_dir: Path):
+        self.db_path = db_path
+        self.storage_dir = storage_dir
+        # 스레드 풀에서 동시에 호출되므로 연결 하나를 잠금으로 보호
+        self._lock = threading.RLock()
+        self.conn = self._connect()
+        # numpy 검색용 postings 사본 (첫 검색 때 만듦)과 그때의 SQLite data_version
+        self._arrays: Optional["_PostingArrays"] = None
+        self._arrays_version = None
+        # 배열을 다시 읽는 백그라운드 스레드, 이 연결로 한 쓰기 횟수 (읽는 도중 쓰기가 있었는지 확인용)
+        self._reload_thread: Optional[threading.Thread] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            # 손상된 색인은 버리고 새로 만든다 (다음 sync 에서 전체 재색인)
+            print(f"Discarding corrupt search index {self.db_path}: {e}", file=sys.stderr)
+            self.db_path.unlink(missing_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            version = 0
+
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if version != SCHEMA_VERSION:
+            conn.executescript("""
+                DROP TABLE IF EXISTS postings;
+                DROP TABLE IF EXISTS documents;
+                DROP TABLE IF EXISTS field_stats;
+            """)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                conversation_id TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                token TEXT NOT NULL,
+                conversation_id TEXT NOT NULL,
+                message_index INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                dl INTEGER NOT NULL,
+                PRIMARY KEY (token, conversation_id, message_index)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS field_stats (
+                field TEXT PRIMARY KEY,
+                doc_count INTEGER NOT NULL,
+                total_length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS postings_by_conversation
+                ON postings (conversation_id);
+        """)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        return conn
+
+    # ---------- 색인 갱신 ----------
+
+    @staticmethod
+    def _document_postings(conversation_id: str, message_index: int, text: str) -> List[Tuple[str, str, int, int, int]]:
+        tokens = tokenize(text)
+        return [
+            (token, conversation_id, message_index, tf, len(tokens))
+            for token, tf in Counter(tokens).items()
+        ]
+
+    def _insert(self, conversation_id: str, documents: Iterable[Tuple[int, str]]) -> List[List[Tuple[str, str, int, int, int]]]:
+        """(message_index, text) 문서들을 색인하고 필드 통계 갱신 (문서별 postings 반환)"""
+        totals = {FIELD_CONTENT: [0, 0], FIELD_METADATA: [0, 0]}
+        inserted = []
+        for message_index, text in documents:
+            rows = self._document_postings(conversation_id, message_index, text)
+            if not rows:
+                continue
+            self.conn.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?, ?, ?)", rows)
+            field = FIELD_METADATA if message_index == METADATA_INDEX else FIELD_CONTENT
+            totals[field][0] += 1
+            totals[field][1] += rows[0][4]
+            inserted.append(rows)
+        self._adjust_stats(totals)
+        return inserted
+
+    def _adjust_stats(self, totals: Dict[str, List[int]]) -> None:
+        for field, (doc_count, total_length) in totals.items():
+            if doc_count:
+                self.conn.execute(
+                    "INSERT INTO field_stats VALUES (?, ?, ?) ON CONFLICT(field) DO UPDATE SET "
+                    "doc_count = doc_count + excluded.doc_count, "
+                    "total_length = total_length + excluded.total_length",
+                    (field, doc_count, total_length)
+                )
+
+    def index_conversation(self, conversation_data: Dict[str, Any], mtime_ns: int) -> None:
+        """대화 전체를 (재)색인"""
+        conversation_id = conversation_data["id"]
+        documents = [(METADATA_INDEX, metadata_text(conversation_data.get("metadata", {})))]
+        documents.extend(
+            (i, message.get("content", ""))
+            for i, message in enumerate(conversation_data.get("messages", []))
+        )
+        with self._lock:
+            with self.conn:
+                self._delete(conversation_id)
+                inserted = self._insert(conversation_id, documents)
+                self.conn.execute(
+                    "INSERT INTO documents VALUES (?, ?)", (conversation_id, mtime_ns)
+                )
+            self._writes += 1
+            # 배열 사본은 SQLite 에 커밋된 뒤에 바꾼다
+            if self._arrays is not None:
+                self._arrays.remove(conversation_id)
+                self._arrays.add(conversation_id, inserted)
+
+    def add_messages(self, conversation_id: str, messages: List[Dict[str, Any]], start_index: int, mtime_ns: int) -> None:
+        """기존 대화에 추가된 메시지만 색인"""
+        with self._lock:
+            with self.conn:
+                inserted = self._insert(
+                    conversation_id,
+                    ((start_index + i, message.get("content", "")) for i, message in enumerate(messages))
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?)", (conversation_id, mtime_ns)
+                )
+            self._writes += 1
+            if self._arrays is not None:
+                self._arrays.add(conversation_id, inserted)
+
+    def _delete(self, conversation_id: str) -> None:
+        rows = self.conn.execute(
+            "SELECT message_index = ?, COUNT(*), SUM(dl) FROM ("
+            "  SELECT message_index, MAX(dl) AS dl FROM postings"
+            "  WHERE conversation_id = ? GROUP BY message_index"
+            ") GROUP BY message_index = ?",
+            (METADATA_INDEX, conversation_id, METADATA_INDEX)
+        ).fetchall()
+        self._adjust_stats({
+            FIELD_METADATA if is_metadata else FIELD_CONTENT: [-doc_count, -total_length]
+            for is_metadata, doc_count, total_length in rows
+        })
+        self.conn.execute("DELETE FROM postings WHERE conversation_id = ?", (conversation_id,))
+        self.conn.execute("DELETE FROM documents WHERE conversation_id = ?", (conversation_id,))
+
+    def remove(self, conversation_id: str) -> None:
+        """대화를 색인에서 제거"""
+        with self._lock:
+            with self.conn:
+                self._delete(conversation_id)
+            self._writes += 1
+            if self._arrays is not None:
+                self._arrays.remove(conversation_id)
+
+    # ---------- 파일과 동기화 ----------
+
+    def sync(self) -> int:
+        """대화 파일과 색인을 비교해 바뀐 대화만 다시 색인
+
+        Returns:
+            다시 색인하거나 제거한 대화 수
+        """
+        with self._lock:
+            indexed = dict(self.conn.execute("SELECT conversation_id, mtime_ns FROM documents"))
+        changed = 0
+
+        for conversation_id in storage.conversation_ids(self.storage_dir):
+            try:
+                file_signature = storage.signature(self.storage_dir, conversation_id)
+                if file_signature is None:
+                    continue
+                mtime_ns = file_signature[0]
+                if indexed.pop(conversation_id, None) == mtime_ns:
+                    continue
+                data = storage.read_conversation(self.storage_dir, conversation_id)
+                if data is None:
+                    continue
+                self.index_conversation(data, mtime_ns)
+                changed += 1
+            except Exception as e:
+                print(f"Error indexing {conversation_id}: {e}", file=sys.stderr)
+
+        # 파일이 사라진 대화
+        for conversation_id in indexed:
+            self.remove(conversation_id)
+            changed += 1
+
+        return changed
+
+    def rebuild(self) -> int:
+        """색인을 비우고 모든 대화를 다시 색인"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM postings")
+                self.conn.execute("DELETE FROM documents")
+                self.conn.execute("DELETE FROM field_stats")
+            self._writes += 1
+            # 다음 검색에서 처음처럼 다시 읽는다
+            self._arrays = None
+            self._arrays_version = None
+        return self.sync()
+
+    # ---------- 검색 ----------
+
+    def search(self, query: str, limit: int) -> Optional[List[Tuple[str, int, float]]]:
+        """BM25 점수가 높은 대화 limit 개 반환
+
+        Returns:
+            점수 내림차순 (conversation_id, message_index, score) 목록.
+            message_index 는 가장 잘 맞는 메시지 위치이며, 메타데이터만
+            일치하면 METADATA_INDEX. 검색어에 토큰이 없으면 None.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return None
+        if limit <= 0:
+            return []
+
+        with self._lock:
+            if np is not None and self._posting_arrays() is not None:
+                return self._search_numpy(terms, limit)
+            return self._search(terms, limit)
+
+    def _field_stats(self) -> Dict[str, Tuple[int, int]]:
+        return {
+            field: (doc_count, total_length)
+            for field, doc_count, total_length in self.conn.execute("SELECT * FROM field_stats")
+        }
+
+    def _term_weights(self, bounds: Tuple[str, str], stats: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[float, float]]:
+        """필드별 (IDF, 평균 문서 길이)"""
+        # 필드별 문서 빈도 (접두어로 여러 토큰이 일치해도 문서당 한 번)
+        df = {FIELD_CONTENT: 0, FIELD_METADATA: 0}
+        for is_metadata, count in self.conn.execute(
+            "SELECT message_index = ?, COUNT(*) FROM ("
+            "  SELECT DISTINCT conversation_id, message_index FROM postings"
+            "  WHERE token >= ? AND token < ?"
+            ") GROUP BY message_index = ?",
+            (METADATA_INDEX, *bounds, METADATA_INDEX)
+        ):
+            df[FIELD_METADATA if is_metadata else FIELD_CONTENT] = count
+
+        weights = {}
+        for field, (doc_count, total_length) in stats.items():
+            if doc_count:
+                weights[field] = (idf(doc_count, df[field]), total_length / doc_count)
+        return weights
+
+    def _term_postings(self, term: str, stats: Dict[str, Tuple[int, int]]) -> Iterator[Tuple[str, int, float]]:
+        """검색어 하나와 접두어가 일치하는 posting 을 (대화, 메시지) 순서로 점수와 함께"""
+        bounds = (term, term + _PREFIX_END)
+        weights = self._term_weights(bounds, stats)
+
+        rows = self.conn.execute(
+            "SELECT conversation_id, message_index, SUM(tf), MAX(dl) FROM postings "
+            "WHERE token >= ? AND token < ? "
+            "GROUP BY conversation_id, message_index "
+            "ORDER BY conversation_id, message_index",
+            bounds
+        )
+        for conversation_id, message_index, tf, dl in rows:
+            field = FIELD_METADATA if message_index == METADATA_INDEX else FIELD_CONTENT
+            term_idf, avgdl = weights.get(field, (0.0, 1.0))
+            yield conversation_id, message_index, bm25(tf, dl, term_idf, avgdl)
+
+    def search_messages(self, query: str, limit: int) -> Optional[List[Tuple[str, int, float]]]:
+        """BM25 점수가 높은 메시지 limit 개 반환 (여러 대화에 걸쳐)
+
+        메시지 점수에 그 대화의 METADATA_WEIGHT x 메타데이터 점수를 더한다.
+
+        Returns:
+            점수 내림차순 (conversation_id, message_index, score) 목록.
+            검색어에 토큰이 없으면 None.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return None
+        if limit <= 0:
+            return []
+
+        with self._lock:
+            if np is not None and self._posting_arrays() is not None:
+                return self._search_messages_numpy(terms, limit)
+            top: List[Tuple[float, str, int]] = []
+            for conversation_id, message_scores in self._conversation_scores(terms):
+                metadata_score = METADATA_WEIGHT * message_scores.pop(METADATA_INDEX, 0.0)
+                for message_index, score in message_scores.items():
+                    item = (score + metadata_score, conversation_id, -message_index)
+                    if len(top) < limit:
+                        heapq.heappush(top, item)
+                    elif item > top[0]:
+                        heapq.heapreplace(top, item)
+
+        return [
+            (conversation_id, -negative_index, score)
+            for score, conversation_id, negative_index in sorted(top, reverse=True)
+        ]
+
+    def _conversation_scores(self, terms: List[str]) -> Iterator[Tuple[str, Dict[int, float]]]:
+        """검색어별 posting 을 (대화, 메시지) 순서로 병합해 대화마다 {메시지 위치: 점수} 를 낸다"""
+        stats = self._field_stats()
+        merged = heapq.merge(*(self._term_postings(term, stats) for term in terms))
+
+        current_id = None
+        message_scores: Dict[int, float] = {}
+        for conversation_id, message_index, score in merged:
+            if conversation_id != current_id:
+                if current_id is not None:
+                    yield current_id, message_scores
+                current_id, message_scores = conversation_id, {}
+            message_scores[message_index] = message_scores.get(message_index, 0.0) + score
+        if current_id is not None:
+            yield current_id, message_scores
+
+    def _search(self, terms: List[str], limit: int) -> List[Tuple[str, int, float]]:
+        # 대화 단위로 모은 점수 중 크기 limit 의 힙만 유지한다
+        top: List[Tuple[float, str, int]] = []
+        for conversation_id, message_scores in self._conversation_scores(terms):
+            metadata_score = message_scores.pop(METADATA_INDEX, 0.0)
+            if message_scores:
+                best_index = max(message_scores, key=lambda i: (message_scores[i], -i))
+                best_score = message_scores[best_index]
+            else:
+                best_index, best_score = METADATA_INDEX, 0.0
+            item = (best_score + METADATA_WEIGHT * metadata_score, conversation_id, best_index)
+            if len(top) < limit:
+                heapq.heappush(top, item)
+            elif item > top[0]:
+                heapq.heapreplace(top, item)
+
+        return [
+            (conversation_id, message_index, score)
+            for score, conversation_id, message_index in sorted(top, reverse=True)
+        ]
+
+    # ---------- 배열 연산 점수 계산 (numpy) ----------
+
+    def _data_version(self) -> int:
+        # data_version 은 다른 연결이 커밋했을 때만 바뀐다
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _posting_arrays(self) -> Optional["_PostingArrays"]:
+        """배열 postings 사본 (첫 검색 때 SQLite 에서 읽음)
+
+        다른 프로세스가 색인을 바꿨으면 사본을 버리고 백그라운드에서 다시 읽는다.
+        다 읽을 때까지는 None 이므로 그동안 검색은 SQLite 에서 점수를 계산한다.
+        """
+        version = self._data_version()
+        if self._arrays is not None and version == self._arrays_version:
+            return self._arrays
+        if self._arrays_version is None:
+            self._arrays = _PostingArrays.load(self.conn)
+            self._arrays_version = version
+            return self._arrays
+
+        self._arrays = None
+        if self._reload_thread is None:
+            self._reload_thread = threading.Thread(target=self._reload_arrays, name="search-arrays", daemon=True)
+            self._reload_thread.start()
+        return None
+
+    def _reload_arrays(self) -> None:
+        """배열 사본을 별도 연결로 다시 읽음 (백그라운드 스레드)
+
+        ARRAYS_RELOAD_DELAY 만큼 기다린 뒤 읽고, 읽는 동안 어느 프로세스에서든 색인이
+        바뀌었으면 버리고 다시 기다린다. 쓰기가 이어지는 동안에는 다시 읽지 않는다.
+        """
+        while True:
+            time.sleep(ARRAYS_RELOAD_DELAY)
+            with self._lock:
+                version, writes = self._data_version(), self._writes
+            try:
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+                try:
+                    arrays = _PostingArrays.load(conn)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Error reloading search arrays: {e}", file=sys.stderr)
+                arrays = None
+
+            with self._lock:
+                if arrays is None or (self._data_version() == version and self._writes == writes):
+                    if arrays is not None and self._arrays_version is not None:
+                        self._arrays, self._arrays_version = arrays, version
+                    # 실패하면 다음 검색이 다시 시작한다
+                    self._reload_thread = None
+                    return
+
+    def _message_scores_numpy(self, terms: List[str]) -> Optional[Tuple[List[str], "np.ndarray", "np.ndarray", "np.ndarray"]]:
+        """(대화, 메시지) 별 BM25 점수 합을 배열로
+
+        Returns:
+            (대화 ID 목록 (정렬됨), 그 목록에서의 대화 위치, 메시지 위치, 점수). 일치가 없으면 None
+        """
+        arrays = self._posting_arrays()
+        arrays.merge_if_needed()
+        stats = self._field_stats()
+        # 전체 문서 크기의 배열 대신 일치한 문서의 (번호, 점수) 만 모은다
+        doc_parts, score_parts = [], []
+        for term in terms:
+            docs, tf = arrays.term_postings(term)
+            if not len(docs):
+                continue
+            # 필드(본문/메타데이터)마다 문서 빈도, IDF, 평균 길이가 다르다
+            is_metadata = arrays.doc_message[docs] == METADATA_INDEX
+            df = {FIELD_METADATA: int(is_metadata.sum())}
+            df[FIELD_CONTENT] = len(docs) - df[FIELD_METADATA]
+            weights = {
+                field: (idf(doc_count, df[field]), total_length / doc_count)
+                for field, (doc_count, total_length) in stats.items() if doc_count
+            }
+            content_idf, content_avgdl = weights.get(FIELD_CONTENT, (0.0, 1.0))
+            metadata_idf, metadata_avgdl = weights.get(FIELD_METADATA, (0.0, 1.0))
+            term_idf = np.where(is_metadata, metadata_idf, content_idf)
+            avgdl = np.where(is_metadata, metadata_avgdl, content_avgdl)
+            dl = arrays.doc_length[docs]
+            doc_parts.append(docs)
+            score_parts.append(term_idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl)))
+
+        if not doc_parts:
+            return None
+        # 검색어별 점수를 문서마다 더한다 (docs 는 문서 번호 순서)
+        docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        # 동점 순서를 _search 와 맞추려고 대화를 ID 순서로 번호 매긴다
+        numbers, inverse = np.unique(arrays.doc_conversation[docs], return_inverse=True)
+        names = [arrays.conversations[number] for number in numbers.tolist()]
+        order = sorted(range(len(names)), key=names.__getitem__)
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[order] = np.arange(len(names))
+        return [names[i] for i in order], rank[inverse], arrays.doc_message[docs].astype(np.int64), scores
+
+    def _search_numpy(self, terms: List[str], limit: int) -> List[Tuple[str, int, float]]:
+        """_search 와 같은 결과를 배열 연산으로"""
+        scored = self._message_scores_numpy(terms)
+        if scored is None:
+            return []
+        conversation_ids, conversation, message, scores = scored
+        count = len(conversation_ids)
+
+        is_metadata = message == METADATA_INDEX
+        metadata_score = np.zeros(count)
+        metadata_score[conversation[is_metadata]] = scores[is_metadata]
+
+        # 대화별 최고 메시지 (점수가 같으면 앞 메시지): (대화, -점수, 위치) 순으로 정렬해 대화마다 첫 행
+        content = ~is_metadata
+        c_conversation, c_message, c_scores = conversation[content], message[content], scores[content]
+        order = np.lexsort((c_message, -c_scores, c_conversation))
+        c_conversation = c_conversation[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = c_conversation[1:] != c_conversation[:-1]
+        best_score = np.zeros(count)
+        best_index = np.full(count, METADATA_INDEX, dtype=np.int64)
+        best_score[c_conversation[first]] = c_scores[order][first]
+        best_index[c_conversation[first]] = c_message[order][first]
+
+        total = best_score + METADATA_WEIGHT * metadata_score
+        top = _top_k(total, limit)
+        return [(str(conversation_ids[i]), int(best_index[i]), float(total[i])) for i in top]
+
+    def _search_messages_numpy(self, terms: List[str], limit: int) -> List[Tuple[str, int, float]]:
+        """search_messages 와 같은 결과를 배열 연산으로"""
+        scored = self._message_scores_numpy(terms)
+        if scored is None:
+            return []
+        conversation_ids, conversation, message, scores = scored
+
+        is_metadata = message == METADATA_INDEX
+        metadata_score = np.zeros(len(conversation_ids))
+        metadata_score[conversation[is_metadata]] = scores[is_metadata]
+
+        content = ~is_metadata
+        c_conversation, c_message = conversation[content], message[content]
+        total = scores[content] + METADATA_WEIGHT * metadata_score[c_conversation]
+        # 점수가 같으면 대화 ID 가 큰 쪽, 같은 대화 안에서는 앞 메시지 (_search 의 힙 순서와 같다)
+        top = _top_k(total, limit, c_conversation, -c_message)
+        return [(str(conversation_ids[c_conversation[i]]), int(c_message[i]), float(total[i])) for i in top]
+
+
+def _top_k(scores: "np.ndarray", limit: int, *tie_breakers: "np.ndarray") -> "np.ndarray":
+    """점수 상위 limit 개의 위치 (점수 내림차순, 같으면 tie_breakers 큰 순서)
+
+    argpartition 으로 후보를 고른 뒤 그것만 정렬한다. 경계 점수와 같은 항목은
+    모두 후보에 넣어야 동점 순서가 전체 정렬과 같아진다.
+    """
+    if limit <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if limit < len(scores):
+        threshold = scores[np.argpartition(-scores, limit - 1)[limit - 1]]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    keys = [-tie[candidates] for tie in reversed(tie_breakers)]
+    if not tie_breakers:
+        # 기본 동점 순서: 위치가 큰 쪽 (대화 ID 가 큰 쪽)
+        keys = [-candidates]
+    order = np.lexsort(keys + [-scores[candidates]])
+    return candidates[order][:limit]
+
+
+def _grow(values: "np.ndarray", capacity: int) -> "np.ndarray":
+    grown = np.zeros(capacity, dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+
+class _PostingArrays:
+    """SQLite postings 의 메모리 사본 (numpy 검색용)
+
+    병합된 postings 는 토큰 순서로 이어 붙인 연속 배열이라 (CSR) vocabulary[i] 의
+    postings 는 posting_doc[token_start[i]:token_start[i + 1]] 이고, 접두어가 같은
+    토큰들은 한 조각이 된다. 그 뒤에 추가된 postings 는 pending 에 토큰별로 모았다가
+    충분히 쌓이면 병합한다. 삭제는 문서를 죽은 것으로 표시하고 병합 때 빼낸다.
+    """
+
+    def __init__(self):
+        # 문서 = 메시지 하나 또는 대화 메타데이터
+        self.doc_count = 0
+        self.doc_conversation = np.zeros(0, dtype=np.int32)
+        self.doc_message = np.zeros(0, dtype=np.int32)
+        self.doc_length = np.zeros(0, dtype=np.float64)
+        self.doc_alive = np.zeros(0, dtype=bool)
+        self.dead = 0
+        # 대화 번호 <-> ID, 대화별 {메시지 위치: 문서 번호}
+        self.conversations: List[str] = []
+        self.conversation_numbers: Dict[str, int] = {}
+        self.conversation_docs: Dict[str, Dict[int, int]] = {}
+        # 병합된 postings
+        self.vocabulary: List[str] = []
+        self.token_start = np.zeros(1, dtype=np.int64)
+        self.posting_doc = np.zeros(0, dtype=np.int32)
+        self.posting_tf = np.zeros(0, dtype=np.int32)
+        # 병합 전 추가분: 토큰 -> (문서 번호들, tf 들), 접두어 검색용 정렬된 토큰 목록
+        self.pending: Dict[str, Tuple[array.array, array.array]] = {}
+        self.pending_tokens: List[str] = []
+        self.pending_count = 0
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "_PostingArrays":
+        """SQLite 의 postings 를 토큰 순서로 한 번 읽어 배열로"""
+        arrays = cls()
+        vocabulary, token_start = [], []
+        posting_doc, posting_tf = array.array("i"), array.array("i")
+        last_token = None
+        for token, conversation_id, message_index, tf, dl in conn.execute(
+            "SELECT token, conversation_id, message_index, tf, dl FROM postings ORDER BY token"
+        ):
+            if token != last_token:
+                vocabulary.append(token)
+                token_start.append(len(posting_doc))
+                last_token = token
+            documents = arrays.conversation_docs.get(conversation_id)
+            doc = None if documents is None else documents.get(message_index)
+            if doc is None:
+                doc = arrays._new_doc(conversation_id, message_index, dl)
+            posting_doc.append(doc)
+            posting_tf.append(tf)
+
+        token_start.append(len(posting_doc))
+        arrays.vocabulary = vocabulary
+        arrays.token_start = np.array(token_start, dtype=np.int64)
+        arrays.posting_doc = np.frombuffer(posting_doc, dtype=np.int32).copy()
+        arrays.posting_tf = np.frombuffer(posting_tf, dtype=np.int32).copy()
+        return arrays
+
+    def _new_doc(self, conversation_id: str, message_index: int, length: int) -> int:
+        number = self.conversation_numbers.get(conversation_id)
+        if number is None:
+            number = self.conversation_numbers[conversation_id] = len(self.conversations)
+            self.conversations.append(conversation_id)
+
+        doc = self.doc_count
+        if doc == len(self.doc_alive):
+            # 용량을 두 배씩 늘려 추가가 평균 O(1) 이 되게 한다
+            capacity = max(2 * doc, 1024)
+            self.doc_conversation = _grow(self.doc_conversation, capacity)
+            self.doc_message = _grow(self.doc_message, capacity)
+            self.doc_length = _grow(self.doc_length, capacity)
+            self.doc_alive = _grow(self.doc_alive, capacity)
+        self.doc_conversation[doc] = number
+        self.doc_message[doc] = message_index
+        self.doc_length[doc] = length
+        self.doc_alive[doc] = True
+        self.doc_count += 1
+        self.conversation_docs.setdefault(conversation_id, {})[message_index] = doc
+        return doc
+
+    def _kill(self, doc: int) -> None:
+        if self.doc_alive[doc]:
+            self.doc_alive[doc] = False
+            self.dead += 1
+
+    def add(self, conversation_id: str, documents: List[List[Tuple[str, str, int, int, int]]]) -> None:
+        """_insert 가 색인한 문서별 postings 를 추가"""
+        for rows in documents:
+            message_index, dl = rows[0][2], rows[0][4]
+            old = self.conversation_docs.get(conversation_id, {}).get(message_index)
+            if old is not None:
+                # INSERT OR REPLACE 와 같이 같은 메시지는 새 문서로 바꾼다
+                self._kill(old)
+            doc = self._new_doc(conversation_id, message_index, dl)
+            for token, _, _, tf, _ in rows:
+                entry = self.pending.get(token)
+                if entry is None:
+                    entry = self.pending[token] = (array.array("i"), array.array("i"))
+                    bisect.insort(self.pending_tokens, token)
+                entry[0].append(doc)
+                entry[1].append(tf)
+            self.pending_count += len(rows)
+
+    def remove(self, conversation_id: str) -> None:
+        for doc in self.conversation_docs.pop(conversation_id, {}).values():
+            self._kill(doc)
+
+    def term_postings(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """term 을 접두어로 갖는 토큰들의 살아 있는 (문서 번호, tf 합). 문서마다 한 행"""
+        lo = bisect.bisect_left(self.vocabulary, term)
+        hi = bisect.bisect_left(self.vocabulary, term + _PREFIX_END)
+        doc_parts = [self.posting_doc[self.token_start[lo]:self.token_start[hi]]]
+        tf_parts = [self.posting_tf[self.token_start[lo]:self.token_start[hi]]]
+        tokens = hi - lo
+
+        pending_lo = bisect.bisect_left(self.pending_tokens, term)
+        pending_hi = bisect.bisect_left(self.pending_tokens, term + _PREFIX_END)
+        for token in self.pending_tokens[pending_lo:pending_hi]:
+            docs, tfs = self.pending[token]
+            doc_parts.append(np.array(docs, dtype=np.int32))
+            tf_parts.append(np.array(tfs, dtype=np.int32))
+        tokens += pending_hi - pending_lo
+
+        docs = np.concatenate(doc_parts)
+        tf = np.concatenate(tf_parts).astype(np.float64)
+        alive = self.doc_alive[docs]
+        docs, tf = docs[alive], tf[alive]
+        if tokens > 1:
+            # 접두어가 여러 토큰에 맞으면 한 문서에 행이 여럿: tf 를 더한다
+            docs, inverse = np.unique(docs, return_inverse=True)
+            tf = np.bincount(inverse, weights=tf)
+        return docs, tf
+
+    def merge_if_needed(self) -> None:
+        if self.pending_count > max(MERGE_MIN_PENDING, len(self.posting_doc) // 8) or self.dead > max(
+            MERGE_MIN_PENDING, self.doc_count // 2
+        ):
+            self.merge()
+
+    def merge(self) -> None:
+        """pending 을 병합된 배열에 합치고 죽은 문서를 빼낸다"""
+        vocabulary = sorted(set(self.vocabulary).union(self.pending))
+        numbers = {token: i for i, token in enumerate(vocabulary)}
+
+        # 병합된 postings 의 토큰 번호를 새 vocabulary 번호로
+        remap = np.array([numbers[token] for token in self.vocabulary], dtype=np.int64)
+        token_parts = [np.repeat(remap, np.diff(self.token_start))]
+        doc_parts, tf_parts = [self.posting_doc], [self.posting_tf]
+        for token, (docs, tfs) in self.pending.items():
+            token_parts.append(np.full(len(docs), numbers[token], dtype=np.int64))
+            doc_parts.append(np.array(docs, dtype=np.int32))
+            tf_parts.append(np.array(tfs, dtype=np.int32))
+        tokens = np.concatenate(token_parts)
+        docs = np.concatenate(doc_parts)
+        tfs = np.concatenate(tf_parts)
+
+        # 죽은 문서를 빼고 문서 번호를 당긴다
+        keep = self.doc_alive[:self.doc_count]
+        doc_remap = np.cumsum(keep, dtype=np.int64) - 1
+        alive = keep[docs]
+        tokens, docs, tfs = tokens[alive], doc_remap[docs[alive]].astype(np.int32), tfs[alive]
+        self.doc_conversation = self.doc_conversation[:self.doc_count][keep]
+        self.doc_message = self.doc_message[:self.doc_count][keep]
+        self.doc_length = self.doc_length[:self.doc_count][keep]
+        self.doc_count = len(self.doc_message)
+        self.doc_alive = np.ones(self.doc_count, dtype=bool)
+        self.dead = 0
+        self.conversation_docs = {
+            conversation_id: {message_index: int(doc_remap[doc]) for message_index, doc in documents.items()}
+            for conversation_id, documents in self.conversation_docs.items()
+        }
+
+        # 토큰 순서로 다시 이어 붙이고 posting 이 없는 토큰은 버린다
+        order = np.argsort(tokens, kind="stable")
+        counts = np.bincount(tokens, minlength=len(vocabulary))
+        self.vocabulary = [token for token, count in zip(vocabulary, counts.tolist()) if count]
+        self.token_start = np.concatenate(([0], np.cumsum(counts[counts > 0])))
+        self.posting_doc = docs[order]
+        self.posting_tf = tfs[order]
+        self.pending = {}
+        self.pending_tokens = []
+        self.pending_count = 0
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 import asyncio
+import base64
+import functools
 import json
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Any
@@ -16,120 +21,463 @@ from mcp.types import (
 )
 from mcp.server.stdio import stdio_server
 
+from .cache import ConversationCache
+from .catalog import Catalog
+from .context import pack_context
+from . import scan, storage
+from .search_index import METADATA_INDEX, SearchIndex
+from .text import make_snippet, tokenize
+from .vector_index import VectorIndex, make_embedder
+
 # 대화 저장 디렉토리
-STORAGE_DIR = Path.home() / ".pensieve-mcp" / "conversations"
-STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+STORAGE_DIR = storage.STORAGE_DIR
+
+# 검색용 역색인 (서버 시작 시 JSON 파일과 동기화)
+INDEX_PATH = STORAGE_DIR.parent / "index.sqlite3"
+
+# 검색 방식: index (역색인, BM25 점수 순), scan (전체 파일 부분 문자열 일치)
+# 또는 semantic (메시지 벡터 코사인 유사도 순)
+SEARCH_MODES = ("index", "scan", "semantic")
+SEARCH_MODE = os.getenv("PENSIEVE_SEARCH_MODE", "index")
+# 전체 스캔에 쓸 프로세스 수 (기본값: CPU 수)
+SCAN_WORKERS = int(os.getenv("PENSIEVE_SCAN_WORKERS", "0")) or os.cpu_count() or 1
+
+# 의미 검색용 벡터 색인 (PENSIEVE_SEMANTIC=1 이거나 기본 검색이 semantic 일 때만, numpy 필요)
+SEMANTIC_ENABLED = SEARCH_MODE == "semantic" or os.getenv("PENSIEVE_SEMANTIC", "").lower() in ("1", "true", "yes")
+VECTOR_INDEX_PATH = STORAGE_DIR.parent / "vectors.npz"
+# 대화마다 한 결과만 남기므로 메시지는 limit 의 몇 배를 가져온다
+SEMANTIC_OVERFETCH = 5
+# 이보다 유사도가 낮은 메시지는 결과에서 뺀다
+SEMANTIC_MIN_SCORE = float(os.getenv("PENSIEVE_SEMANTIC_MIN_SCORE", "0.05"))
+
+# 목록 조회용 카탈로그 (대화 본문 없이 요약만 저장)
+CATALOG_PATH = STORAGE_DIR.parent / "catalog.sqlite3"
 
 # 서버 인스턴스
 app = Server("pensieve-mcp")
 
-# 메모리 내 대화 캐시 (성능 향상)
-conversation_cache: Dict[str, Dict[str, Any]] = {}
+# 파일 I/O 는 이벤트 루프 밖의 스레드 풀에서 (동시 실행 수 제한)
+IO_WORKERS = int(os.getenv("PENSIEVE_IO_WORKERS", "4"))
+
+# spawn 으로 뜬 스캔 워커는 이 모듈(python -m mcp_server.server)을 __mp_main__ 으로 다시 실행한다.
+# 워커는 scan 과 storage 만 쓰므로 디렉토리, 색인, 카탈로그, 캐시, 스레드 풀은 서버 프로세스에서만 만든다
+if __name__ != "__mp_main__":
+    STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    search_index = SearchIndex(INDEX_PATH, STORAGE_DIR)
+    vector_index = VectorIndex(VECTOR_INDEX_PATH, STORAGE_DIR, make_embedder()) if SEMANTIC_ENABLED else None
+    catalog = Catalog(CATALOG_PATH, STORAGE_DIR)
+    # 메모리 내 대화 캐시 (성능 향상, LRU 로 항목 수/바이트 제한)
+    conversation_cache = ConversationCache(
+        max_entries=int(os.getenv("PENSIEVE_CACHE_MAX_ENTRIES", "256")),
+        max_bytes=int(os.getenv("PENSIEVE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    )
+    io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="pensieve-io")
+
+# 같은 대화에 대한 저장/추가는 순서대로 (대화 ID 별 잠금, 고정 개수로 분할)
+_conversation_locks = [threading.Lock() for _ in range(64)]
+
+
+def _conversation_lock(conversation_id: str) -> threading.Lock:
+    return _conversation_locks[hash(conversation_id) % len(_conversation_locks)]
+
+
+async def run_blocking(func, *args, **kwargs):
+    """블로킹 함수를 I/O 스레드 풀에서 실행"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
 
 
 def save_conversation(conversation_id: str, messages: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """대화를 파일 시스템에 저장"""
-    conversation_data = {
-        "id": conversation_id,
-        "messages": messages,
-        "metadata": metadata or {},
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
-    }
+    with _conversation_lock(conversation_id):
+        now = datetime.now().isoformat()
     
-    # 파일로 저장
-    file_path = STORAGE_DIR / f"{conversation_id}.json"
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(conversation_data, f, ensure_ascii=False, indent=2)
+        # 같은 ID 로 다시 저장하면 생성 시각은 유지
+        existing = catalog.get(conversation_id)
+        conversation_data = {
+            "id": conversation_id,
+            "messages": messages,
+            "metadata": metadata or {},
+            "created_at": existing["created_at"] if existing and existing["created_at"] else now,
+            "updated_at": now
+        }
     
-    # 캐시에도 저장
-    conversation_cache[conversation_id] = conversation_data
+        # 파일로 저장
+        size = storage.write_conversation(STORAGE_DIR, conversation_data)
+        file_signature = storage.signature(STORAGE_DIR, conversation_id)
     
-    return conversation_data
+        # 카탈로그와 검색 색인 갱신 (실패해도 저장은 유지 - 다음 sync 에서 복구)
+        try:
+            catalog.upsert(conversation_data, file_signature[0])
+            search_index.index_conversation(conversation_data, file_signature[0])
+            if vector_index is not None:
+                vector_index.index_conversation(conversation_data, file_signature[0])
+        except Exception as e:
+            print(f"Error indexing {conversation_id}: {e}", file=sys.stderr)
+    
+        # 캐시에도 저장
+        conversation_cache.put(conversation_id, conversation_data, file_signature, size)
+    
+        return conversation_data
 
 
 def load_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
     """대화를 파일 시스템에서 불러오기"""
-    # 캐시 확인
-    if conversation_id in conversation_cache:
-        return conversation_cache[conversation_id]
+    file_signature = storage.signature(STORAGE_DIR, conversation_id)
+    if file_signature is None:
+        return None
     
-    # 파일에서 로드
-    file_path = STORAGE_DIR / f"{conversation_id}.json"
-    if file_path.exists():
-        with open(file_path, 'r', encoding='utf-8') as f:
-            conversation_data = json.load(f)
-            conversation_cache[conversation_id] = conversation_data
-            return conversation_data
+    # 캐시 확인 (파일이 바뀌었으면 캐시 항목은 무효)
+    cached = conversation_cache.get(conversation_id, file_signature)
+    if cached is not None:
+        return cached
     
-    return None
+    # 파일에서 로드 (스냅샷 + 추가 로그)
+    loaded = storage.read_conversation_sized(STORAGE_DIR, conversation_id)
+    if loaded is None:
+        return None
+    conversation_data, size = loaded
+    conversation_cache.put(conversation_id, conversation_data, file_signature, size)
+    return conversation_data
 
 
-def list_conversations(limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
-    """저장된 모든 대화 목록 반환"""
-    conversations = []
+def encode_message_cursor(conversation_id: str, offset: int) -> str:
+    payload = {"c": conversation_id, "o": offset}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_message_cursor(cursor: str, conversation_id: str) -> int:
+    """커서에서 다음 메시지 위치를 꺼냄 (다른 대화의 커서면 ValueError)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["c"] != conversation_id:
+            raise ValueError
+        return max(int(payload["o"]), 0)
+    except Exception:
+        raise ValueError(f"잘못된 커서입니다: {cursor}")
+
+
+def load_message_range(
+    conversation_id: str,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    last: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """대화의 메시지 일부만 반환 (대화가 없으면 None)
+    
+    cursor 가 있으면 offset 대신 커서 위치부터. last 는 offset/limit 보다 우선하며,
+    max_bytes 를 넘기 전까지 (적어도 메시지 하나는) 담는다. last 와 함께 쓰면 최신 메시지부터 채운다.
+    직렬화는 고른 구간만 하므로 긴 대화도 응답 크기가 범위만큼으로 제한된다.
+    """
+    if any(value is not None and value < 0 for value in (offset, limit, last, max_bytes)):
+        raise ValueError("offset, limit, last, max_bytes 는 0 이상이어야 합니다")
+    conversation = load_conversation(conversation_id)
+    if conversation is None:
+        return None
+    
+    messages = conversation.get("messages", [])
+    total = len(messages)
+    if cursor:
+        offset = decode_message_cursor(cursor, conversation_id)
+    if last is not None:
+        start, end = max(total - last, 0), total
+    else:
+        start = min(offset or 0, total)
+        end = total if limit is None else min(start + limit, total)
     
-    # 모든 JSON 파일 읽기
-    json_files = sorted(STORAGE_DIR.glob("*.json"), key=lambda x: x.stat().st_mtime, reverse=True)
+    # 바이트 예산만큼 (last 면 뒤에서부터) 줄인다
+    used = 0
+    if max_bytes is not None:
+        positions = range(end - 1, start - 1, -1) if last is not None else range(start, end)
+        for count, position in enumerate(positions):
+            size = len(json.dumps(messages[position], ensure_ascii=False).encode())
+            if count and used + size > max_bytes:
+                if last is not None:
+                    start = position + 1
+                else:
+                    end = position
+                break
+            used += size
+    
+    # 캐시된 대화를 바꾸지 않도록 복사본에 담는다
+    result = {key: value for key, value in conversation.items() if key != "messages"}
+    result["messages"] = messages[start:end]
+    result["range"] = {"start": start, "end": end, "total": total}
+    result["next_cursor"] = encode_message_cursor(conversation_id, end) if end < total else None
+    return result
+
+
+def append_to_conversation(conversation_id: str, messages: List[Dict[str, Any]]) -> Optional[int]:
+    """기존 대화에 메시지 추가 (로그에 덧붙이므로 기존 메시지 수와 무관)
+    
+    Returns:
+        추가 후 전체 메시지 수. 대화가 없으면 None
+    """
+    with _conversation_lock(conversation_id):
+        file_signature = storage.signature(STORAGE_DIR, conversation_id)
+        if file_signature is None:
+            return None
+    
+        # 기존 메시지 수는 카탈로그에서 (파일이 밖에서 바뀌었으면 직접 읽는다)
+        start_index = catalog.message_count(conversation_id, file_signature[0])
+        catalog_current = start_index is not None
+        cached = conversation_cache.get(conversation_id, file_signature)
+        if not catalog_current:
+            conversation = cached or load_conversation(conversation_id)
+            if conversation is None:
+                return None
+            cached = conversation
+            start_index = len(conversation.get("messages", []))
+    
+        updated_at = datetime.now().isoformat()
+        appended = storage.append_messages(STORAGE_DIR, conversation_id, messages, start_index, updated_at)
+        file_signature = storage.signature(STORAGE_DIR, conversation_id)
     
-    for file_path in json_files[offset:offset + limit]:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 메타데이터만 포함한 간략한 정보
-                conversations.append({
-                    "id": data["id"],
-                    "metadata": data.get("metadata", {}),
-                    "created_at": data.get("created_at"),
-                    "updated_at": data.get("updated_at"),
-                    "message_count": len(data.get("messages", []))
-                })
+            if catalog_current:
+                catalog.record_append(conversation_id, len(messages), updated_at, file_signature[0])
+            else:
+                catalog.upsert(storage.read_conversation(STORAGE_DIR, conversation_id), file_signature[0])
+            search_index.add_messages(conversation_id, messages, start_index, file_signature[0])
+            if vector_index is not None:
+                vector_index.add_messages(conversation_id, messages, start_index, file_signature[0])
         except Exception as e:
-            print(f"Error loading {file_path}: {e}")
+            print(f"Error indexing {conversation_id}: {e}", file=sys.stderr)
+    
+        # 캐시에 있던 대화는 다시 읽지 않고 이어 붙인 새 dict 로 바꾼다
+        # (이미 반환된 캐시 항목을 들고 있는 호출자가 있으므로 제자리에서 고치지 않는다)
+        if cached is not None:
+            cached_size = conversation_cache.size_of(conversation_id)
+            if cached_size is not None:
+                updated = {**cached, "messages": cached.get("messages", []) + messages, "updated_at": updated_at}
+                conversation_cache.put(conversation_id, updated, file_signature, cached_size + appended)
     
-    return conversations
+        return start_index + len(messages)
 
 
-def search_conversations(query: str, limit: int = 20) -> List[Dict[str, Any]]:
-    """대화 내용 검색"""
+def list_conversations(limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """저장된 모든 대화 목록 반환 (카탈로그에서 조회)"""
+    return catalog.list(limit, offset)
+
+
+def search_conversations(query: str, limit: int = 20, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+    """대화 내용 검색 (기본: 역색인 + BM25 점수 순)
+    
+    Args:
+        mode: index, scan, semantic 중 하나 (기본값: PENSIEVE_SEARCH_MODE)
+    """
+    mode = mode or SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"알 수 없는 검색 방식: {mode}")
+    if mode == "scan":
+        return scan_conversations(query, limit)
+    
+    if mode == "semantic":
+        hits = semantic_hits(query, limit)
+    else:
+        hits = search_index.search(query, limit)
+    if hits is None:
+        # 토큰이 없는 검색어 (기호만 있는 경우 등)는 전체 스캔
+        return scan_conversations(query, limit)
+    return search_results(query, hits)
+
+
+def semantic_hits(query: str, limit: int) -> Optional[List[Any]]:
+    """벡터 색인에서 대화마다 가장 가까운 메시지 하나씩, 유사도 순으로 limit 개"""
+    if vector_index is None:
+        raise ValueError("의미 검색이 꺼져 있습니다 (PENSIEVE_SEMANTIC=1 로 켜세요)")
+    hits = vector_index.search(query, limit * SEMANTIC_OVERFETCH)
+    if hits is None:
+        return None
+    best: Dict[str, Any] = {}
+    for conversation_id, message_index, score in hits:
+        if score < SEMANTIC_MIN_SCORE:
+            break
+        if conversation_id not in best:
+            best[conversation_id] = (conversation_id, message_index, score)
+            if len(best) >= limit:
+                break
+    return list(best.values())
+
+
+def search_results(query: str, hits: List[Any]) -> List[Dict[str, Any]]:
+    """(대화 ID, 메시지 위치, 점수) 를 검색 결과 항목으로 (일치한 메시지만 본문을 읽는다)"""
     results = []
-    query_lower = query.lower()
+    for conversation_id, message_index, score in hits:
+        summary = catalog.get(conversation_id)
+        result = {
+            "id": conversation_id,
+            "metadata": summary["metadata"] if summary else {},
+            "created_at": summary["created_at"] if summary else None,
+            "message_count": summary["message_count"] if summary else 0,
+            "score": round(score, 4)
+        }
+        
+        # 메시지가 일치한 경우에만 본문을 읽는다
+        if message_index != METADATA_INDEX or summary is None:
+            data = load_conversation(conversation_id)
+            if data is None:
+                # 다른 곳에서 삭제된 대화
+                search_index.remove(conversation_id)
+                catalog.remove(conversation_id)
+                if vector_index is not None:
+                    vector_index.remove(conversation_id)
+                continue
+            messages = data.get("messages", [])
+            result.update({
+                "metadata": data.get("metadata", {}),
+                "created_at": data.get("created_at"),
+                "message_count": len(messages)
+            })
+            if message_index != METADATA_INDEX and message_index < len(messages):
+                result["matched_message"] = messages[message_index]
+                result["snippet"] = make_snippet(messages[message_index].get("content", ""), tokenize(query))
+        
+        results.append(result)
     
-    for file_path in STORAGE_DIR.glob("*.json"):
+    return results
+
+
+def scan_conversations(query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """색인 없이 모든 대화 파일을 읽어 부분 문자열 검색 (여러 프로세스로 병렬 스캔)"""
+    return scan.scan(STORAGE_DIR, query, limit, SCAN_WORKERS)
+
+
+# retrieve_context 가 예산을 채우려고 살펴볼 최대 메시지 수
+CONTEXT_CANDIDATES = 200
+
+
+def retrieve_context(query: str, max_tokens: int = 2000) -> Dict[str, Any]:
+    """검색어와 관련된 메시지를 여러 대화에서 골라 토큰 예산 안에 묶음"""
+    hits = None if SEARCH_MODE == "scan" else search_index.search_messages(query, CONTEXT_CANDIDATES)
+    loaded: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+        if conversation_id not in loaded:
+            loaded[conversation_id] = load_conversation(conversation_id)
+        return loaded[conversation_id]
+
+    if hits is None:
+        # 색인을 쓰지 않으면 스캔으로 찾은 대화에서 검색어가 든 메시지를 모두 후보로
+        query_lower = query.lower()
+        hits = []
+        for result in scan_conversations(query, CONTEXT_CANDIDATES):
+            conversation = get_conversation(result["id"]) or {}
+            for index, message in enumerate(conversation.get("messages", [])):
+                if query_lower in message.get("content", "").lower():
+                    hits.append((result["id"], index, 0.0))
+
+    return pack_context(query, hits, get_conversation, max_tokens)
+
+
+# 일괄 처리 한 번에 받을 최대 항목 수
+MAX_BATCH_ITEMS = 100
+
+
+def _check_batch(items: Any, name: str) -> None:
+    if not isinstance(items, list):
+        raise ValueError(f"{name} 는 배열이어야 합니다")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"한 번에 최대 {MAX_BATCH_ITEMS}개까지 처리할 수 있습니다")
+
+
+def _check_messages(messages: Any) -> None:
+    if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+        raise ValueError("messages 는 메시지 객체의 배열이어야 합니다")
+
+
+async def save_many(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """여러 대화를 동시에 저장 (fsync 는 storage 의 그룹 커밋으로 묶인다)"""
+    _check_batch(items, "conversations")
+
+    async def save_one(index: int, item: Any) -> Dict[str, Any]:
+        if not isinstance(item, dict):
+            return {"index": index, "status": "invalid", "error": "항목은 객체여야 합니다"}
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                # 메시지 내용에서 검색
-                for message in data.get("messages", []):
-                    content = message.get("content", "").lower()
-                    if query_lower in content:
-                        results.append({
-                            "id": data["id"],
-                            "metadata": data.get("metadata", {}),
-                            "created_at": data.get("created_at"),
-                            "matched_message": message,
-                            "message_count": len(data.get("messages", []))
-                        })
-                        break
-                
-                # 메타데이터에서도 검색
-                metadata_str = json.dumps(data.get("metadata", {})).lower()
-                if query_lower in metadata_str and data["id"] not in [r["id"] for r in results]:
-                    results.append({
-                        "id": data["id"],
-                        "metadata": data.get("metadata", {}),
-                        "created_at": data.get("created_at"),
-                        "message_count": len(data.get("messages", []))
-                    })
-                    
-                if len(results) >= limit:
-                    break
-                    
+            _check_messages(item.get("messages"))
+        except ValueError as e:
+            return {"index": index, "status": "invalid", "error": str(e)}
+        conversation_id = item.get("conversation_id") or item.get("id") or str(uuid4())
+        try:
+            await run_blocking(save_conversation, conversation_id, item["messages"], item.get("metadata", {}))
         except Exception as e:
-            print(f"Error searching {file_path}: {e}")
-    
-    return results[:limit]
+            return {"index": index, "id": conversation_id, "status": "error", "error": str(e)}
+        return {"index": index, "id": conversation_id, "status": "saved"}
+
+    return list(await asyncio.gather(*(save_one(i, item) for i, item in enumerate(items))))
+
+
+async def load_many(conversation_ids: List[str]) -> List[Dict[str, Any]]:
+    """여러 대화를 동시에 불러오기 (요청한 순서대로)"""
+    _check_batch(conversation_ids, "conversation_ids")
+    unique_ids = list(dict.fromkeys(conversation_ids))
+    loaded = await asyncio.gather(
+        *(run_blocking(load_conversation, conversation_id) for conversation_id in unique_ids),
+        return_exceptions=True
+    )
+    found = dict(zip(unique_ids, loaded))
+
+    results = []
+    for conversation_id in conversation_ids:
+        conversation = found[conversation_id]
+        if isinstance(conversation, Exception):
+            results.append({"id": conversation_id, "status": "error", "error": str(conversation)})
+        elif conversation is None:
+            results.append({"id": conversation_id, "status": "not_found"})
+        else:
+            results.append({"id": conversation_id, "status": "ok", "conversation": conversation})
+    return results
+
+
+async def append_many(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """여러 대화에 메시지 추가
+
+    같은 대화의 항목은 요청 순서대로 이어 붙여 로그에 한 번만 쓰고,
+    서로 다른 대화는 동시에 처리한다.
+    """
+    _check_batch(items, "items")
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    groups: Dict[str, List[int]] = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("conversation_id"):
+            results[index] = {"index": index, "status": "invalid", "error": "conversation_id 가 필요합니다"}
+            continue
+        try:
+            _check_messages(item.get("messages"))
+        except ValueError as e:
+            results[index] = {"index": index, "id": item["conversation_id"], "status": "invalid", "error": str(e)}
+            continue
+        groups.setdefault(item["conversation_id"], []).append(index)
+
+    async def append_group(conversation_id: str, indexes: List[int]) -> None:
+        messages = [message for index in indexes for message in items[index]["messages"]]
+        try:
+            total = await run_blocking(append_to_conversation, conversation_id, messages)
+        except Exception as e:
+            for index in indexes:
+                results[index] = {"index": index, "id": conversation_id, "status": "error", "error": str(e)}
+            return
+        for index in indexes:
+            if total is None:
+                results[index] = {"index": index, "id": conversation_id, "status": "not_found"}
+            else:
+                results[index] = {"index": index, "id": conversation_id, "status": "appended",
+                                  "added": len(items[index]["messages"])}
+
+    await asyncio.gather(*(append_group(conversation_id, indexes) for conversation_id, indexes in groups.items()))
+    return results
+
+
+# load_conversation 의 범위 인자 (하나라도 주면 범위 조회)
+MESSAGE_RANGE_PROPERTIES = {
+    "offset": {"type": "integer", "description": "처음 메시지 위치 (0부터)"},
+    "limit": {"type": "integer", "description": "불러올 메시지 수"},
+    "last": {"type": "integer", "description": "마지막 N개 메시지만 (offset/limit 보다 우선)"},
+    "max_bytes": {"type": "integer", "description": "메시지 직렬화 크기 예산 (바이트)"},
+    "cursor": {"type": "string", "description": "이전 응답의 next_cursor (이어서 불러오기)"}
+}
 
 
 @app.list_tools()
@@ -168,14 +516,15 @@ async def list_tools() -> List[Tool]:
         ),
         Tool(
             name="load_conversation",
-            description="저장된 대화를 불러옵니다",
+            description="저장된 대화를 불러옵니다 (긴 대화는 범위를 지정해 일부만 불러오고 next_cursor 로 이어서)",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "conversation_id": {
                         "type": "string",
                         "description": "불러올 대화 ID"
-                    }
+                    },
+                    **MESSAGE_RANGE_PROPERTIES
                 },
                 "required": ["conversation_id"]
             }
@@ -213,6 +562,11 @@ async def list_tools() -> List[Tool]:
                         "type": "integer",
                         "description": "최대 결과 수 (기본값: 20)",
                         "default": 20
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": list(SEARCH_MODES),
+                        "description": "index: 키워드 (BM25), scan: 부분 문자열, semantic: 비슷한 뜻의 메시지 (PENSIEVE_SEMANTIC=1 필요)"
                     }
                 },
                 "required": ["query"]
@@ -243,6 +597,93 @@ async def list_tools() -> List[Tool]:
                 },
                 "required": ["conversation_id", "messages"]
             }
+        ),
+        Tool(
+            name="save_conversations",
+            description=f"여러 대화를 한 번에 저장합니다 (최대 {MAX_BATCH_ITEMS}개, 항목별 결과 반환)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "conversations": {
+                        "type": "array",
+                        "description": "저장할 대화 목록",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "conversation_id": {"type": "string", "description": "대화 ID (없으면 새로 생성)"},
+                                "messages": {"type": "array", "items": {"type": "object"}},
+                                "metadata": {"type": "object"}
+                            },
+                            "required": ["messages"]
+                        }
+                    }
+                },
+                "required": ["conversations"]
+            }
+        ),
+        Tool(
+            name="load_conversations",
+            description=f"여러 대화를 한 번에 불러옵니다 (최대 {MAX_BATCH_ITEMS}개, 항목별 결과 반환)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "conversation_ids": {
+                        "type": "array",
+                        "description": "불러올 대화 ID 목록",
+                        "items": {"type": "string"}
+                    }
+                },
+                "required": ["conversation_ids"]
+            }
+        ),
+        Tool(
+            name="append_many",
+            description=f"여러 대화에 메시지를 한 번에 추가합니다 (최대 {MAX_BATCH_ITEMS}개, 항목별 결과 반환)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "items": {
+                        "type": "array",
+                        "description": "추가할 목록",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "conversation_id": {"type": "string"},
+                                "messages": {"type": "array", "items": {"type": "object"}}
+                            },
+                            "required": ["conversation_id", "messages"]
+                        }
+                    }
+                },
+                "required": ["items"]
+            }
+        ),
+        Tool(
+            name="retrieve_context",
+            description="검색어와 관련된 메시지를 여러 대화에서 골라 토큰 예산 안에 담아 반환합니다 (대화 전체를 불러오지 않음)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "검색어"
+                    },
+                    "max_tokens": {
+                        "type": "integer",
+                        "description": "반환할 메시지들의 최대 토큰 수 (근사치)",
+                        "default": 2000
+                    }
+                },
+                "required": ["query"]
+            }
+        ),
+        Tool(
+            name="cache_stats",
+            description="대화 캐시 통계(적중/실패/내보냄 횟수, 사용 바이트)를 조회합니다",
+            inputSchema={
+                "type": "object",
+                "properties": {}
+            }
         )
     ]
 
@@ -256,7 +697,7 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             messages = arguments["messages"]
             metadata = arguments.get("metadata", {})
             
-            result = save_conversation(conversation_id, messages, metadata)
+            result = await run_blocking(save_conversation, conversation_id, messages, metadata)
             return [TextContent(
                 type="text",
                 text=f"대화가 저장되었습니다. ID: {result['id']}"
@@ -264,12 +705,16 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             
         elif name == "load_conversation":
             conversation_id = arguments["conversation_id"]
-            conversation = load_conversation(conversation_id)
+            range_arguments = {key: arguments[key] for key in MESSAGE_RANGE_PROPERTIES if arguments.get(key) is not None}
+            if range_arguments:
+                conversation = await run_blocking(load_message_range, conversation_id, **range_arguments)
+            else:
+                conversation = await run_blocking(load_conversation, conversation_id)
             
             if conversation:
                 return [TextContent(
                     type="text",
-                    text=json.dumps(conversation, ensure_ascii=False, indent=2)
+                    text=await run_blocking(json.dumps, conversation, ensure_ascii=False, indent=2)
                 )]
             else:
                 return [TextContent(
@@ -281,7 +726,7 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             limit = arguments.get("limit", 50)
             offset = arguments.get("offset", 0)
             
-            conversations = list_conversations(limit, offset)
+            conversations = await run_blocking(list_conversations, limit, offset)
             return [TextContent(
                 type="text",
                 text=json.dumps(conversations, ensure_ascii=False, indent=2)
@@ -291,7 +736,7 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             query = arguments["query"]
             limit = arguments.get("limit", 20)
             
-            results = search_conversations(query, limit)
+            results = await run_blocking(search_conversations, query, limit, arguments.get("mode"))
             return [TextContent(
                 type="text",
                 text=json.dumps(results, ensure_ascii=False, indent=2)
@@ -301,28 +746,55 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             conversation_id = arguments["conversation_id"]
             new_messages = arguments["messages"]
             
-            # 기존 대화 로드
-            conversation = load_conversation(conversation_id)
-            if not conversation:
+            if await run_blocking(append_to_conversation, conversation_id, new_messages) is None:
                 return [TextContent(
                     type="text",
                     text=f"대화를 찾을 수 없습니다: {conversation_id}"
                 )]
             
-            # 메시지 추가
-            conversation["messages"].extend(new_messages)
-            conversation["updated_at"] = datetime.now().isoformat()
+            return [TextContent(
+                type="text",
+                text=f"대화에 {len(new_messages)}개의 메시지가 추가되었습니다."
+            )]
             
-            # 저장
-            result = save_conversation(
-                conversation_id,
-                conversation["messages"],
-                conversation.get("metadata", {})
-            )
+        elif name == "save_conversations":
+            results = await save_many(arguments["conversations"])
+            return [TextContent(
+                type="text",
+                text=json.dumps(results, ensure_ascii=False, indent=2)
+            )]
             
+        elif name == "load_conversations":
+            results = await load_many(arguments["conversation_ids"])
             return [TextContent(
                 type="text",
-                text=f"대화에 {len(new_messages)}개의 메시지가 추가되었습니다."
+                text=await run_blocking(json.dumps, results, ensure_ascii=False, indent=2)
+            )]
+            
+        elif name == "append_many":
+            results = await append_many(arguments["items"])
+            return [TextContent(
+                type="text",
+                text=json.dumps(results, ensure_ascii=False, indent=2)
+            )]
+            
+        elif name == "retrieve_context":
+            query = arguments["query"]
+            max_tokens = arguments.get("max_tokens", 2000)
+            
+            result = await run_blocking(retrieve_context, query, max_tokens)
+            return [TextContent(
+                type="text",
+                text=json.dumps(result, ensure_ascii=False)
+            )]
+            
+        elif name == "cache_stats":
+            stats = conversation_cache.stats()
+            if vector_index is not None:
+                stats["vector_index"] = vector_index.stats()
+            return [TextContent(
+                type="text",
+                text=json.dumps(stats, ensure_ascii=False, indent=2)
             )]
             
         else:
@@ -340,12 +812,31 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
 
 async def main():
     """서버 실행"""
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            app.create_initialization_options()
-        )
+    # 중단된 저장이 남긴 임시 파일 정리
+    await run_blocking(storage.remove_temp_files, STORAGE_DIR)
+    
+    # 다른 프로세스가 바꾼 파일을 카탈로그와 색인에 반영 (하나가 실패해도 서버는 뜬다)
+    indexes = [catalog, search_index] + ([vector_index] if vector_index is not None else [])
+    for index in indexes:
+        try:
+            await run_blocking(index.sync)
+        except Exception as e:
+            print(f"Error syncing {type(index).__name__}: {e}", file=sys.stderr)
+            if index is vector_index:
+                # 망가진 벡터 색인은 비우고 시작한다 (저장된 뒤 다음 시작 때 다시 임베딩)
+                vector_index.clear()
+    
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await app.run(
+                read_stream,
+                write_stream,
+                app.create_initialization_options()
+            )
+    finally:
+        # 세션 동안 추가된 벡터를 저장 (못 해도 다음 sync 가 다시 임베딩)
+        if vector_index is not None:
+            vector_index.save()
 
 
 if __name__ == "__main__":
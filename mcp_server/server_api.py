@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 import asyncio
+import base64
+import hashlib
+import importlib.util
 import json
 import os
-from typing import Dict, List, Optional, Any
+import random
+import re
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple
+from uuid import uuid4
 import httpx
 from mcp.server import Server
 from mcp.types import Tool, TextContent
@@ -15,13 +25,470 @@ API_TOKEN = os.getenv("PENSIEVE_API_TOKEN", "")
 # 서버 인스턴스
 app = Server("pensieve-mcp")
 
-# HTTP 클라이언트
-async def get_http_client():
-    global API_TOKEN
-    headers = {}
-    if API_TOKEN:
-        headers["Authorization"] = f"Bearer {API_TOKEN}"
-    return httpx.AsyncClient(base_url=API_BASE_URL, headers=headers)
+# HTTP 연결 설정 (초 / 연결 수)
+API_TIMEOUT = float(os.getenv("PENSIEVE_API_TIMEOUT", "30"))
+API_CONNECT_TIMEOUT = float(os.getenv("PENSIEVE_API_CONNECT_TIMEOUT", "5"))
+API_MAX_CONNECTIONS = int(os.getenv("PENSIEVE_API_MAX_CONNECTIONS", "10"))
+API_MAX_KEEPALIVE = int(os.getenv("PENSIEVE_API_MAX_KEEPALIVE", "5"))
+API_KEEPALIVE_EXPIRY = float(os.getenv("PENSIEVE_API_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 는 h2 패키지가 있을 때만 (pip install "pensieve-mcp[http2]")
+API_HTTP2 = (
+    os.getenv("PENSIEVE_API_HTTP2", "1").lower() not in ("0", "false", "no")
+    and importlib.util.find_spec("h2") is not None
+)
+
+class TokenAuth(httpx.Auth):
+    """요청마다 현재 API_TOKEN 을 넣는다 (로그인/토큰 변경 후 클라이언트를 다시 만들 필요 없음)"""
+
+    def auth_flow(self, request):
+        if API_TOKEN:
+            request.headers["Authorization"] = f"Bearer {API_TOKEN}"
+        yield request
+
+# HTTP 클라이언트 (연결을 재사용하도록 프로세스에 하나)
+_http_client: Optional[httpx.AsyncClient] = None
+
+async def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=API_BASE_URL,
+            auth=TokenAuth(),
+            http2=API_HTTP2,
+            timeout=httpx.Timeout(API_TIMEOUT, connect=API_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_KEEPALIVE,
+                keepalive_expiry=API_KEEPALIVE_EXPIRY
+            )
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# 재시도와 서킷 브레이커
+# 멱등 요청(GET/PUT/DELETE)은 연결 오류, 타임아웃, 502/503/504 에서 재시도하고,
+# POST 는 요청이 서버에 닿지 않은 것이 확실할 때(연결 실패)와 429 에서만 재시도한다.
+API_RETRIES = int(os.getenv("PENSIEVE_API_RETRIES", "3"))
+API_BACKOFF_BASE = float(os.getenv("PENSIEVE_API_BACKOFF_BASE", "0.2"))
+API_BACKOFF_MAX = float(os.getenv("PENSIEVE_API_BACKOFF_MAX", "5"))
+# 연속 실패가 이만큼이면 API_BREAKER_COOLDOWN 초 동안 요청을 보내지 않고 바로 실패
+API_BREAKER_THRESHOLD = int(os.getenv("PENSIEVE_API_BREAKER_THRESHOLD", "5"))
+API_BREAKER_COOLDOWN = float(os.getenv("PENSIEVE_API_BREAKER_COOLDOWN", "30"))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+RETRY_STATUS = {502, 503, 504}
+_ID_SEGMENT = re.compile(r"/[0-9a-fA-F-]{16,}(?=/|$)")
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """closed -> (연속 실패) -> open -> (쿨다운) -> half-open 에서 요청 하나로 확인"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def before_request(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half-open" and self.trial_in_flight):
+            remaining = max(self.cooldown - (time.monotonic() - self.opened_at), 0)
+            raise CircuitOpenError(f"API 서버가 응답하지 않습니다. {remaining:.0f}초 후 다시 시도하세요")
+        if state == "half-open":
+            self.trial_in_flight = True
+
+    def record(self, success: bool) -> None:
+        self.trial_in_flight = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker(API_BREAKER_THRESHOLD, API_BREAKER_COOLDOWN)
+
+# "METHOD /경로" -> 요청 통계 (경로의 대화 ID 는 {id} 로 묶는다)
+endpoint_stats: Dict[str, Dict[str, float]] = {}
+
+def _record_stats(endpoint: str, latency: float, error: bool, retries: int) -> None:
+    stats = endpoint_stats.setdefault(
+        endpoint, {"requests": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0}
+    )
+    stats["requests"] += 1
+    stats["errors"] += int(error)
+    stats["retries"] += retries
+    stats["total_ms"] += latency * 1000
+    stats["max_ms"] = max(stats["max_ms"], latency * 1000)
+
+def _backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+    """full jitter 지수 백오프 (Retry-After 가 있으면 따른다)"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), API_BACKOFF_MAX)
+    return random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+
+async def api_request(method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+    """API 요청 (재시도, 서킷 브레이커, 통계 포함)
+
+    재시도해도 실패하면 마지막 응답을 반환하거나 마지막 예외를 다시 던진다.
+    서킷 브레이커에는 재시도 횟수와 관계없이 요청 하나를 최종 결과 하나로 기록한다.
+
+    Args:
+        idempotent: 다시 보내도 안전한 요청인지 (기본값: 메서드로 판단).
+            Idempotency-Key 를 붙인 POST 는 True 로 준다
+    """
+    method = method.upper()
+    endpoint = f"{method} {_ID_SEGMENT.sub('/{id}', url)}"
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    client = await get_http_client()
+    started = time.perf_counter()
+    attempt = 0
+
+    breaker.before_request()
+    try:
+        while True:
+            response: Optional[httpx.Response] = None
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                # 연결 자체가 안 됐으면 POST 도 서버에 닿지 않았다
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= API_RETRIES:
+                    _record_stats(endpoint, time.perf_counter() - started, True, attempt)
+                    breaker.record(False)
+                    raise
+            else:
+                server_error = response.status_code >= 500
+                retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUS)
+                if not retryable or attempt >= API_RETRIES:
+                    _record_stats(endpoint, time.perf_counter() - started, server_error, attempt)
+                    breaker.record(not server_error)
+                    return response
+
+            await asyncio.sleep(_backoff(attempt, response))
+            attempt += 1
+    finally:
+        # 취소 등으로 기록 없이 끝나도 half-open 확인 요청이 영영 끝나지 않은 것으로 남지 않게
+        breaker.trial_in_flight = False
+
+# 읽기 캐시: 마지막으로 받은 대화/목록을 ETag 와 함께 두고 If-None-Match 로 재검증한다
+# (서버가 304 를 주면 본문을 다시 받지 않고 캐시된 것을 쓴다)
+RESPONSE_CACHE_ENTRIES = int(os.getenv("PENSIEVE_CLIENT_CACHE_ENTRIES", "128"))
+RESPONSE_CACHE_BYTES = int(os.getenv("PENSIEVE_CLIENT_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+class ResponseCache:
+    """요청 키 -> (ETag, JSON 본문, 응답 헤더 일부, 바이트) LRU
+
+    항목 수와 바이트 예산(응답 본문 크기 합)을 넘으면 가장 오래 쓰지 않은 것부터 내보낸다.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> tuple:
+        """조건부 GET. (응답, JSON 본문) 반환 (본문은 200/304 일 때만)"""
+        key = url + ("?" + json.dumps(params, sort_keys=True) if params else "")
+        cached = self._entries.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = await api_request("GET", url, params=params, headers=headers)
+
+        if response.status_code == 304 and cached:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            # 304 에는 본문에 딸린 헤더(X-Next-Cursor 등)가 없을 수 있다
+            for name, value in cached[2].items():
+                response.headers.setdefault(name, value)
+            return response, cached[1]
+
+        self.misses += 1
+        self._remove(key)
+        if response.status_code != 200:
+            return response, None
+        data = response.json()
+        etag = response.headers.get("ETag")
+        size = len(response.content)
+        if etag and self.max_entries > 0 and size <= self.max_bytes:
+            extra = {name: response.headers[name] for name in ("X-Next-Cursor",) if name in response.headers}
+            self._entries[key] = (etag, data, extra, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted[3]
+        return response, data
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[3]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "not_modified_hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_BYTES)
+
+# 쓰기 지연 아웃박스 (PENSIEVE_OUTBOX=1)
+# 저장/메시지 추가를 디스크에 먼저 기록하고 바로 응답한 뒤 백그라운드에서 API 로 보낸다.
+# 대화 ID 와 Idempotency-Key 를 클라이언트가 정하므로 같은 쓰기를 여러 번 보내도 한 번만 반영된다.
+OUTBOX_ENABLED = os.getenv("PENSIEVE_OUTBOX", "").lower() in ("1", "true", "yes")
+OUTBOX_DIR = Path(os.getenv("PENSIEVE_OUTBOX_DIR", str(Path.home() / ".pensieve-mcp" / "outbox")))
+OUTBOX_BATCH = int(os.getenv("PENSIEVE_OUTBOX_BATCH", "50"))
+OUTBOX_FLUSH_INTERVAL = float(os.getenv("PENSIEVE_OUTBOX_FLUSH_INTERVAL", "5"))
+
+def token_identity(token: str) -> str:
+    """토큰의 사용자 (JWT 의 uid/sub, 읽을 수 없으면 토큰 해시). 토큰 자체는 디스크에 남기지 않는다"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        subject = claims.get("uid") or claims.get("sub")
+        if subject:
+            return f"user:{subject}"
+    except (IndexError, ValueError, AttributeError):
+        pass
+    return "token:" + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+class Outbox:
+    """쓰기 하나를 파일 하나로 보관하는 디스크 큐 (파일 이름 순서 = 기록 순서)
+
+    쓰기마다 만든 사용자(owner)를 기록하고, 지금 토큰의 사용자와 같은 쓰기만 보낸다.
+    다른 계정의 쓰기는 그 계정으로 다시 로그인할 때까지 남겨 두고, 사용자가 기록되지
+    않은 (이전 버전의) 쓰기는 quarantine 디렉토리로 옮긴다.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.failed_directory = directory / "failed"
+        self.quarantine_directory = directory / "quarantine"
+        self.wakeup = asyncio.Event()
+        self.sent = 0
+        self.failed = 0
+        self.quarantined = 0
+        self.last_error: Optional[str] = None
+        self._sequence = 0
+        # 파일 이름 -> (owner, 대화 ID), 기록 순서. 대기 목록을 볼 때마다 파일을 읽지 않도록 메모리에 둔다
+        self._index: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._load_index()
+
+    def _load_index(self) -> None:
+        if not self.directory.exists():
+            return
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                op = json.loads(path.read_text(encoding="utf-8"))
+                conversation_id = op["conversation_id"]
+            except (ValueError, KeyError) as e:
+                self._move_to_failed(path, f"unreadable entry: {e}")
+                continue
+            except OSError:
+                continue
+            if not op.get("owner"):
+                self._move(path, self.quarantine_directory)
+                self.quarantined += 1
+                print(f"Outbox: quarantined {path.name}: no owner recorded", file=sys.stderr)
+                continue
+            self._index[path.name] = (op["owner"], conversation_id)
+
+    @staticmethod
+    def _write(path: Path, op: Dict[str, Any]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(op, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    async def enqueue(self, op: Dict[str, Any]) -> None:
+        """쓰기를 지금 사용자 이름으로 디스크에 기록 (fsync 후 rename 하므로 반환되면 재시작해도 남아 있다)"""
+        op = {**op, "owner": token_identity(API_TOKEN)}
+        self._sequence = max(self._sequence + 1, time.time_ns())
+        name = f"{self._sequence:020d}-{uuid4().hex[:8]}.json"
+        # fsync 는 이벤트 루프를 막지 않도록 스레드에서
+        await asyncio.to_thread(self._write, self.directory / name, op)
+        self._index[name] = (op["owner"], op["conversation_id"])
+        self.wakeup.set()
+
+    def pending(self, owner: Optional[str] = None) -> List[str]:
+        """대기 중인 쓰기의 파일 이름 (기록 순서). owner 를 주면 그 사용자의 것만"""
+        return [name for name, (op_owner, _) in self._index.items() if owner is None or op_owner == owner]
+
+    def pending_for(self, conversation_id: str) -> int:
+        """지금 사용자가 이 대화에 대해 아직 보내지 않은 쓰기 수"""
+        owner = token_identity(API_TOKEN)
+        return sum(1 for entry in self._index.values() if entry == (owner, conversation_id))
+
+    def _move(self, path: Path, directory: Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        path.replace(directory / path.name)
+        self._index.pop(path.name, None)
+
+    def _move_to_failed(self, path: Path, reason: str) -> None:
+        self._move(path, self.failed_directory)
+        self.failed += 1
+        self.last_error = reason
+        print(f"Outbox: giving up on {path.name}: {reason}", file=sys.stderr)
+
+    async def _send(self, op: Dict[str, Any]) -> httpx.Response:
+        headers = {"Idempotency-Key": op["key"]}
+        if op["op"] == "save":
+            return await api_request(
+                "POST", "/conversations", idempotent=True, headers=headers,
+                json={"messages": op["messages"], "metadata": op.get("metadata", {})}
+            )
+        return await api_request(
+            "POST", f"/conversations/{op['conversation_id']}/messages", idempotent=True, headers=headers,
+            json=op["messages"]
+        )
+
+    async def _send_conversation(self, ops: List[tuple]) -> int:
+        """한 대화의 쓰기를 순서대로 보냄 (하나가 실패하면 뒤의 쓰기는 다음 플러시로 미룬다)"""
+        sent = 0
+        for path, op in ops:
+            # 보내는 도중 다른 계정으로 로그인했으면 멈춘다
+            if token_identity(API_TOKEN) != op["owner"]:
+                break
+            try:
+                response = await self._send(op)
+            except Exception as e:
+                self.last_error = str(e)
+                break
+            if response.status_code == 200:
+                path.unlink(missing_ok=True)
+                self._index.pop(path.name, None)
+                sent += 1
+            elif response.status_code in (401, 429) or response.status_code >= 500:
+                # 로그인 전이거나 일시적인 오류: 그대로 두고 나중에 다시
+                self.last_error = f"{response.status_code}: {response.text[:200]}"
+                break
+            else:
+                # 다시 보내도 성공할 수 없는 요청은 큐를 막지 않도록 옆으로 치운다
+                self._move_to_failed(path, f"{response.status_code}: {response.text[:200]}")
+        return sent
+
+    async def flush(self) -> int:
+        """지금 사용자의 대기 중인 쓰기를 최대 OUTBOX_BATCH 개 보냄. 보낸 개수 반환
+
+        대화별 순서는 지키고, 서로 다른 대화는 동시에 보낸다.
+        """
+        if not API_TOKEN:
+            return 0
+        owner = token_identity(API_TOKEN)
+        groups: Dict[str, List[tuple]] = {}
+        for name in self.pending(owner)[:OUTBOX_BATCH]:
+            path = self.directory / name
+            try:
+                op = json.loads(path.read_text(encoding="utf-8"))
+                conversation_id = op["conversation_id"]
+            except (ValueError, KeyError) as e:
+                self._move_to_failed(path, f"unreadable entry: {e}")
+                continue
+            except FileNotFoundError:
+                self._index.pop(name, None)
+                continue
+            except OSError:
+                continue
+            if op.get("owner") != owner:
+                continue
+            groups.setdefault(conversation_id, []).append((path, op))
+
+        sent = sum(await asyncio.gather(*(self._send_conversation(ops) for ops in groups.values())))
+        self.sent += sent
+        return sent
+
+    async def run(self) -> None:
+        """백그라운드 플러시 루프 (새 쓰기가 들어오거나 OUTBOX_FLUSH_INTERVAL 마다)"""
+        while True:
+            self.wakeup.clear()
+            try:
+                sent = await self.flush()
+            except Exception as e:
+                sent = 0
+                self.last_error = str(e)
+            if sent and self.pending(token_identity(API_TOKEN)):
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), OUTBOX_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        pending = len(self._index)
+        mine = len(self.pending(token_identity(API_TOKEN))) if API_TOKEN else 0
+        return {
+            "directory": str(self.directory),
+            "pending": mine,
+            "pending_other_accounts": pending - mine,
+            "sent": self.sent,
+            "failed": self.failed,
+            "quarantined": self.quarantined,
+            "last_error": self.last_error
+        }
+
+outbox = Outbox(OUTBOX_DIR) if OUTBOX_ENABLED else None
+
+def client_stats() -> Dict[str, Any]:
+    endpoints = {}
+    for endpoint, stats in endpoint_stats.items():
+        endpoints[endpoint] = {
+            **stats,
+            "avg_ms": round(stats["total_ms"] / stats["requests"], 2) if stats["requests"] else 0.0,
+            "total_ms": round(stats["total_ms"], 2),
+            "max_ms": round(stats["max_ms"], 2)
+        }
+    stats = {
+        "circuit": breaker.state,
+        "consecutive_failures": breaker.failures,
+        "endpoints": endpoints,
+        "response_cache": response_cache.stats()
+    }
+    if outbox is not None:
+        stats["outbox"] = outbox.stats()
+    return stats
+
+# load_conversation 의 범위 인자 (하나라도 주면 서버가 그 구간만 보낸다)
+MESSAGE_RANGE_PROPERTIES = {
+    "offset": {"type": "integer", "description": "처음 메시지 위치 (0부터)"},
+    "limit": {"type": "integer", "description": "불러올 메시지 수"},
+    "last": {"type": "integer", "description": "마지막 N개 메시지만 (offset/limit 보다 우선)"},
+    "max_bytes": {"type": "integer", "description": "메시지 직렬화 크기 예산 (바이트)"},
+    "cursor": {"type": "string", "description": "이전 응답의 next_cursor (이어서 불러오기)"}
+}
 
 @app.list_tools()
 async def list_tools() -> List[Tool]:
@@ -55,14 +522,15 @@ async def list_tools() -> List[Tool]:
         ),
         Tool(
             name="load_conversation",
-            description="저장된 대화를 불러옵니다",
+            description="저장된 대화를 불러옵니다 (긴 대화는 범위를 지정해 일부만 불러오고 next_cursor 로 이어서)",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "conversation_id": {
                         "type": "string",
                         "description": "불러올 대화 ID"
-                    }
+                    },
+                    **MESSAGE_RANGE_PROPERTIES
                 },
                 "required": ["conversation_id"]
             }
@@ -80,8 +548,13 @@ async def list_tools() -> List[Tool]:
                     },
                     "offset": {
                         "type": "integer",
-                        "description": "시작 위치 (기본값: 0)",
+                        "description": "시작 위치 (기본값: 0, cursor 를 주면 무시)",
                         "default": 0
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "이전 결과의 next_cursor (다음 페이지 조회). 첫 페이지는 빈 문자열. "
+                                       "주면 {conversations, next_cursor} 를, 주지 않으면 대화 배열을 반환"
                     }
                 }
             }
@@ -131,6 +604,84 @@ async def list_tools() -> List[Tool]:
                 "required": ["conversation_id", "messages"]
             }
         ),
+        Tool(
+            name="retrieve_context",
+            description="검색어와 관련된 메시지를 여러 대화에서 골라 토큰 예산 안에 담아 반환합니다 (대화 전체를 불러오지 않음)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "검색어"
+                    },
+                    "max_tokens": {
+                        "type": "integer",
+                        "description": "반환할 메시지들의 최대 토큰 수 (근사치)",
+                        "default": 2000
+                    }
+                },
+                "required": ["query"]
+            }
+        ),
+        Tool(
+            name="save_conversations",
+            description="여러 대화를 한 번에 저장합니다 (최대 100개, 항목별 결과 반환)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "conversations": {
+                        "type": "array",
+                        "description": "저장할 대화 목록",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "messages": {"type": "array", "items": {"type": "object"}},
+                                "metadata": {"type": "object"}
+                            },
+                            "required": ["messages"]
+                        }
+                    }
+                },
+                "required": ["conversations"]
+            }
+        ),
+        Tool(
+            name="load_conversations",
+            description="여러 대화를 한 번에 불러옵니다 (최대 100개, 항목별 결과 반환)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "conversation_ids": {
+                        "type": "array",
+                        "description": "불러올 대화 ID 목록",
+                        "items": {"type": "string"}
+                    }
+                },
+                "required": ["conversation_ids"]
+            }
+        ),
+        Tool(
+            name="append_many",
+            description="여러 대화에 메시지를 한 번에 추가합니다 (최대 100개, 항목별 결과 반환)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "items": {
+                        "type": "array",
+                        "description": "추가할 목록",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "conversation_id": {"type": "string"},
+                                "messages": {"type": "array", "items": {"type": "object"}}
+                            },
+                            "required": ["conversation_id", "messages"]
+                        }
+                    }
+                },
+                "required": ["items"]
+            }
+        ),
         Tool(
             name="set_api_token",
             description="API 토큰을 설정합니다 (로그인 후 받은 토큰)",
@@ -163,6 +714,14 @@ async def list_tools() -> List[Tool]:
                 "required": ["email", "password"]
             }
         ),
+        Tool(
+            name="client_stats",
+            description="API 요청 통계(엔드포인트별 지연 시간, 오류, 재시도)와 서킷 브레이커 상태를 조회합니다",
+            inputSchema={
+                "type": "object",
+                "properties": {}
+            }
+        ),
         Tool(
             name="register",
             description="새 계정을 등록합니다",
@@ -191,54 +750,69 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
     try:
         if name == "set_api_token":
             API_TOKEN = arguments["token"]
+            response_cache.clear()
+            if outbox is not None:
+                outbox.wakeup.set()
             return [TextContent(
                 type="text",
                 text="API 토큰이 설정되었습니다. 이제 대화를 저장하고 불러올 수 있습니다."
             )]
         
+        elif name == "client_stats":
+            return [TextContent(
+                type="text",
+                text=json.dumps(client_stats(), ensure_ascii=False, indent=2)
+            )]
+        
         elif name == "login":
-            async with httpx.AsyncClient(base_url=API_BASE_URL) as client:
-                response = await client.post(
-                    "/auth/login",
-                    json={
-                        "email": arguments["email"],
-                        "password": arguments["password"]
-                    }
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    API_TOKEN = data["access_token"]
-                    return [TextContent(
-                        type="text",
-                        text=f"로그인 성공! 토큰이 자동으로 설정되었습니다."
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"로그인 실패: {response.text}"
-                    )]
+            response = await api_request(
+                "POST",
+                "/auth/login",
+                json={
+                    "email": arguments["email"],
+                    "password": arguments["password"]
+                }
+            )
+            if response.status_code == 200:
+                data = response.json()
+                API_TOKEN = data["access_token"]
+                response_cache.clear()
+                if outbox is not None:
+                    outbox.wakeup.set()
+                return [TextContent(
+                    type="text",
+                    text=f"로그인 성공! 토큰이 자동으로 설정되었습니다."
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"로그인 실패: {response.text}"
+                )]
 
         elif name == "register":
-            async with httpx.AsyncClient(base_url=API_BASE_URL) as client:
-                response = await client.post(
-                    "/auth/register",
-                    json={
-                        "email": arguments["email"],
-                        "password": arguments["password"]
-                    }
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    API_TOKEN = data["access_token"]
-                    return [TextContent(
-                        type="text",
-                        text=f"회원가입 성공! 토큰이 자동으로 설정되었습니다."
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"회원가입 실패: {response.text}"
-                    )]
+            response = await api_request(
+                "POST",
+                "/auth/register",
+                json={
+                    "email": arguments["email"],
+                    "password": arguments["password"]
+                }
+            )
+            if response.status_code == 200:
+                data = response.json()
+                API_TOKEN = data["access_token"]
+                response_cache.clear()
+                if outbox is not None:
+                    outbox.wakeup.set()
+                return [TextContent(
+                    type="text",
+                    text=f"회원가입 성공! 토큰이 자동으로 설정되었습니다."
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"회원가입 실패: {response.text}"
+                )]
         
         # 나머지 도구들은 인증이 필요
         if not API_TOKEN:
@@ -247,123 +821,279 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
                 text="먼저 로그인하거나 API 토큰을 설정해주세요. login 또는 set_api_token 도구를 사용하세요."
             )]
         
-        client = await get_http_client()
-        async with client:
-            if name == "save_conversation":
-                messages = arguments["messages"]
-                metadata = arguments.get("metadata", {})
-                
-                # 디버그: API 토큰 확인
-                import sys
-                print(f"DEBUG: API_TOKEN exists: {bool(API_TOKEN)}", file=sys.stderr)
-                print(f"DEBUG: API_BASE_URL: {API_BASE_URL}", file=sys.stderr)
+        if name == "save_conversation":
+            messages = arguments["messages"]
+            metadata = arguments.get("metadata", {})
+            
+            if outbox is not None:
+                conversation_id = str(uuid4())
+                await outbox.enqueue({
+                    "op": "save",
+                    "conversation_id": conversation_id,
+                    "key": conversation_id,
+                    "messages": messages,
+                    "metadata": metadata
+                })
+                return [TextContent(
+                    type="text",
+                    text=f"대화가 저장되었습니다 (서버로 전송 대기 중). ID: {conversation_id}"
+                )]
                 
-                response = await client.post(
-                    "/conversations",
-                    json={
-                        "messages": messages,
-                        "metadata": metadata
-                    }
-                )
+            response = await api_request(
+                "POST",
+                "/conversations",
+                json={
+                    "messages": messages,
+                    "metadata": metadata
+                }
+            )
                 
-                print(f"DEBUG: Response status: {response.status_code}", file=sys.stderr)
-                print(f"DEBUG: Response text: {response.text[:200]}", file=sys.stderr)
+            if response.status_code == 200:
+                data = response.json()
+                return [TextContent(
+                    type="text",
+                    text=f"대화가 저장되었습니다. ID: {data['id']}"
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"대화 저장 실패: {response.text}"
+                )]
+            
+        elif name == "load_conversation":
+            conversation_id = arguments["conversation_id"]
+            params = {key: arguments[key] for key in MESSAGE_RANGE_PROPERTIES if arguments.get(key) is not None}
+            response, conversation = await response_cache.get_json(f"/conversations/{conversation_id}", params=params or None)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    return [TextContent(
-                        type="text",
-                        text=f"대화가 저장되었습니다. ID: {data['id']}"
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"대화 저장 실패: {response.text}"
-                    )]
+            if conversation is not None:
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(conversation, ensure_ascii=False, indent=2)
+                )]
+            elif response.status_code == 404 and outbox is not None and outbox.pending_for(conversation_id):
+                return [TextContent(
+                    type="text",
+                    text=f"아직 서버로 전송되지 않은 대화입니다 (대기 중인 쓰기 {outbox.pending_for(conversation_id)}개). 잠시 후 다시 시도하세요."
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"대화를 찾을 수 없습니다: {response.text}"
+                )]
             
-            elif name == "load_conversation":
-                conversation_id = arguments["conversation_id"]
-                response = await client.get(f"/conversations/{conversation_id}")
+        elif name == "list_conversations":
+            limit = arguments.get("limit", 50)
+            offset = arguments.get("offset", 0)
+            params = {"limit": limit, "offset": offset}
+            if arguments.get("cursor"):
+                params["cursor"] = arguments["cursor"]
+                
+            response, conversations = await response_cache.get_json("/conversations", params=params)
                 
-                if response.status_code == 200:
-                    conversation = response.json()
-                    return [TextContent(
-                        type="text",
-                        text=json.dumps(conversation, ensure_ascii=False, indent=2)
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"대화를 찾을 수 없습니다: {response.text}"
-                    )]
+            if conversations is not None:
+                # cursor 를 요청하지 않은 호출은 예전처럼 배열만 돌려준다
+                result = conversations
+                if "cursor" in arguments:
+                    result = {
+                        "conversations": conversations,
+                        "next_cursor": response.headers.get("X-Next-Cursor")
+                    }
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(result, ensure_ascii=False, indent=2)
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"대화 목록 조회 실패: {response.text}"
+                )]
             
-            elif name == "list_conversations":
-                limit = arguments.get("limit", 50)
-                offset = arguments.get("offset", 0)
+        elif name == "search_conversations":
+            query = arguments["query"]
+            limit = arguments.get("limit", 20)
                 
-                response = await client.get(
-                    "/conversations",
-                    params={"limit": limit, "offset": offset}
-                )
+            response = await api_request(
+                "GET",
+                "/conversations/search",
+                params={"query": query, "limit": limit}
+            )
                 
-                if response.status_code == 200:
-                    conversations = response.json()
-                    return [TextContent(
-                        type="text",
-                        text=json.dumps(conversations, ensure_ascii=False, indent=2)
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"대화 목록 조회 실패: {response.text}"
-                    )]
+            if response.status_code == 200:
+                results = response.json()
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(results, ensure_ascii=False, indent=2)
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"검색 실패: {response.text}"
+                )]
             
-            elif name == "search_conversations":
-                query = arguments["query"]
-                limit = arguments.get("limit", 20)
+        elif name == "append_to_conversation":
+            conversation_id = arguments["conversation_id"]
+            messages = arguments["messages"]
+            
+            if outbox is not None:
+                await outbox.enqueue({
+                    "op": "append",
+                    "conversation_id": conversation_id,
+                    "key": str(uuid4()),
+                    "messages": messages
+                })
+                return [TextContent(
+                    type="text",
+                    text=f"대화에 {len(messages)}개의 메시지가 추가되었습니다 (서버로 전송 대기 중)."
+                )]
                 
-                response = await client.get(
-                    "/conversations/search",
-                    params={"query": query, "limit": limit}
-                )
+            response = await api_request(
+                "POST",
+                f"/conversations/{conversation_id}/messages",
+                json=messages
+            )
+                
+            if response.status_code == 200:
+                return [TextContent(
+                    type="text",
+                    text=f"대화에 {len(messages)}개의 메시지가 추가되었습니다."
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"메시지 추가 실패: {response.text}"
+                )]
+            
+        elif name == "retrieve_context":
+            response = await api_request(
+                "GET",
+                "/conversations/context",
+                params={"query": arguments["query"], "max_tokens": arguments.get("max_tokens", 2000)}
+            )
                 
-                if response.status_code == 200:
-                    results = response.json()
-                    return [TextContent(
-                        type="text",
-                        text=json.dumps(results, ensure_ascii=False, indent=2)
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"검색 실패: {response.text}"
-                    )]
+            if response.status_code == 200:
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(response.json(), ensure_ascii=False)
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"맥락 조회 실패: {response.text}"
+                )]
+            
+        elif name == "save_conversations":
+            # 항목마다 ID 를 미리 정해 보내므로 재시도해도 중복 저장되지 않는다
+            conversations = [
+                {
+                    "id": item.get("id") or str(uuid4()),
+                    "messages": item.get("messages"),
+                    "metadata": item.get("metadata", {})
+                }
+                for item in arguments["conversations"]
+            ]
             
-            elif name == "append_to_conversation":
-                conversation_id = arguments["conversation_id"]
-                messages = arguments["messages"]
+            if outbox is not None:
+                for conversation in conversations:
+                    await outbox.enqueue({
+                        "op": "save",
+                        "conversation_id": conversation["id"],
+                        "key": conversation["id"],
+                        "messages": conversation["messages"],
+                        "metadata": conversation["metadata"]
+                    })
+                results = [
+                    {"index": index, "id": conversation["id"], "status": "queued"}
+                    for index, conversation in enumerate(conversations)
+                ]
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(results, ensure_ascii=False, indent=2)
+                )]
+                
+            response = await api_request(
+                "POST",
+                "/batch/conversations",
+                idempotent=True,
+                json={"conversations": conversations}
+            )
                 
-                response = await client.post(
-                    f"/conversations/{conversation_id}/messages",
-                    json=messages
-                )
+            if response.status_code == 200:
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(response.json()["results"], ensure_ascii=False, indent=2)
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"대화 일괄 저장 실패: {response.text}"
+                )]
+            
+        elif name == "load_conversations":
+            response = await api_request(
+                "POST",
+                "/batch/conversations/load",
+                idempotent=True,
+                json={"ids": arguments["conversation_ids"]}
+            )
                 
-                if response.status_code == 200:
-                    return [TextContent(
-                        type="text",
-                        text=f"대화에 {len(messages)}개의 메시지가 추가되었습니다."
-                    )]
-                else:
-                    return [TextContent(
-                        type="text",
-                        text=f"메시지 추가 실패: {response.text}"
-                    )]
+            if response.status_code == 200:
+                results = response.json()["results"]
+                if outbox is not None:
+                    for result in results:
+                        if result["status"] == "not_found" and outbox.pending_for(result["id"]):
+                            result["status"] = "queued"
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(results, ensure_ascii=False, indent=2)
+                )]
+            else:
+                return [TextContent(
+                    type="text",
+                    text=f"대화 일괄 조회 실패: {response.text}"
+                )]
             
+        elif name == "append_many":
+            items = arguments["items"]
+            
+            if outbox is not None:
+                for item in items:
+                    await outbox.enqueue({
+                        "op": "append",
+                        "conversation_id": item["conversation_id"],
+                        "key": str(uuid4()),
+                        "messages": item["messages"]
+                    })
+                results = [
+                    {"index": index, "id": item["conversation_id"], "status": "queued"}
+                    for index, item in enumerate(items)
+                ]
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(results, ensure_ascii=False, indent=2)
+                )]
+                
+            response = await api_request(
+                "POST",
+                "/batch/conversations/messages",
+                json={"items": items}
+            )
+                
+            if response.status_code == 200:
+                return [TextContent(
+                    type="text",
+                    text=json.dumps(response.json()["results"], ensure_ascii=False, indent=2)
+                )]
             else:
                 return [TextContent(
                     type="text",
-                    text=f"알 수 없는 도구: {name}"
+                    text=f"메시지 일괄 추가 실패: {response.text}"
                 )]
+            
+        else:
+            return [TextContent(
+                type="text",
+                text=f"알 수 없는 도구: {name}"
+            )]
                 
     except Exception as e:
         return [TextContent(
@@ -373,12 +1103,23 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
 
 async def main():
     """서버 실행"""
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            app.create_initialization_options()
-        )
+    flusher = asyncio.create_task(outbox.run()) if outbox is not None else None
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await app.run(
+                read_stream,
+                write_stream,
+                app.create_initialization_options()
+            )
+    finally:
+        if flusher is not None:
+            flusher.cancel()
+            # 종료 전에 한 번 더 보내 본다 (못 보낸 쓰기는 디스크에 남아 다음 실행 때 전송)
+            try:
+                await asyncio.wait_for(outbox.flush(), timeout=5)
+            except Exception:
+                pass
+        await close_http_client()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
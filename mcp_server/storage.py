@@ -0,0 +1,496 @@
+"""로컬 대화 파일 저장 형식
+
+대화 하나는 두 파일로 저장된다.
+
+- ``<id>.json`` (또는 압축된 ``<id>.json.gz`` / ``<id>.json.zst``): 대화 전체 스냅샷
+- ``<id>.jsonl``: 스냅샷 이후 추가된 메시지 로그 (한 줄에 append 한 번)
+
+append 는 로그에 한 줄만 덧붙이므로 대화 길이와 무관하게 비용이 일정하다.
+로그가 스냅샷보다 커지면 둘을 합쳐 스냅샷을 다시 쓰고 로그를 지운다
+(compaction). 로그 레코드에는 시작 메시지 위치(start)가 들어 있어서
+compaction 도중 중단되어 이미 합쳐진 레코드가 남아 있어도 중복 적용되지 않는다.
+
+스냅샷을 새로 쓸 때마다 로그 세대(log_generation)를 바꾸고 레코드에 그 세대(gen)를
+적는다. 새 스냅샷을 디스크에 반영한 뒤에 로그를 지우므로, 그 사이에 죽어 남은
+이전 세대의 로그는 읽을 때 무시된다.
+
+스냅샷은 임시 파일에 쓴 뒤 rename 으로 바꿔치기하므로 쓰는 도중 죽어도
+잘린 JSON 파일이 남지 않는다. fsync 는 PENSIEVE_FSYNC 로 고른다.
+
+- ``group`` (기본값): 동시에 들어온 저장들을 한 번의 fsync 묶음으로 처리
+  (group commit). 호출은 자기 묶음이 디스크에 반영된 뒤 반환된다.
+- ``off``: fsync 하지 않음 (rename 으로 원자성만 보장, 대량 가져오기용)
+
+새 스냅샷의 압축 방식은 PENSIEVE_COMPRESSION (``none`` 기본값, ``gzip``,
+``zstd``) 으로 고르며, 읽을 때는 형식에 관계없이 자동으로 처리한다.
+"""
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 압축 방식별 스냅샷 확장자
+SNAPSHOT_SUFFIXES = {
+    "none": ".json",
+    "gzip": ".json.gz",
+    "zstd": ".json.zst",
+}
+LOG_SUFFIX = ".jsonl"
+TEMP_SUFFIX = ".tmp"
+
+# 대화 저장 디렉토리 (서버와 migrate 가 같이 쓴다)
+STORAGE_DIR = Path.home() / ".pensieve-mcp" / "conversations"
+
+FSYNC_MODE = os.getenv("PENSIEVE_FSYNC", "group")
+# group 모드에서 리더가 다른 저장을 더 기다리는 시간 (기본 0: fsync 중 쌓인 것만 묶음)
+FSYNC_WINDOW = float(os.getenv("PENSIEVE_FSYNC_WINDOW_MS", "0")) / 1000
+
+COMPRESSION = os.getenv("PENSIEVE_COMPRESSION", "none")
+if COMPRESSION not in SNAPSHOT_SUFFIXES:
+    raise ValueError(f"Unknown PENSIEVE_COMPRESSION: {COMPRESSION}")
+if COMPRESSION == "zstd" and zstandard is None:
+    raise ImportError("PENSIEVE_COMPRESSION=zstd requires the zstandard package")
+
+# 로그가 이 크기와 스냅샷 크기 중 큰 쪽을 넘으면 compaction
+COMPACT_MIN_BYTES = 256 * 1024
+
+# 스냅샷 문서에 저장하는 로그 세대 키 (읽을 때 빼고 돌려준다)
+GENERATION_KEY = "log_generation"
+
+# 로그 경로 -> (스냅샷 (mtime_ns, size, inode), 세대). append 마다 스냅샷을 읽지 않으려고 기억한다
+_generations: Dict[Path, Tuple[Tuple[int, int, int], Optional[str]]] = {}
+
+
+def _fsync_path(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: Path) -> None:
+    try:
+        _fsync_path(path)
+    except OSError:
+        # 디렉토리 fsync 를 지원하지 않는 플랫폼 (Windows 등)
+        pass
+
+
+class GroupCommit:
+    """동시에 들어온 쓰기의 fsync 를 한 묶음으로 처리
+
+    먼저 도착한 스레드가 리더가 되어 대기 중인 모든 항목을 fsync 하고
+    (rename 할 항목은 rename 한 뒤) 관련 디렉토리를 한 번씩만 fsync 한다.
+    리더가 일하는 동안 도착한 항목은 다음 묶음으로 모인다.
+    """
+
+    def __init__(self, window: float = 0.0):
+        self.window = window
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[Path, Optional[Path]]] = []
+        self._next_batch = 1
+        self._synced_batch = 0
+        self._syncing = False
+        # 실패한 묶음 -> [오류, 아직 오류를 받지 않은 대기 스레드 수]
+        self._errors: Dict[int, List[Any]] = {}
+        self.batches = 0
+        self.items = 0
+
+    def commit(self, path: Path, rename_to: Optional[Path] = None) -> None:
+        """path 를 fsync 하고 (rename_to 가 있으면 그 이름으로 바꾼 뒤) 반환"""
+        with self._cond:
+            self._pending.append((path, rename_to))
+            batch = self._next_batch
+            while self._synced_batch < batch:
+                if not self._syncing:
+                    self._syncing = True
+                    break
+                self._cond.wait()
+            else:
+                failure = self._errors.get(batch)
+                if failure is None:
+                    return
+                failure[1] -= 1
+                if failure[1] == 0:
+                    del self._errors[batch]
+                raise failure[0]
+
+        # 리더: 지금까지 모인 항목을 한 번에 처리
+        if self.window:
+            time.sleep(self.window)
+        with self._cond:
+            items, self._pending = self._pending, []
+            flushed = self._next_batch
+            self._next_batch += 1
+
+        error = None
+        try:
+            directories = set()
+            for item_path, _ in items:
+                _fsync_path(item_path)
+            for item_path, target in items:
+                if target is not None:
+                    os.replace(item_path, target)
+                directories.add((target or item_path).parent)
+            for directory in directories:
+                _fsync_dir(directory)
+        except Exception as e:
+            error = e
+            # rename 되지 못한 임시 파일은 남기지 않는다
+            for item_path, target in items:
+                if target is not None:
+                    try:
+                        item_path.unlink()
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"Error removing {item_path}: {e}", file=sys.stderr)
+
+        with self._cond:
+            self._synced_batch = flushed
+            self._syncing = False
+            self.batches += 1
+            self.items += len(items)
+            if error is not None and len(items) > 1:
+                # 같은 묶음의 다른 스레드가 모두 실패를 받을 때까지 남겨 둔다
+                self._errors[flushed] = [error, len(items) - 1]
+            self._cond.notify_all()
+
+        if error is not None:
+            raise error
+
+
+_group_commit = GroupCommit(FSYNC_WINDOW)
+
+
+def _commit(path: Path, rename_to: Optional[Path] = None) -> None:
+    """FSYNC_MODE 에 따라 파일을 디스크에 반영"""
+    if FSYNC_MODE == "off":
+        if rename_to is not None:
+            os.replace(path, rename_to)
+        return
+    _group_commit.commit(path, rename_to)
+
+
+def fsync_stats() -> Dict[str, Any]:
+    """group commit 통계 (묶음 수, 처리한 쓰기 수)"""
+    return {
+        "mode": FSYNC_MODE,
+        "batches": _group_commit.batches,
+        "items": _group_commit.items
+    }
+
+
+def snapshot_path(storage_dir: Path, conversation_id: str, compression: str = COMPRESSION) -> Path:
+    """새 스냅샷을 쓸 경로"""
+    return storage_dir / f"{conversation_id}{SNAPSHOT_SUFFIXES[compression]}"
+
+
+def _find_snapshot(storage_dir: Path, conversation_id: str) -> Optional[Tuple[Path, os.stat_result]]:
+    """디스크에 있는 스냅샷 (형식이 여러 개면 가장 최근 것)"""
+    found = None
+    for suffix in SNAPSHOT_SUFFIXES.values():
+        path = storage_dir / f"{conversation_id}{suffix}"
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        if found is None or st.st_mtime_ns > found[1].st_mtime_ns:
+            found = (path, st)
+    return found
+
+
+def _compression_of(path: Path) -> str:
+    for compression, suffix in SNAPSHOT_SUFFIXES.items():
+        if compression != "none" and path.name.endswith(suffix):
+            return compression
+    return "none"
+
+
+def _serialize(conversation_data: Dict[str, Any], compression: str) -> bytes:
+    if compression == "none":
+        return json.dumps(conversation_data, ensure_ascii=False, indent=2).encode('utf-8')
+    # 압축할 때는 들여쓰기 없이
+    return json.dumps(conversation_data, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def _decompress(raw: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(raw)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("Reading .json.zst files requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(raw)
+    return raw
+
+
+def _encode(conversation_data: Dict[str, Any], compression: str) -> bytes:
+    return _compress(_serialize(conversation_data, compression), compression)
+
+
+def _decode(raw: bytes, compression: str) -> Dict[str, Any]:
+    return json.loads(_decompress(raw, compression))
+
+
+def log_path(storage_dir: Path, conversation_id: str) -> Path:
+    return storage_dir / f"{conversation_id}{LOG_SUFFIX}"
+
+
+def conversation_ids(storage_dir: Path) -> Iterator[str]:
+    """저장된 모든 대화 ID"""
+    seen = set()
+    for suffix in SNAPSHOT_SUFFIXES.values():
+        for file_path in storage_dir.glob(f"*{suffix}"):
+            conversation_id = file_path.name[:-len(suffix)]
+            if conversation_id not in seen:
+                seen.add(conversation_id)
+                yield conversation_id
+
+
+def signature(storage_dir: Path, conversation_id: str) -> Optional[Tuple[int, int]]:
+    """대화 파일들의 (최종 수정 시각 ns, 전체 바이트). 대화가 없으면 None"""
+    found = _find_snapshot(storage_dir, conversation_id)
+    if found is None:
+        return None
+    mtime_ns, size = found[1].st_mtime_ns, found[1].st_size
+
+    try:
+        log_st = log_path(storage_dir, conversation_id).stat()
+        mtime_ns = max(mtime_ns, log_st.st_mtime_ns)
+        size += log_st.st_size
+    except FileNotFoundError:
+        pass
+
+    return mtime_ns, size
+
+
+def _read_log(path: Path) -> List[Dict[str, Any]]:
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 쓰는 도중 중단된 줄
+                    print(f"Skipping corrupt log record {path}:{line_no}", file=sys.stderr)
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _apply_log(conversation_data: Dict[str, Any], records: List[Dict[str, Any]], generation: Optional[str]) -> None:
+    messages = conversation_data.setdefault("messages", [])
+    for record in records:
+        # 이전 스냅샷에 딸린 로그 (새 스냅샷을 쓰고 로그를 지우기 전에 중단됨)
+        if record.get("gen") != generation:
+            continue
+        # 이미 스냅샷에 합쳐진 부분은 건너뛴다
+        skip = max(len(messages) - record.get("start", len(messages)), 0)
+        messages.extend(record.get("messages", [])[skip:])
+        if record.get("updated_at"):
+            conversation_data["updated_at"] = record["updated_at"]
+
+
+def read_conversation(storage_dir: Path, conversation_id: str) -> Optional[Dict[str, Any]]:
+    """스냅샷과 로그를 합친 대화 문서 반환. 대화가 없으면 None"""
+    loaded = read_conversation_sized(storage_dir, conversation_id)
+    return loaded[0] if loaded is not None else None
+
+
+def read_conversation_sized(storage_dir: Path, conversation_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    """read_conversation 과 같지만 압축을 푼 바이트 수(스냅샷 JSON + 로그)도 함께 반환"""
+    found = _find_snapshot(storage_dir, conversation_id)
+    if found is None:
+        return None
+    try:
+        raw = _decompress(found[0].read_bytes(), _compression_of(found[0]))
+    except FileNotFoundError:
+        return None
+    conversation_data = json.loads(raw)
+    size = len(raw)
+
+    generation = conversation_data.pop(GENERATION_KEY, None)
+    _remember_generation(storage_dir, conversation_id, found[1], generation)
+    path = log_path(storage_dir, conversation_id)
+    records = _read_log(path)
+    if records:
+        try:
+            size += path.stat().st_size
+        except FileNotFoundError:
+            pass
+    _apply_log(conversation_data, records, generation)
+    return conversation_data, size
+
+
+def _snapshot_key(st: os.stat_result) -> Tuple[int, int, int]:
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _remember_generation(storage_dir: Path, conversation_id: str, st: os.stat_result, generation: Optional[str]) -> None:
+    _generations[log_path(storage_dir, conversation_id)] = (_snapshot_key(st), generation)
+
+
+def _log_generation(storage_dir: Path, conversation_id: str) -> Optional[str]:
+    """지금 스냅샷의 로그 세대 (스냅샷이 바뀌지 않았으면 기억해 둔 값)"""
+    found = _find_snapshot(storage_dir, conversation_id)
+    if found is None:
+        return None
+    remembered = _generations.get(log_path(storage_dir, conversation_id))
+    if remembered is not None and remembered[0] == _snapshot_key(found[1]):
+        return remembered[1]
+    generation = _decode(found[0].read_bytes(), _compression_of(found[0])).get(GENERATION_KEY)
+    _remember_generation(storage_dir, conversation_id, found[1], generation)
+    return generation
+
+
+def _write_snapshot(storage_dir: Path, conversation_data: Dict[str, Any], compression: str = COMPRESSION) -> Tuple[Path, int]:
+    """스냅샷을 쓰고 (경로, 압축 전 바이트 수) 반환"""
+    conversation_id = conversation_data["id"]
+    target = snapshot_path(storage_dir, conversation_id, compression)
+    temp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}{TEMP_SUFFIX}")
+    data = _serialize(conversation_data, compression)
+    try:
+        with open(temp, 'wb') as f:
+            f.write(_compress(data, compression))
+        _commit(temp, target)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+    # 다른 형식으로 저장되어 있던 스냅샷 정리
+    for other in SNAPSHOT_SUFFIXES:
+        if other != compression:
+            snapshot_path(storage_dir, conversation_id, other).unlink(missing_ok=True)
+    return target, len(data)
+
+
+def _replace_snapshot(storage_dir: Path, conversation_data: Dict[str, Any], compression: str = COMPRESSION) -> int:
+    """새 세대의 스냅샷을 디스크에 반영한 뒤 이전 로그를 지움 (압축 전 바이트 수 반환)"""
+    conversation_id = conversation_data["id"]
+    generation = os.urandom(8).hex()
+    target, size = _write_snapshot(storage_dir, {**conversation_data, GENERATION_KEY: generation}, compression)
+    _remember_generation(storage_dir, conversation_id, target.stat(), generation)
+    log_path(storage_dir, conversation_id).unlink(missing_ok=True)
+    return size
+
+
+def remove_temp_files(storage_dir: Path, min_age: float = 60.0) -> int:
+    """중단된 저장이 남긴 임시 파일 정리
+
+    다른 서버 프로세스가 쓰는 중인 파일은 건드리지 않도록 min_age 초보다
+    오래된 것만 지운다.
+    """
+    removed = 0
+    now = time.time()
+    for temp in storage_dir.glob(f".*{TEMP_SUFFIX}"):
+        try:
+            if now - temp.stat().st_mtime < min_age:
+                continue
+            temp.unlink()
+            removed += 1
+        except OSError as e:
+            print(f"Error removing {temp}: {e}", file=sys.stderr)
+    return removed
+
+
+def write_conversation(storage_dir: Path, conversation_data: Dict[str, Any], compression: str = COMPRESSION) -> int:
+    """대화 전체를 스냅샷으로 씀 (기존 로그는 버림)
+
+    Returns:
+        압축 전 스냅샷 바이트 수 (캐시 예산 계산용)
+    """
+    return _replace_snapshot(storage_dir, conversation_data, compression)
+
+
+def append_messages(storage_dir: Path, conversation_id: str, messages: List[Dict[str, Any]], start_index: int, updated_at: str) -> int:
+    """대화 로그에 메시지를 덧붙임 (필요하면 compaction)
+
+    Args:
+        start_index: 추가되는 첫 메시지의 위치 (= 기존 메시지 수)
+
+    Returns:
+        덧붙인 로그 바이트 수 (캐시 예산 계산용)
+    """
+    record = {"start": start_index, "messages": messages, "updated_at": updated_at}
+    generation = _log_generation(storage_dir, conversation_id)
+    if generation is not None:
+        record["gen"] = generation
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+
+    path = log_path(storage_dir, conversation_id)
+    with open(path, 'a+b') as f:
+        log_size = f.tell()
+        if log_size:
+            # 이전 쓰기가 줄 중간에서 끊겼다면 새 레코드와 섞이지 않게 줄을 바꾼다
+            f.seek(-1, 2)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+        log_size += len(line)
+    _commit(path)
+
+    found = _find_snapshot(storage_dir, conversation_id)
+    snapshot_size = found[1].st_size if found else 0
+    if log_size > max(snapshot_size, COMPACT_MIN_BYTES):
+        compact(storage_dir, conversation_id)
+    return len(line)
+
+
+def compact(storage_dir: Path, conversation_id: str) -> None:
+    """로그를 스냅샷에 합침"""
+    conversation_data = read_conversation(storage_dir, conversation_id)
+    if conversation_data is None:
+        return
+    # 스냅샷을 먼저 쓰고 로그를 지운다 (중간에 멈추면 남은 로그는 이전 세대라 무시됨)
+    _replace_snapshot(storage_dir, conversation_data)
+
+
+def migrate(storage_dir: Path, compression: str = COMPRESSION) -> Dict[str, int]:
+    """모든 스냅샷을 주어진 압축 방식으로 다시 씀
+
+    수정 시각은 그대로 두므로 카탈로그와 검색 색인을 다시 만들 필요가 없다.
+    추가 로그(.jsonl)는 건드리지 않는다.
+
+    Returns:
+        변환한 대화 수와 변환 전후 스냅샷 바이트 수
+    """
+    stats = {"converted": 0, "bytes_before": 0, "bytes_after": 0}
+    for conversation_id in list(conversation_ids(storage_dir)):
+        found = _find_snapshot(storage_dir, conversation_id)
+        if found is None:
+            continue
+        path, st = found
+        stats["bytes_before"] += st.st_size
+        if _compression_of(path) == compression:
+            stats["bytes_after"] += st.st_size
+            continue
+        try:
+            conversation_data = _decode(path.read_bytes(), _compression_of(path))
+            target, _ = _write_snapshot(storage_dir, conversation_data, compression)
+            os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+            stats["bytes_after"] += target.stat().st_size
+            stats["converted"] += 1
+        except Exception as e:
+            print(f"Error migrating {conversation_id}: {e}", file=sys.stderr)
+    return stats
@@ -0,0 +1,60 @@
+"""검색 텍스트 처리: 토큰화, BM25 점수, 스니펫, 근사 토큰 수
+
+로컬 서버(search_index, context)와 API 서버(api_server/main.py)가 같은 구현을 쓰도록
+한곳에 둔다. API 서버 이미지에도 이 파일만 복사하므로 표준 라이브러리만 사용한다.
+"""
+import math
+import re
+from typing import List
+
+# BM25 파라미터
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 스니펫 길이 (글자 수)
+SNIPPET_CHARS = 160
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """텍스트를 소문자 단어 토큰으로 분리"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def bm25(tf: int, dl: int, idf: float, avgdl: float) -> float:
+    """BM25 단어 점수"""
+    return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl))
+
+
+def idf(doc_count: int, df: int) -> float:
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def make_snippet(text: str, terms: List[str], width: int = SNIPPET_CHARS) -> str:
+    """검색어(토큰)가 처음 나오는 곳 주변의 짧은 발췌"""
+    if len(text) <= width:
+        return text
+
+    lowered = text.lower()
+    positions = [pos for pos in (lowered.find(term) for term in terms) if pos >= 0]
+    start = max(min(positions) - width // 4, 0) if positions else 0
+    end = min(start + width, len(text))
+    start = max(end - width, 0)
+    return ("..." if start else "") + text[start:end] + ("..." if end < len(text) else "")
+
+
+def estimate_tokens(text: str) -> int:
+    """근사 토큰 수: ASCII 는 4글자에 1토큰, 그 밖의 글자(한글 등)는 글자당 1토큰"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / 4) + len(text) - ascii_chars
+
+
+def truncate_to_tokens(text: str, terms: List[str], max_tokens: int) -> str:
+    """검색어 주변을 남기고 max_tokens 안으로 자름"""
+    width = max_tokens * 4
+    snippet = make_snippet(text, terms, width)
+    while width > 0 and estimate_tokens(snippet) > max_tokens:
+        width = width * 3 // 4
+        snippet = make_snippet(text, terms, width)
+    return snippet
@@ -0,0 +1,483 @@
+"""로컬 의미 검색용 메시지 벡터 색인 (NumPy)
+
+메시지마다 길이 1 로 정규화한 벡터 한 줄을 연속된 float32 배열에 담는다.
+검색은 행렬-벡터 곱 한 번(코사인 유사도)과 argpartition 으로 상위 k 개를 고른다.
+메시지 1M 개 x 256 차원이면 약 1 GiB 이다.
+
+전체를 곱하는 비용은 메모리 대역폭에 묶이므로, 벡터가 IVF_MIN_VECTORS 개를 넘으면
+sync() 때 k-means 로 묶음(IVF)을 만들고 검색어와 가까운 IVF_NPROBE 개 묶음만 점수를 매긴다.
+이때부터는 근사 검색이다 (묶음 경계 근처의 메시지를 놓칠 수 있다).
+
+임베딩은 PENSIEVE_EMBEDDING_MODEL 에 모델 이름을 주고 sentence-transformers 가
+설치되어 있으면 그 모델을 CPU 로 돌리고, 아니면 단어와 글자 3-gram 을 해싱한 벡터를 쓴다.
+해싱 벡터는 모델 없이도 "대화를"/"대화" 같은 어형 변화나 철자 차이는 잡지만,
+뜻만 같은 다른 표현은 모델을 써야 잡힌다.
+
+색인은 저장/추가 때 바뀐 메시지만 임베딩하고, 파일(vectors.npz)에는 종료할 때와
+sync() 뒤에 쓴다. 중간에 죽어도 다음 sync() 가 mtime 이 바뀐 대화만 다시 임베딩한다.
+"""
+import functools
+import math
+import os
+import sys
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+from . import storage
+from .search_index import METADATA_INDEX, metadata_text, tokenize
+
+# 해싱 벡터 차원 (모델을 쓰면 모델 차원)
+VECTOR_DIM = int(os.getenv("PENSIEVE_VECTOR_DIM", "256"))
+# 글자 3-gram 특징의 가중치 (단어 특징은 1)
+CHAR_NGRAM_WEIGHT = 0.5
+# 삭제된 행이 이 비율을 넘으면 배열을 압축
+COMPACT_RATIO = 0.25
+# IVF 근사 검색을 쓰기 시작할 벡터 수와 검색할 때 볼 묶음 수
+IVF_MIN_VECTORS = int(os.getenv("PENSIEVE_VECTOR_IVF_MIN", "100000"))
+IVF_NPROBE = int(os.getenv("PENSIEVE_VECTOR_NPROBE", "16"))
+# k-means 학습에 쓸 표본 수와 반복 횟수
+IVF_TRAIN_SAMPLE = 65536
+IVF_ITERATIONS = 8
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _feature_hash(feature: str) -> int:
+    # hash() 는 프로세스마다 달라지므로 저장되는 색인에는 crc32 를 쓴다
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbedder:
+    """단어 + 글자 3-gram 을 부호 있는 해싱으로 고정 차원에 모은 벡터"""
+
+    def __init__(self, dim: int = VECTOR_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def features(self, text: str) -> Dict[str, float]:
+        """특징 -> 가중치 (빈도는 로그로 눌러 긴 메시지의 반복 단어가 벡터를 지배하지 않게 한다)"""
+        words: Counter = Counter()
+        ngrams: Counter = Counter()
+        for token in tokenize(text):
+            words["w:" + token] += 1
+            padded = f" {token} "
+            ngrams.update("c:" + padded[i:i + 3] for i in range(len(padded) - 2))
+        weights = {feature: 1.0 + math.log(count) for feature, count in words.items()}
+        weights.update(
+            (feature, CHAR_NGRAM_WEIGHT * (1.0 + math.log(count))) for feature, count in ngrams.items()
+        )
+        return weights
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, weight in self.features(text).items():
+                h = _feature_hash(feature)
+                rows.append(row)
+                cols.append(h % self.dim)
+                # 최상위 비트를 부호로 써서 충돌한 특징끼리 평균적으로 상쇄되게 한다
+                values.append(-weight if h & 0x80000000 else weight)
+        if rows:
+            np.add.at(vectors, (np.array(rows), np.array(cols)), np.array(values, dtype=np.float32))
+        return normalize(vectors)
+
+
+class ModelEmbedder:
+    """sentence-transformers 모델 (CPU)"""
+
+    def __init__(self, model_name: str):
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"model:{model_name}"
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        vectors = self.model.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False)
+        return normalize(vectors.astype(np.float32))
+
+
+def normalize(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def make_embedder():
+    """PENSIEVE_EMBEDDING_MODEL 이 있으면 모델, 없거나 쓸 수 없으면 해싱"""
+    if np is None:
+        raise ImportError("Semantic search requires numpy (pip install 'pensieve-mcp[semantic]')")
+    model_name = os.getenv("PENSIEVE_EMBEDDING_MODEL")
+    if model_name:
+        if SentenceTransformer is not None:
+            return ModelEmbedder(model_name)
+        print("sentence-transformers is not installed; using hashing vectors", file=sys.stderr)
+    return HashingEmbedder()
+
+
+class VectorIndex:
+    """메시지 벡터를 담은 NumPy 배열과 행 -> (대화, 메시지 위치) 표"""
+
+    def __init__(self, path: Path, storage_dir: Path, embedder):
+        self.path = path
+        self.storage_dir = storage_dir
+        self.embedder = embedder
+        self._lock = threading.RLock()
+        self._reset()
+        self._load()
+
+    def _reset(self) -> None:
+        dim = self.embedder.dim
+        self.size = 0
+        self.dead = 0
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.row_conversation = np.zeros(0, dtype=np.int32)
+        self.row_message = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        # IVF: 묶음 중심, 행별 묶음 번호, 묶음별 행 (학습 때 만든 배열 + 그 뒤에 추가된 행)
+        self.centroids: Optional["np.ndarray"] = None
+        self.row_cluster = np.zeros(0, dtype=np.int32)
+        self.cluster_rows: List["np.ndarray"] = []
+        self.cluster_pending: List[List[int]] = []
+        self.trained_size = 0
+        # 대화 번호 <-> ID (행에는 번호만 저장)
+        self.conversations: List[str] = []
+        self.conversation_numbers: Dict[str, int] = {}
+        self.rows: Dict[str, List[int]] = {}
+        self.mtimes: Dict[str, int] = {}
+        self.dirty = False
+
+    # ---------- 저장/불러오기 ----------
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["embedder"]) != self.embedder.name:
+                    # 임베딩 방식이 바뀌면 모두 다시 임베딩
+                    return
+                vectors = data["vectors"]
+                row_conversation = data["row_conversation"]
+                row_message = data["row_message"]
+                conversations = [str(c) for c in data["conversations"]]
+                mtimes = dict(zip((str(c) for c in data["mtime_ids"]), data["mtime_values"].tolist()))
+                centroids = data["centroids"] if "centroids" in data else None
+                row_cluster = data["row_cluster"] if "row_cluster" in data else None
+        except Exception as e:
+            print(f"Discarding unreadable vector index {self.path}: {e}", file=sys.stderr)
+            return
+
+        self.size = len(vectors)
+        self.vectors = vectors.astype(np.float32, copy=False)
+        self.row_conversation = row_conversation.astype(np.int32, copy=False)
+        self.row_message = row_message.astype(np.int32, copy=False)
+        self.alive = np.ones(self.size, dtype=bool)
+        self.conversations = conversations
+        self.conversation_numbers = {c: i for i, c in enumerate(conversations)}
+        for row, number in enumerate(self.row_conversation.tolist()):
+            self.rows.setdefault(conversations[number], []).append(row)
+        self.mtimes = mtimes
+        if centroids is not None and row_cluster is not None:
+            self.centroids = centroids.astype(np.float32, copy=False)
+            self.row_cluster = row_cluster.astype(np.int32, copy=False)
+            self.trained_size = self.size
+            self._rebuild_clusters()
+        else:
+            # 행 배열은 모두 같은 길이를 유지한다 (_compact/_grow 가 함께 자르고 늘림)
+            self.row_cluster = np.zeros(self.size, dtype=np.int32)
+
+    def save(self) -> None:
+        """살아 있는 행만 파일로 저장 (임시 파일에 쓰고 rename)"""
+        with self._lock:
+            if not self.dirty:
+                return
+            self._compact()
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(temp_path, "wb") as f:
+                np.savez(
+                    f,
+                    embedder=np.array(self.embedder.name),
+                    vectors=self.vectors[:self.size],
+                    row_conversation=self.row_conversation[:self.size],
+                    row_message=self.row_message[:self.size],
+                    conversations=np.array(self.conversations, dtype=str),
+                    # 메시지가 없는 대화도 다시 임베딩하지 않도록 mtime 은 따로 저장
+                    mtime_ids=np.array(list(self.mtimes), dtype=str),
+                    mtime_values=np.array(list(self.mtimes.values()), dtype=np.int64),
+                    **({} if self.centroids is None else {
+                        "centroids": self.centroids,
+                        "row_cluster": self.row_cluster[:self.size]
+                    })
+                )
+            os.replace(temp_path, self.path)
+            self.dirty = False
+
+    def _compact(self) -> None:
+        """삭제된 행을 빼고 배열을 당긴다 (대화 번호도 다시 매김)"""
+        if not self.dead and len(self.conversations) == len(self.rows):
+            return
+        keep = np.flatnonzero(self.alive[:self.size])
+        old_conversations = self.conversations
+        self.conversations = list(self.rows)
+        self.conversation_numbers = {c: i for i, c in enumerate(self.conversations)}
+        remap = np.array(
+            [self.conversation_numbers.get(c, -1) for c in old_conversations] or [0], dtype=np.int32
+        )
+
+        self.vectors = self.vectors[keep]
+        self.row_conversation = remap[self.row_conversation[keep]]
+        self.row_message = self.row_message[keep]
+        self.row_cluster = self.row_cluster[keep]
+        self.size = len(keep)
+        self.alive = np.ones(self.size, dtype=bool)
+        self.dead = 0
+        self.rows = {}
+        for row, number in enumerate(self.row_conversation.tolist()):
+            self.rows.setdefault(self.conversations[number], []).append(row)
+        if self.centroids is not None:
+            self._rebuild_clusters()
+
+    # ---------- IVF ----------
+
+    def _assign(self, vectors: "np.ndarray") -> "np.ndarray":
+        """벡터마다 가장 가까운 묶음 번호"""
+        clusters = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 16384):
+            chunk = vectors[start:start + 16384]
+            clusters[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return clusters
+
+    def _rebuild_clusters(self) -> None:
+        """row_cluster 에서 묶음별 행 배열을 다시 만든다"""
+        order = np.argsort(self.row_cluster[:self.size], kind="stable")
+        bounds = np.searchsorted(self.row_cluster[:self.size][order], np.arange(len(self.centroids) + 1))
+        self.cluster_rows = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        self.cluster_pending = [[] for _ in range(len(self.centroids))]
+
+    def _train(self) -> None:
+        """살아 있는 벡터로 구면 k-means 를 돌려 묶음을 만들고 모든 행을 배정"""
+        self._compact()
+        n = self.size
+        rng = np.random.default_rng(0)
+        sample = self.vectors[:n][np.sort(rng.choice(n, min(n, IVF_TRAIN_SAMPLE), replace=False))]
+        nlist = max(int(math.sqrt(n)), 1)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            # 빈 묶음은 이전 중심을 유지
+            filled = np.linalg.norm(sums, axis=1) > 0
+            centroids[filled] = normalize(sums[filled])
+
+        self.centroids = centroids
+        self.row_cluster = _grow(self._assign(self.vectors[:n]), len(self.vectors))
+        self.trained_size = n
+        self._rebuild_clusters()
+        self.dirty = True
+
+    def _needs_training(self) -> bool:
+        alive = self.size - self.dead
+        if alive < IVF_MIN_VECTORS:
+            return False
+        # 처음이거나 학습 뒤 두 배로 늘었으면 다시 학습
+        return self.centroids is None or alive > 2 * self.trained_size
+
+    # ---------- 색인 갱신 ----------
+
+    def _append(self, conversation_id: str, documents: List[Tuple[int, str]]) -> None:
+        documents = [(index, text) for index, text in documents if text.strip()]
+        if not documents:
+            return
+        vectors = self.embedder.embed([text for _, text in documents])
+
+        needed = self.size + len(documents)
+        if needed > len(self.vectors):
+            # 용량을 두 배씩 늘려 추가가 평균 O(1) 이 되게 한다
+            capacity = max(needed, 2 * len(self.vectors), 1024)
+            self.vectors = _grow(self.vectors, capacity)
+            self.row_conversation = _grow(self.row_conversation, capacity)
+            self.row_message = _grow(self.row_message, capacity)
+            self.alive = _grow(self.alive, capacity)
+            self.row_cluster = _grow(self.row_cluster, capacity)
+
+        number = self.conversation_numbers.get(conversation_id)
+        if number is None:
+            number = self.conversation_numbers[conversation_id] = len(self.conversations)
+            self.conversations.append(conversation_id)
+
+        start, end = self.size, needed
+        self.vectors[start:end] = vectors
+        self.row_conversation[start:end] = number
+        self.row_message[start:end] = [index for index, _ in documents]
+        self.alive[start:end] = True
+        self.rows.setdefault(conversation_id, []).extend(range(start, end))
+        self.size = end
+        if self.centroids is not None:
+            clusters = self._assign(vectors)
+            self.row_cluster[start:end] = clusters
+            for row, cluster in zip(range(start, end), clusters.tolist()):
+                self.cluster_pending[cluster].append(row)
+
+    def _delete(self, conversation_id: str) -> None:
+        rows = self.rows.pop(conversation_id, [])
+        if rows:
+            self.alive[rows] = False
+            self.dead += len(rows)
+        self.mtimes.pop(conversation_id, None)
+        if self.dead > COMPACT_RATIO * max(self.size, 1):
+            self._compact()
+
+    def index_conversation(self, conversation_data: Dict[str, Any], mtime_ns: int) -> None:
+        """대화 전체를 (재)색인"""
+        conversation_id = conversation_data["id"]
+        documents = [(METADATA_INDEX, metadata_text(conversation_data.get("metadata", {})))]
+        documents.extend(
+            (i, message.get("content", ""))
+            for i, message in enumerate(conversation_data.get("messages", []))
+        )
+        with self._lock:
+            self._delete(conversation_id)
+            self._append(conversation_id, documents)
+            self.mtimes[conversation_id] = mtime_ns
+            self.dirty = True
+
+    def add_messages(self, conversation_id: str, messages: List[Dict[str, Any]], start_index: int, mtime_ns: int) -> None:
+        """기존 대화에 추가된 메시지만 색인"""
+        with self._lock:
+            self._append(
+                conversation_id,
+                [(start_index + i, message.get("content", "")) for i, message in enumerate(messages)]
+            )
+            self.mtimes[conversation_id] = mtime_ns
+            self.dirty = True
+
+    def remove(self, conversation_id: str) -> None:
+        with self._lock:
+            self._delete(conversation_id)
+            self.dirty = True
+
+    def clear(self) -> None:
+        """모든 벡터를 버림 (다음 save 가 파일을 덮어쓰고, 다음 sync 가 다시 임베딩)"""
+        with self._lock:
+            self._reset()
+            self.dirty = True
+
+    def sync(self) -> int:
+        """대화 파일과 비교해 바뀐 대화만 다시 임베딩하고 파일에 저장
+
+        Returns:
+            다시 색인하거나 제거한 대화 수
+        """
+        with self._lock:
+            indexed = dict(self.mtimes)
+        changed = 0
+
+        for conversation_id in storage.conversation_ids(self.storage_dir):
+            try:
+                file_signature = storage.signature(self.storage_dir, conversation_id)
+                if file_signature is None:
+                    continue
+                if indexed.pop(conversation_id, None) == file_signature[0]:
+                    continue
+                data = storage.read_conversation(self.storage_dir, conversation_id)
+                if data is None:
+                    continue
+                self.index_conversation(data, file_signature[0])
+                changed += 1
+            except Exception as e:
+                print(f"Error embedding {conversation_id}: {e}", file=sys.stderr)
+
+        for conversation_id in indexed:
+            self.remove(conversation_id)
+            changed += 1
+
+        with self._lock:
+            if self._needs_training():
+                self._train()
+        self.save()
+        return changed
+
+    # ---------- 검색 ----------
+
+    def search(self, query: str, limit: int) -> Optional[List[Tuple[str, int, float]]]:
+        """코사인 유사도가 높은 메시지 limit 개
+
+        Returns:
+            유사도 내림차순 (conversation_id, message_index, score) 목록.
+            message_index 가 METADATA_INDEX 면 제목/태그가 일치한 것.
+            검색어 벡터가 비면 (토큰이 없으면) None.
+        """
+        query_vector = self.embedder.embed([query])[0]
+        if not query_vector.any():
+            return None
+        if limit <= 0:
+            return []
+
+        with self._lock:
+            if self.size == 0:
+                return []
+            if self.centroids is None:
+                rows = None
+                scores = self.vectors[:self.size] @ query_vector
+                if self.dead:
+                    scores[~self.alive[:self.size]] = -np.inf
+            else:
+                rows = self._probe_rows(query_vector)
+                scores = self.vectors[rows] @ query_vector
+            if len(scores) == 0:
+                return []
+
+            k = min(limit, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            results = []
+            for position in top.tolist():
+                score = float(scores[position])
+                if score == -np.inf:
+                    break
+                row = position if rows is None else rows[position]
+                results.append(
+                    (self.conversations[self.row_conversation[row]], int(self.row_message[row]), score)
+                )
+            return results
+
+    def _probe_rows(self, query_vector: "np.ndarray") -> "np.ndarray":
+        """검색어와 가까운 IVF_NPROBE 개 묶음의 살아 있는 행"""
+        centroid_scores = self.centroids @ query_vector
+        nprobe = min(IVF_NPROBE, len(self.centroids))
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe].tolist()
+        rows = np.concatenate(
+            [self.cluster_rows[c] for c in probe]
+            + [np.array(self.cluster_pending[c], dtype=np.int64) for c in probe]
+        )
+        return rows[self.alive[rows]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "embedder": self.embedder.name,
+                "dim": self.embedder.dim,
+                "vectors": self.size - self.dead,
+                "conversations": len(self.rows),
+                "bytes": int(self.vectors[:self.size].nbytes),
+                "ivf_clusters": 0 if self.centroids is None else len(self.centroids)
+            }
+
+
+def _grow(array: "np.ndarray", capacity: int) -> "np.ndarray":
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
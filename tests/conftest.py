@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+API_SERVER_DIR = Path(__file__).resolve().parent.parent / "api_server"
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """MongoDB 대신 mongomock 컬렉션을 쓰는 api_server/main.py (의존성이 없으면 건너뜀)"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    if str(API_SERVER_DIR) not in sys.path:
+        sys.path.insert(0, str(API_SERVER_DIR))
+    main = pytest.importorskip("main")
+
+    db = mongomock_motor.AsyncMongoMockClient()["pensieve"]
+    monkeypatch.setattr(main, "db", db)
+    monkeypatch.setattr(main, "users_collection", db.users)
+    monkeypatch.setattr(main, "conversations_collection", db.conversations)
+    return main
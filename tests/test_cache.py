@@ -0,0 +1,60 @@
+"""cache: 항목 수/바이트 예산과 압축을 푼 크기 기준 계산"""
+from mcp_server import storage
+from mcp_server.cache import ConversationCache
+
+SIGNATURE = (1, 100)
+
+
+def test_evicts_least_recently_used_until_within_byte_budget():
+    cache = ConversationCache(max_entries=10, max_bytes=100)
+    cache.put("a", {"id": "a"}, SIGNATURE, 40)
+    cache.put("b", {"id": "b"}, SIGNATURE, 40)
+    assert cache.get("a", SIGNATURE) is not None  # a 를 최근 사용으로
+
+    cache.put("c", {"id": "c"}, SIGNATURE, 40)
+
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.total_bytes == 80
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entry_limit_and_oversized_entries():
+    cache = ConversationCache(max_entries=2, max_bytes=1000)
+    for name in "abc":
+        cache.put(name, {"id": name}, SIGNATURE, 10)
+    assert len(cache) == 2 and "a" not in cache
+
+    cache.put("huge", {"id": "huge"}, SIGNATURE, 1001)
+    assert "huge" not in cache
+    assert cache.total_bytes == 20
+
+
+def test_replacing_and_invalidating_keep_byte_total_exact():
+    cache = ConversationCache(max_entries=10, max_bytes=1000)
+    cache.put("a", {"id": "a"}, SIGNATURE, 100)
+    cache.put("a", {"id": "a"}, (2, 200), 300)
+    assert cache.total_bytes == 300
+    assert cache.size_of("a") == 300
+
+    # 파일이 바뀌면 (signature 가 다르면) 항목을 버린다
+    assert cache.get("a", SIGNATURE) is None
+    assert cache.total_bytes == 0
+    assert cache.stats()["invalidations"] == 1
+    assert cache.size_of("a") is None
+
+
+def test_budget_uses_decompressed_size_not_file_size(tmp_path):
+    messages = [{"role": "user", "content": "반복되는 내용 " * 200}]
+    written = storage.write_conversation(tmp_path, {"id": "c1", "messages": messages, "metadata": {}}, "gzip")
+    appended = storage.append_messages(tmp_path, "c1", [{"content": "hi"}], 1, "t")
+
+    data, size = storage.read_conversation_sized(tmp_path, "c1")
+    file_size = storage.signature(tmp_path, "c1")[1]
+
+    assert size == written + appended
+    assert size > file_size  # gzip 스냅샷은 디스크에서 훨씬 작다
+
+    cache = ConversationCache(max_entries=10, max_bytes=size)
+    cache.put("c1", data, storage.signature(tmp_path, "c1"), size)
+    assert cache.total_bytes == size
@@ -0,0 +1,159 @@
+"""조건부 GET: API 서버의 ETag/304 와 클라이언트 ResponseCache"""
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+
+from mcp_server import server_api
+
+
+class FakeApi:
+    """api_request 대신 서버처럼 If-None-Match 가 맞으면 304 를 돌려준다"""
+
+    def __init__(self):
+        self.bodies = {}
+        self.calls = []
+
+    async def __call__(self, method, url, params=None, headers=None, **kwargs):
+        self.calls.append(dict(headers or {}))
+        body, extra = self.bodies[url]
+        etag = f'"{len(body)}-{hash(body)}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, content=body.encode(), headers={"ETag": etag, **extra})
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    fake = FakeApi()
+    monkeypatch.setattr(server_api, "api_request", fake)
+    return fake
+
+
+def test_response_cache_reuses_body_on_304(fake_api):
+    cache = server_api.ResponseCache(max_entries=10, max_bytes=1 << 20)
+    fake_api.bodies["/conversations"] = ('[{"id": "a"}]', {"X-Next-Cursor": "next"})
+
+    async def run():
+        first = await cache.get_json("/conversations", {"limit": 1})
+        second = await cache.get_json("/conversations", {"limit": 1})
+        return first, second
+
+    (first, first_data), (second, second_data) = asyncio.run(run())
+
+    assert first.status_code == 200 and second.status_code == 304
+    assert second_data == first_data == [{"id": "a"}]
+    # 304 에 없는 다음 페이지 커서는 캐시에서 되살린다
+    assert second.headers["X-Next-Cursor"] == "next"
+    assert "If-None-Match" not in fake_api.calls[0]
+    assert fake_api.calls[1]["If-None-Match"] == first.headers["ETag"]
+    assert cache.stats()["not_modified_hits"] == 1
+
+
+def test_response_cache_refreshes_changed_body(fake_api):
+    cache = server_api.ResponseCache(max_entries=10, max_bytes=1 << 20)
+    fake_api.bodies["/c"] = ('{"v": 1}', {})
+    asyncio.run(cache.get_json("/c"))
+    fake_api.bodies["/c"] = ('{"v": 22}', {})
+
+    response, data = asyncio.run(cache.get_json("/c"))
+
+    assert response.status_code == 200 and data == {"v": 22}
+    assert cache.total_bytes == len('{"v": 22}')
+
+
+def test_response_cache_evicts_by_entries_and_bytes(fake_api):
+    for name in "abcd":
+        fake_api.bodies[f"/{name}"] = ('"' + name * 98 + '"', {})
+    cache = server_api.ResponseCache(max_entries=3, max_bytes=250)
+
+    async def run(*names):
+        for name in names:
+            await cache.get_json(f"/{name}")
+
+    asyncio.run(run("a", "b", "c"))
+    # 바이트 예산(250)에 100바이트 본문은 둘까지만 들어간다
+    assert list(cache._entries) == ["/b", "/c"] and cache.total_bytes == 200
+
+    cache.max_bytes = 1000
+    asyncio.run(run("b", "d", "a"))
+    # 항목 수 한도에서는 가장 오래 쓰지 않은 /c 가 나간다
+    assert list(cache._entries) == ["/b", "/d", "/a"]
+    assert cache.total_bytes == sum(entry[3] for entry in cache._entries.values())
+
+    fake_api.bodies["/big"] = ('"' + "x" * 2000 + '"', {})
+    asyncio.run(run("big"))
+    assert "/big" not in cache._entries
+
+
+def test_response_cache_does_not_keep_errors(fake_api, monkeypatch):
+    cache = server_api.ResponseCache(max_entries=10, max_bytes=1 << 20)
+    fake_api.bodies["/c"] = ('{"v": 1}', {})
+    asyncio.run(cache.get_json("/c"))
+
+    async def not_found(*args, **kwargs):
+        return httpx.Response(404, json={"detail": "Conversation not found"})
+
+    monkeypatch.setattr(server_api, "api_request", not_found)
+    response, data = asyncio.run(cache.get_json("/c"))
+
+    assert response.status_code == 404 and data is None
+    assert cache.stats()["entries"] == 0 and cache.total_bytes == 0
+
+
+@pytest.fixture
+def client(api):
+    testclient = pytest.importorskip("fastapi.testclient")
+    api.app.dependency_overrides[api.get_current_user] = lambda: {"_id": "u", "email": "u@example.com"}
+    asyncio.run(api.conversations_collection.insert_one({
+        "_id": "c1",
+        "user_id": "u",
+        "messages": [{"role": "user", "content": "hello"}],
+        "metadata": {},
+        "message_count": 1,
+        "preview": "hello",
+        "created_at": datetime(2024, 1, 1),
+        "updated_at": datetime(2024, 1, 1),
+    }))
+    yield api, testclient.TestClient(api.app)
+    api.app.dependency_overrides.clear()
+
+
+def test_conversation_etag_round_trip(client):
+    api, http = client
+
+    first = http.get("/conversations/c1")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and first.json()["_id"] == "c1"
+
+    unchanged = http.get("/conversations/c1", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304 and unchanged.content == b""
+    assert unchanged.headers["ETag"] == etag
+    # 약한 비교이므로 W/ 없는 태그도 맞는다
+    assert http.get("/conversations/c1", headers={"If-None-Match": etag.removeprefix("W/")}).status_code == 304
+
+    asyncio.run(api.conversations_collection.update_one(
+        {"_id": "c1"},
+        {"$push": {"messages": {"role": "assistant", "content": "hi"}},
+         "$set": {"updated_at": datetime(2024, 1, 2), "message_count": 2}}
+    ))
+    changed = http.get("/conversations/c1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert len(changed.json()["messages"]) == 2
+
+
+def test_list_etag_round_trip(client):
+    api, http = client
+
+    first = http.get("/conversations", params={"limit": 10})
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and [item["id"] for item in first.json()] == ["c1"]
+
+    assert http.get("/conversations", params={"limit": 10}, headers={"If-None-Match": etag}).status_code == 304
+    # 다른 계정의 대화는 목록(과 ETag)에 영향을 주지 않는다
+    asyncio.run(api.conversations_collection.insert_one({
+        "_id": "x", "user_id": "v", "messages": [], "metadata": {},
+        "created_at": datetime(2024, 1, 3), "updated_at": datetime(2024, 1, 3)
+    }))
+    assert http.get("/conversations", params={"limit": 10}, headers={"If-None-Match": etag}).status_code == 304
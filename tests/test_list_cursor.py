@@ -0,0 +1,123 @@
+"""API 서버 대화 목록의 keyset 커서"""
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+
+def _conversation(conversation_id, user_id="u", created_at=None, updated_at=None):
+    return {
+        "_id": conversation_id,
+        "user_id": user_id,
+        "messages": [{"role": "user", "content": conversation_id}],
+        "metadata": {},
+        "message_count": 1,
+        "preview": conversation_id,
+        "created_at": created_at,
+        "updated_at": updated_at or created_at,
+    }
+
+
+def _seed(api):
+    docs = [
+        _conversation("a", created_at=datetime(2024, 1, 1)),
+        _conversation("b", created_at=datetime(2024, 1, 2)),
+        _conversation("c", created_at=datetime(2024, 1, 2)),
+        _conversation("d", created_at=datetime(2024, 1, 2)),
+        _conversation("e", created_at=datetime(2024, 1, 3)),
+        _conversation("f", created_at=datetime(2024, 1, 4)),
+        _conversation("g", created_at=datetime(2024, 1, 5)),
+        _conversation("other", user_id="v", created_at=datetime(2024, 1, 3)),
+    ]
+    asyncio.run(api.conversations_collection.insert_many(docs))
+
+
+def _all_pages(api, limit, sort="created_at"):
+    async def collect():
+        pages, cursor = [], None
+        while True:
+            docs, cursor = await api.list_user_conversations("u", limit, cursor=cursor, sort=sort)
+            pages.append([doc["_id"] for doc in docs])
+            if cursor is None:
+                return pages
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 50])
+def test_cursor_pages_cover_everything_once_in_order(api, limit):
+    _seed(api)
+
+    pages = _all_pages(api, limit)
+
+    # created_at 내림차순, 같은 시각이면 _id 내림차순
+    assert [item for page in pages for item in page] == ["g", "f", "e", "d", "c", "b", "a"]
+    assert all(len(page) <= limit for page in pages)
+    assert pages[-1]
+
+
+def test_cursor_is_stable_when_newer_conversations_arrive(api):
+    _seed(api)
+
+    async def run():
+        first, cursor = await api.list_user_conversations("u", 3)
+        # offset 이었다면 새 대화만큼 밀려서 "e" 가 다시 나온다
+        await api.conversations_collection.insert_one(_conversation("new", created_at=datetime(2024, 2, 1)))
+        second, _ = await api.list_user_conversations("u", 3, cursor=cursor)
+        return [doc["_id"] for doc in first], [doc["_id"] for doc in second]
+
+    first, second = asyncio.run(run())
+    assert first == ["g", "f", "e"]
+    assert second == ["d", "c", "b"]
+
+
+def test_cursor_ignores_offset_and_sorts_by_updated_at(api):
+    _seed(api)
+    asyncio.run(api.conversations_collection.update_one({"_id": "a"}, {"$set": {"updated_at": datetime(2024, 3, 1)}}))
+
+    pages = _all_pages(api, 2, sort="updated_at")
+    assert [item for page in pages for item in page][:2] == ["a", "g"]
+
+    async def with_offset():
+        _, cursor = await api.list_user_conversations("u", 2, sort="updated_at")
+        docs, _ = await api.list_user_conversations("u", 2, offset=100, cursor=cursor, sort="updated_at")
+        return [doc["_id"] for doc in docs]
+
+    assert asyncio.run(with_offset()) == ["f", "e"]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "e30"])
+def test_invalid_cursor_is_rejected(api, cursor):
+    with pytest.raises(api.HTTPException) as error:
+        asyncio.run(api.list_user_conversations("u", 2, cursor=cursor))
+    assert error.value.status_code == 400
+
+
+def test_cursor_from_another_sort_is_rejected(api):
+    _seed(api)
+
+    async def run():
+        _, cursor = await api.list_user_conversations("u", 2, sort="created_at")
+        await api.list_user_conversations("u", 2, cursor=cursor, sort="updated_at")
+
+    with pytest.raises(api.HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 400
+
+
+def test_mcp_tool_keeps_array_shape_unless_cursor_requested(api, monkeypatch):
+    _seed(api)
+
+    async def mcp_user(email):
+        return {"_id": "u"}
+
+    monkeypatch.setattr(api, "get_mcp_user", mcp_user)
+    tool = getattr(api.list_conversations, "fn", api.list_conversations)
+
+    plain = json.loads(asyncio.run(tool("user@example.com", limit=2)))
+    assert [item["id"] for item in plain] == ["g", "f"]
+
+    paged = json.loads(asyncio.run(tool("user@example.com", limit=2, cursor="")))
+    assert [item["id"] for item in paged["conversations"]] == ["g", "f"]
+    following = json.loads(asyncio.run(tool("user@example.com", limit=2, cursor=paged["next_cursor"])))
+    assert [item["id"] for item in following["conversations"]] == ["e", "d"]
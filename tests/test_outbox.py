@@ -0,0 +1,140 @@
+"""server_api 의 쓰기 지연 아웃박스"""
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+
+from mcp_server import server_api
+
+
+def _token(uid):
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+    return f"{part({'alg': 'HS256'})}.{part({'sub': f'{uid}@example.com', 'uid': uid})}.signature"
+
+
+class FakeApi:
+    """Outbox._send 대신 호출 순서를 기록하고 정해진 상태 코드를 돌려준다"""
+
+    def __init__(self, status_codes=None):
+        self.sent = []
+        self.status_codes = status_codes or {}
+
+    async def __call__(self, op):
+        self.sent.append((op["key"], server_api.API_TOKEN))
+        return httpx.Response(self.status_codes.get(op["key"], 200), text="")
+
+
+@pytest.fixture
+def login(monkeypatch):
+    def set_user(uid):
+        monkeypatch.setattr(server_api, "API_TOKEN", _token(uid) if uid else "")
+    set_user("alice")
+    return set_user
+
+
+def _append(conversation_id, key):
+    return {"op": "append", "conversation_id": conversation_id, "key": key, "messages": [{"content": key}]}
+
+
+def _outbox(tmp_path, api):
+    outbox = server_api.Outbox(tmp_path)
+    outbox._send = api
+    return outbox
+
+
+def test_enqueue_persists_with_owner_but_never_the_token(tmp_path, login):
+    outbox = _outbox(tmp_path, FakeApi())
+    asyncio.run(outbox.enqueue(_append("c1", "k1")))
+
+    (path,) = tmp_path.glob("*.json")
+    stored = json.loads(path.read_text(encoding="utf-8"))
+    assert stored["owner"] == "user:alice"
+    assert server_api.API_TOKEN not in path.read_text(encoding="utf-8")
+    assert outbox.pending_for("c1") == 1
+
+    # 재시작해도 디스크에서 대기열을 다시 읽는다
+    assert server_api.Outbox(tmp_path).pending() == [path.name]
+
+
+def test_flush_keeps_order_per_conversation_and_empties_queue(tmp_path, login):
+    api = FakeApi()
+    outbox = _outbox(tmp_path, api)
+
+    async def run():
+        for key in ("a1", "b1", "a2", "b2", "a3"):
+            await outbox.enqueue(_append(key[0], key))
+        return await outbox.flush()
+
+    assert asyncio.run(run()) == 5
+    keys = [key for key, _ in api.sent]
+    assert [key for key in keys if key[0] == "a"] == ["a1", "a2", "a3"]
+    assert [key for key in keys if key[0] == "b"] == ["b1", "b2"]
+    assert outbox.pending() == [] and not list(tmp_path.glob("*.json"))
+    assert outbox.stats()["sent"] == 5
+
+
+def test_only_the_logged_in_accounts_writes_are_sent(tmp_path, login):
+    api = FakeApi()
+    outbox = _outbox(tmp_path, api)
+    asyncio.run(outbox.enqueue(_append("c1", "alice-1")))
+    login("bob")
+    asyncio.run(outbox.enqueue(_append("c1", "bob-1")))
+
+    assert outbox.pending_for("c1") == 1
+    assert asyncio.run(outbox.flush()) == 1
+    assert api.sent == [("bob-1", _token("bob"))]
+    assert outbox.stats()["pending_other_accounts"] == 1
+
+    # 다시 로그인한 계정의 쓰기는 그 토큰으로 보낸다
+    login("alice")
+    assert asyncio.run(outbox.flush()) == 1
+    assert api.sent[-1] == ("alice-1", _token("alice"))
+    assert outbox.pending() == []
+
+
+def test_flush_waits_for_login(tmp_path, login):
+    api = FakeApi()
+    outbox = _outbox(tmp_path, api)
+    asyncio.run(outbox.enqueue(_append("c1", "k1")))
+    login(None)
+
+    assert asyncio.run(outbox.flush()) == 0
+    assert api.sent == []
+
+
+def test_entries_without_owner_are_quarantined(tmp_path, login):
+    legacy = tmp_path / "00000000000000000001-legacy.json"
+    legacy.write_text(json.dumps(_append("c1", "legacy")), encoding="utf-8")
+    api = FakeApi()
+
+    outbox = _outbox(tmp_path, api)
+    asyncio.run(outbox.flush())
+
+    assert api.sent == []
+    assert (tmp_path / "quarantine" / legacy.name).exists()
+    assert outbox.stats()["quarantined"] == 1
+
+
+def test_transient_error_stops_the_conversation_and_permanent_error_sets_it_aside(tmp_path, login):
+    api = FakeApi({"a1": 503, "b1": 400})
+    outbox = _outbox(tmp_path, api)
+
+    async def run():
+        for key in ("a1", "a2", "b1", "b2"):
+            await outbox.enqueue(_append(key[0], key))
+        return await outbox.flush()
+
+    assert asyncio.run(run()) == 1
+    # a1 이 일시적으로 실패하면 a2 는 보내지 않고 둘 다 남는다
+    assert "a2" not in [key for key, _ in api.sent]
+    assert outbox.pending_for("a") == 2
+    # b1 은 failed/ 로 옮기고 b2 는 보낸다
+    assert len(list((tmp_path / "failed").glob("*.json"))) == 1
+    assert outbox.pending_for("b") == 0
+
+    api.status_codes = {}
+    assert asyncio.run(outbox.flush()) == 2
+    assert [key for key, _ in api.sent][-2:] == ["a1", "a2"]
@@ -0,0 +1,85 @@
+"""scan: 조각 병렬 스캔의 결과 순서와 조기 종료"""
+from concurrent.futures import Future
+
+import pytest
+
+from mcp_server import scan, storage
+
+
+def _write(storage_dir, count=60):
+    # 대화 3개 중 하나는 메시지, 5개 중 하나는 메타데이터에 검색어가 있다
+    for i in range(count):
+        storage.write_conversation(storage_dir, {
+            "id": f"conv-{i:04d}",
+            "messages": [{"role": "user", "content": "needle here" if i % 3 == 0 else f"message {i}"}],
+            "metadata": {"tags": ["needle"] if i % 5 == 0 else []},
+            "created_at": "2024-01-01T00:00:00",
+            "updated_at": "2024-01-01T00:00:00",
+        })
+
+
+def _sequential(storage_dir, query, limit):
+    ids = sorted(storage.conversation_ids(storage_dir))
+    return scan.scan_shard(storage_dir, ids, query.lower(), limit)
+
+
+@pytest.fixture
+def process_pool():
+    yield
+    if scan._pool is not None:
+        scan._pool.shutdown(wait=True, cancel_futures=True)
+        scan._pool = None
+        scan._pool_workers = 0
+
+
+@pytest.mark.parametrize("limit", [1, 7, 1000])
+def test_parallel_scan_matches_sequential_order(tmp_path, monkeypatch, process_pool, limit):
+    _write(tmp_path)
+    monkeypatch.setattr(scan, "PARALLEL_MIN_CONVERSATIONS", 10)
+
+    results = scan.scan(tmp_path, "NEEDLE", limit=limit, workers=2)
+
+    expected = _sequential(tmp_path, "needle", limit)
+    assert [item["id"] for item in results] == [item["id"] for item in expected]
+    assert results == expected
+    assert len(results) == min(limit, 28)
+    assert scan._pool is not None
+
+
+class InlinePool:
+    """앞의 started 개 조각만 바로 실행하고 나머지는 시작 전 상태로 두는 가짜 풀"""
+
+    def __init__(self, started):
+        self.started = started
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        if len(self.futures) < self.started:
+            future.set_running_or_notify_cancel()
+            future.set_result(fn(*args))
+        self.futures.append(future)
+        return future
+
+
+def test_limit_reached_early_cancels_remaining_shards(tmp_path, monkeypatch):
+    _write(tmp_path)
+    pool = InlinePool(started=2)
+    monkeypatch.setattr(scan, "PARALLEL_MIN_CONVERSATIONS", 10)
+    monkeypatch.setattr(scan, "_get_pool", lambda workers: pool)
+
+    results = scan.scan(tmp_path, "needle", limit=3, workers=2)
+
+    assert results == _sequential(tmp_path, "needle", 3)
+    assert len(pool.futures) == 2 * scan.SHARDS_PER_WORKER
+    assert all(future.done() and not future.cancelled() for future in pool.futures[:2])
+    assert all(future.cancelled() for future in pool.futures[2:])
+
+
+def test_small_or_single_worker_scan_stays_in_process(tmp_path, monkeypatch):
+    _write(tmp_path, count=20)
+    monkeypatch.setattr(scan, "_get_pool", lambda workers: pytest.fail("pool should not be used"))
+
+    assert scan.scan(tmp_path, "needle", limit=100, workers=4) == _sequential(tmp_path, "needle", 100)
+    monkeypatch.setattr(scan, "PARALLEL_MIN_CONVERSATIONS", 1)
+    assert scan.scan(tmp_path, "needle", limit=100, workers=1) == _sequential(tmp_path, "needle", 100)
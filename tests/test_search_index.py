@@ -0,0 +1,103 @@
+"""search_index: numpy 배열 점수 계산과 SQLite 점수 계산의 결과가 같은지"""
+import random
+import sqlite3
+import time
+
+import pytest
+
+from mcp_server import search_index
+
+np = pytest.importorskip("numpy")
+
+WORDS = ["memory", "storage", "conversation", "search", "index", "python", "tomato", "cache", "한국어", "검색"]
+QUERIES = ["memory", "storage search", "tomato cache python", "한국어 검색", "conversation", "missing"]
+
+
+def _conversation(rng, conversation_id, message_count):
+    return {
+        "id": conversation_id,
+        "messages": [
+            {"role": "user", "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 30)))}
+            for _ in range(message_count)
+        ],
+        "metadata": {"title": " ".join(rng.choices(WORDS, k=2)), "tags": [rng.choice(WORDS)]},
+    }
+
+
+def _same(a, b):
+    """(대화, 메시지) 순서가 같고 점수가 부동소수 오차 안에서 같은지"""
+    return len(a) == len(b) and all(
+        x[:2] == y[:2] and x[2] == pytest.approx(y[2], rel=1e-9) for x, y in zip(a, b)
+    )
+
+
+def _assert_numpy_matches_sqlite(index, monkeypatch):
+    for query in QUERIES:
+        for limit in (1, 5, 1000):
+            with_arrays = (index.search(query, limit), index.search_messages(query, limit))
+            with monkeypatch.context() as patched:
+                patched.setattr(search_index, "np", None)
+                without = (index.search(query, limit), index.search_messages(query, limit))
+            assert _same(with_arrays[0], without[0]), (query, limit)
+            assert _same(with_arrays[1], without[1]), (query, limit)
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = random.Random(7)
+    index = search_index.SearchIndex(tmp_path / "index.sqlite3", tmp_path)
+    for i in range(120):
+        index.index_conversation(_conversation(rng, f"c{i:04d}", rng.randint(0, 6)), 0)
+    return index
+
+
+def test_numpy_scores_match_sqlite(index, monkeypatch):
+    _assert_numpy_matches_sqlite(index, monkeypatch)
+    assert index._arrays is not None
+    assert index.search("memory", 5)
+
+
+def test_numpy_scores_match_after_incremental_changes(index, monkeypatch):
+    index.search("memory", 5)
+    rng = random.Random(8)
+    for i in range(120, 150):
+        index.index_conversation(_conversation(rng, f"c{i:04d}", 4), 0)
+    for i in range(0, 20):
+        index.remove(f"c{i:04d}")
+    for i in range(20, 30):
+        index.index_conversation(_conversation(rng, f"c{i:04d}", 2), 0)
+    index.add_messages("c0050", [{"role": "user", "content": "tomato tomato memory"}], 100, 0)
+
+    # 병합 전(대기 중인 추가분이 있는 상태)과 병합 후 모두 같아야 한다
+    assert index._arrays.pending_count or index._arrays.dead
+    _assert_numpy_matches_sqlite(index, monkeypatch)
+    index._arrays.merge()
+    _assert_numpy_matches_sqlite(index, monkeypatch)
+
+    index.rebuild()
+    _assert_numpy_matches_sqlite(index, monkeypatch)
+
+
+def test_external_write_falls_back_to_sqlite_until_reloaded(index, tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, "ARRAYS_RELOAD_DELAY", 0.05)
+    index.search("memory", 5)
+    assert index._arrays is not None
+
+    # 다른 프로세스가 색인을 바꾼 것처럼 별도 연결로 지운다
+    other = sqlite3.connect(str(tmp_path / "index.sqlite3"))
+    other.execute("DELETE FROM postings WHERE conversation_id = 'c0001'")
+    other.commit()
+    other.close()
+
+    assert index._posting_arrays() is None
+    with monkeypatch.context() as patched:
+        patched.setattr(search_index, "np", None)
+        expected = index.search_messages("memory", 1000)
+    assert _same(index.search_messages("memory", 1000), expected)
+
+    deadline = time.monotonic() + 5
+    while index._reload_thread is not None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert index._posting_arrays() is not None
+    assert all(conversation_id != "c0001" for conversation_id, _, _ in index.search_messages("memory", 1000))
+    _assert_numpy_matches_sqlite(index, monkeypatch)
@@ -0,0 +1,112 @@
+"""storage: 스냅샷 + JSONL 로그, 로그 세대, compaction 복구"""
+import json
+import shutil
+
+from mcp_server import storage
+
+
+def _save(storage_dir, conversation_id="c1", count=2):
+    data = {
+        "id": conversation_id,
+        "messages": [{"role": "user", "content": f"m{i}"} for i in range(count)],
+        "metadata": {},
+        "created_at": "2024-01-01T00:00:00",
+        "updated_at": "2024-01-01T00:00:00",
+    }
+    storage.write_conversation(storage_dir, data)
+    return data
+
+
+def _contents(data):
+    return [message["content"] for message in data["messages"]]
+
+
+def _log_records(storage_dir, conversation_id="c1"):
+    lines = storage.log_path(storage_dir, conversation_id).read_text(encoding="utf-8").splitlines()
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def test_append_goes_to_log_stamped_with_snapshot_generation(tmp_path):
+    _save(tmp_path)
+    storage.append_messages(tmp_path, "c1", [{"role": "assistant", "content": "m2"}], 2, "2024-01-02T00:00:00")
+
+    snapshot = json.loads(storage.snapshot_path(tmp_path, "c1", "none").read_text(encoding="utf-8"))
+    assert _contents(snapshot) == ["m0", "m1"]
+    (record,) = _log_records(tmp_path)
+    assert record["gen"] == snapshot[storage.GENERATION_KEY]
+
+    data = storage.read_conversation(tmp_path, "c1")
+    assert _contents(data) == ["m0", "m1", "m2"]
+    assert data["updated_at"] == "2024-01-02T00:00:00"
+    assert storage.GENERATION_KEY not in data
+
+
+def test_log_left_by_crash_after_rewrite_is_ignored(tmp_path):
+    _save(tmp_path)
+    storage.append_messages(tmp_path, "c1", [{"role": "user", "content": "old"}], 2, "2024-01-02T00:00:00")
+    stale_log = tmp_path / "stale.jsonl"
+    shutil.copy(storage.log_path(tmp_path, "c1"), stale_log)
+
+    # 새 스냅샷을 쓴 뒤 로그를 지우기 전에 죽은 상황: 이전 세대의 로그가 남아 있다
+    _save(tmp_path, count=1)
+    shutil.copy(stale_log, storage.log_path(tmp_path, "c1"))
+
+    assert _contents(storage.read_conversation(tmp_path, "c1")) == ["m0"]
+
+    # 새 세대로 추가한 레코드는 적용된다
+    storage.append_messages(tmp_path, "c1", [{"role": "user", "content": "new"}], 1, "2024-01-03T00:00:00")
+    assert _contents(storage.read_conversation(tmp_path, "c1")) == ["m0", "new"]
+
+
+def test_interrupted_compaction_does_not_duplicate_messages(tmp_path):
+    _save(tmp_path)
+    storage.append_messages(tmp_path, "c1", [{"role": "user", "content": "m2"}], 2, "2024-01-02T00:00:00")
+    log_copy = tmp_path / "log.copy"
+    shutil.copy(storage.log_path(tmp_path, "c1"), log_copy)
+
+    storage.compact(tmp_path, "c1")
+    assert not storage.log_path(tmp_path, "c1").exists()
+    # compaction 이 로그를 지우기 전에 멈췄다면
+    shutil.copy(log_copy, storage.log_path(tmp_path, "c1"))
+
+    assert _contents(storage.read_conversation(tmp_path, "c1")) == ["m0", "m1", "m2"]
+
+
+def test_legacy_files_without_generation_use_start_index(tmp_path):
+    # 세대가 없던 때의 스냅샷과 로그: start 로 이미 합쳐진 메시지를 건너뛴다
+    snapshot = {"id": "c1", "messages": [{"content": "m0"}, {"content": "m1"}], "metadata": {}}
+    storage.snapshot_path(tmp_path, "c1", "none").write_text(json.dumps(snapshot), encoding="utf-8")
+    records = [
+        {"start": 1, "messages": [{"content": "m1"}], "updated_at": "t1"},
+        {"start": 2, "messages": [{"content": "m2"}], "updated_at": "t2"},
+    ]
+    storage.log_path(tmp_path, "c1").write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+
+    assert _contents(storage.read_conversation(tmp_path, "c1")) == ["m0", "m1", "m2"]
+
+
+def test_torn_log_line_is_skipped_and_next_append_still_reads(tmp_path):
+    _save(tmp_path)
+    with open(storage.log_path(tmp_path, "c1"), "a", encoding="utf-8") as f:
+        f.write('{"start": 2, "messa')
+
+    storage.append_messages(tmp_path, "c1", [{"role": "user", "content": "m2"}], 2, "2024-01-02T00:00:00")
+
+    assert _contents(storage.read_conversation(tmp_path, "c1")) == ["m0", "m1", "m2"]
+
+
+def test_log_is_compacted_once_it_outgrows_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "COMPACT_MIN_BYTES", 0)
+    _save(tmp_path, count=1)
+    big = [{"role": "user", "content": "x" * 4096}]
+
+    storage.append_messages(tmp_path, "c1", big, 1, "2024-01-02T00:00:00")
+
+    assert not storage.log_path(tmp_path, "c1").exists()
+    data = storage.read_conversation(tmp_path, "c1")
+    assert len(data["messages"]) == 2
+    assert data["updated_at"] == "2024-01-02T00:00:00"
+    # compaction 뒤의 추가는 새 세대로 기록된다
+    storage.append_messages(tmp_path, "c1", [{"role": "user", "content": "m2"}], 2, "2024-01-03T00:00:00")
+    assert _contents(storage.read_conversation(tmp_path, "c1"))[-1] == "m2"
+